@@ -14,7 +14,7 @@ version = 0.1
 
 # (list) Source files to include (let empty to include all the files
 # in the current directory)
-source.include_exts = py,png,jpg,mp3,wav,kv,xml,json
+source.include_exts = py,png,jpg,mp3,wav,kv,xml,json,onnx
 
 # (list) List of inclusions using pattern matching
 # This option allows to select which files to include in the apk
@@ -27,6 +27,9 @@ source.include_exts = py,png,jpg,mp3,wav,kv,xml,json
 # by matching them against a list of patterns. Default to []
 # source.exclude_patterns = .git/*,.buildozer/*
 
+# (list) List of directory to exclude (let empty to not exclude anything)
+source.exclude_dirs = tools, tests
+
 # (list) Application requirements
 # comma separated list of packages
 # These will be installed by pip in the target machine
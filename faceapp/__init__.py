@@ -0,0 +1 @@
+"""Support modules for the FaceApp attendance kiosk (gallery, recognition)."""
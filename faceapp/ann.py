@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import copy
+import math
+from pathlib import Path
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+# ---------------------------------------------------------------------------
+# Approximate nearest-neighbour index (PCA + inverted file)
+# ---------------------------------------------------------------------------
+
+
+class RecallStats:
+    """Running comparison of ANN answers against exact search.
+
+    Only audited queries (every ``audit_every``-th one) pay for the exact
+    search, so the estimate stays cheap enough to keep on in production.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.audited = 0
+        self.top1_agree = 0
+        self.nn_found = 0
+        self.ann_ms = 0.0
+        self.exact_ms = 0.0
+
+    @property
+    def top1_recall(self) -> float:
+        """Share of audited queries whose ANN identity equals the exact one."""
+        return self.top1_agree / self.audited if self.audited else 1.0
+
+    @property
+    def nn_recall(self) -> float:
+        """Share of audited queries whose exact nearest sample was shortlisted."""
+        return self.nn_found / self.audited if self.audited else 1.0
+
+    def as_dict(self) -> dict:
+        """Snapshot for logging / the UI."""
+        audited = max(self.audited, 1)
+        return {
+            "queries": self.queries,
+            "audited": self.audited,
+            "top1_recall": round(self.top1_recall, 4),
+            "nn_recall": round(self.nn_recall, 4),
+            "ann_ms": round(self.ann_ms / audited, 3),
+            "exact_ms": round(self.exact_ms / audited, 3),
+        }
+
+
+class IVFIndex:
+    """Inverted-file index over PCA-reduced LBP histograms.
+
+    Histograms are square-rooted first (Hellinger embedding), which makes
+    Euclidean distance a close proxy for the chi-square distance LBPH uses.
+    PCA then reduces them to *dims* components and k-means splits the
+    gallery into ``~4*sqrt(N)`` cells. A query probes its *nprobe* nearest
+    cells, keeps the *rerank* closest samples in PCA space and returns them
+    for exact chi-square re-scoring, so search cost grows with
+    ``sqrt(N)`` instead of ``N``.
+
+    New samples are projected and appended to their nearest cell; the
+    PCA basis and cells are retrained once the gallery has doubled since the
+    last training.
+    """
+
+    def __init__(
+        self,
+        dims: int = 64,
+        nprobe: int = 16,
+        rerank: int = 64,
+        train_sample: int = 4096,
+        audit_every: int = 50,
+    ):
+        self.dims = dims
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.train_sample = train_sample
+        self.audit_every = audit_every
+        self.stats = RecallStats()
+        self._basis: Optional[np.ndarray] = None  # (dims, D)
+        self._offset: Optional[np.ndarray] = None  # basis @ mean, (dims, 1)
+        self._centroids: Optional[np.ndarray] = None  # (nlist, dims)
+        self._cells: List[np.ndarray] = []
+        self._proj = np.empty((0, dims), dtype=np.float32)
+        self._count = 0
+        self._trained_count = 0
+
+    @property
+    def trained(self) -> bool:
+        return self._centroids is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def needs_retrain(self, gallery_size: int) -> bool:
+        """True once the gallery has doubled since the last training."""
+        return not self.trained or gallery_size >= 2 * self._trained_count
+
+    def fork(self) -> "IVFIndex":
+        """Returns a copy that can be appended to/retrained independently.
+
+        Projections are shared the same way as :meth:`GalleryMatcher.fork`;
+        cell lists are copied (appends replace the per-cell arrays) and the
+        recall statistics keep accumulating in one place.
+        """
+        clone = copy.copy(self)
+        clone._cells = list(self._cells)
+        return clone
+
+    def without(self, keep: np.ndarray) -> "IVFIndex":
+        """Returns a copy indexing only the gallery rows where boolean *keep* is set.
+
+        The basis and cells are kept as trained: dropped rows leave their
+        cells and the rest are renumbered to the compacted gallery, so
+        retiring samples costs no retraining.
+        """
+        clone = copy.copy(self)
+        if not self.trained:
+            return clone
+        keep = keep[: self._count]
+        renumber = np.cumsum(keep, dtype=np.int32) - 1
+        clone._proj = np.ascontiguousarray(self._proj[: self._count][keep])
+        clone._count = len(clone._proj)
+        clone._cells = [renumber[cell[keep[cell]]] for cell in self._cells]
+        return clone
+
+    # -- building -----------------------------------------------------------
+
+    def train(self, bins: np.ndarray) -> None:
+        """(Re)builds the basis, cells and projections from a bin-major gallery."""
+        n = bins.shape[1]
+        if n == 0:
+            return
+        rng = np.random.default_rng(0)
+        cols = np.sort(rng.choice(n, size=min(n, self.train_sample), replace=False))
+        sample = np.sqrt(np.ascontiguousarray(bins[:, cols].T, dtype=np.float32))
+        mean = sample.mean(axis=0, keepdims=True)
+        self._basis = top_components(sample - mean, min(self.dims, len(cols)), rng)
+        self._offset = self._basis @ mean.T
+
+        self._proj = np.empty((max(n, 64), self._basis.shape[0]), dtype=np.float32)
+        self._count = 0
+        self._append_projections(self.project(bins))
+
+        nlist = max(1, min(n, int(4 * math.sqrt(n))))
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1e-3)
+        _, assign, centroids = cv2.kmeans(
+            self._proj[:n], nlist, None, criteria, 1, cv2.KMEANS_PP_CENTERS
+        )
+        self._centroids = centroids.astype(np.float32)
+        assign = assign.ravel()
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        self._cells = [order[bounds[c] : bounds[c + 1]].astype(np.int32) for c in range(nlist)]
+        self._trained_count = n
+
+    def project(self, bins: np.ndarray, block: int = 1024) -> np.ndarray:
+        """Projects bin-major histograms ``(D, n)`` to ``(n, dims)``."""
+        out = np.empty((bins.shape[1], self._basis.shape[0]), dtype=np.float32)
+        for start in range(0, bins.shape[1], block):
+            chunk = np.sqrt(np.asarray(bins[:, start : start + block], dtype=np.float32))
+            out[start : start + block] = (self._basis @ chunk - self._offset).T
+        return out
+
+    def add(self, hists: np.ndarray) -> None:
+        """Appends ``(n, D)`` histograms (gallery rows ``len(self)`` onwards)."""
+        if not self.trained or len(hists) == 0:
+            return
+        proj = self.project(hists.T)
+        first = self._count
+        self._append_projections(proj)
+        nearest = self._nearest_cells(proj, 1)[:, 0]
+        for offset, cell in enumerate(nearest):
+            self._cells[cell] = np.append(self._cells[cell], np.int32(first + offset))
+
+    def _append_projections(self, proj: np.ndarray) -> None:
+        needed = self._count + len(proj)
+        if needed > len(self._proj):
+            grown = np.empty((max(needed, 2 * len(self._proj)), self._proj.shape[1]), dtype=np.float32)
+            grown[: self._count] = self._proj[: self._count]
+            self._proj = grown
+        self._proj[self._count : needed] = proj
+        self._count = needed
+
+    def _nearest_cells(self, proj: np.ndarray, k: int) -> np.ndarray:
+        d = (
+            (proj * proj).sum(axis=1)[:, None]
+            - 2.0 * proj @ self._centroids.T
+            + (self._centroids * self._centroids).sum(axis=1)[None, :]
+        )
+        k = min(k, d.shape[1])
+        return np.argpartition(d, k - 1, axis=1)[:, :k]
+
+    # -- querying -----------------------------------------------------------
+
+    def search(self, query: np.ndarray) -> np.ndarray:
+        """Returns the gallery rows to re-score exactly for one query histogram."""
+        proj = self.project(query.reshape(-1, 1))
+        cells = self._nearest_cells(proj, self.nprobe)[0]
+        rows = np.concatenate([self._cells[c] for c in cells])
+        if len(rows) > self.rerank:
+            diff = self._proj[rows] - proj
+            d = np.einsum("ij,ij->i", diff, diff)
+            rows = rows[np.argpartition(d, self.rerank - 1)[: self.rerank]]
+        # Ascending rows keep the exact re-scoring gather cache friendly.
+        return np.sort(rows)
+
+    def audit_due(self) -> bool:
+        """Counts a query and tells whether it should be checked against exact search."""
+        self.stats.queries += 1
+        return self.audit_every > 0 and self.stats.queries % self.audit_every == 0
+
+    def record_audit(self, ann_label: int, exact_label: int, nn_found: bool, ann_s: float, exact_s: float) -> None:
+        """Adds one ANN-vs-exact comparison to :attr:`stats`."""
+        self.stats.audited += 1
+        self.stats.top1_agree += int(ann_label == exact_label)
+        self.stats.nn_found += int(nn_found)
+        self.stats.ann_ms += ann_s * 1000.0
+        self.stats.exact_ms += exact_s * 1000.0
+
+    # -- persistence --------------------------------------------------------
+
+    def save(self, path: Path) -> None:
+        """Writes the trained index to *path* (``.npz``)."""
+        if not self.trained:
+            return
+        sizes = np.array([len(c) for c in self._cells], dtype=np.int64)
+        tmp = path.with_name(path.stem + ".tmp.npz")
+        np.savez(
+            tmp,
+            basis=self._basis,
+            offset=self._offset,
+            centroids=self._centroids,
+            proj=self._proj[: self._count],
+            cell_rows=np.concatenate(self._cells) if self._cells else np.empty(0, np.int32),
+            cell_sizes=sizes,
+            params=np.array([self.nprobe, self.rerank, self._trained_count], dtype=np.int64),
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path, **kwargs) -> "IVFIndex":
+        """Restores an index written by :meth:`save`."""
+        with np.load(path) as data:
+            index = cls(dims=data["basis"].shape[0], **kwargs)
+            index._basis = data["basis"]
+            index._offset = data["offset"]
+            index._centroids = data["centroids"]
+            index._proj = data["proj"].copy()
+            index._count = len(index._proj)
+            index._cells = np.split(data["cell_rows"], np.cumsum(data["cell_sizes"])[:-1])
+            index._trained_count = int(data["params"][2])
+        return index
+
+
+def top_components(centred: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """Top-*k* principal axes of *centred* ``(n, D)`` data, as ``(k, D)`` rows.
+
+    Randomised range finder + small SVD: O(n*D*k) instead of the O(n^2*D)
+    (or O(D^3)) of a full covariance eigen-decomposition, which matters at
+    D = 16384.
+    """
+    probe = rng.standard_normal((centred.shape[1], k + 10)).astype(np.float32)
+    basis, _ = np.linalg.qr(centred @ probe)
+    for _ in range(2):  # power iterations sharpen the spectrum
+        basis, _ = np.linalg.qr(centred @ (centred.T @ basis))
+    _, _, vt = np.linalg.svd(basis.T @ centred, full_matrices=False)
+    return np.ascontiguousarray(vt[:k], dtype=np.float32)
@@ -0,0 +1,466 @@
+from __future__ import annotations
+
+import abc
+import copy
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Type
+
+import cv2
+import numpy as np
+
+from faceapp.ann import top_components
+from faceapp.common import MODELS_DIR
+from faceapp.recognition import GalleryMatcher, MatchResult, rank_identities
+
+# ---------------------------------------------------------------------------
+# Recogniser backends
+# ---------------------------------------------------------------------------
+
+DEFAULT_BACKEND: str = "lbph"
+DEFAULT_EMBEDDING_MODEL: Path = MODELS_DIR / "face_recognition_sface_2021dec.onnx"
+
+
+class RecognizerBackend(Protocol):
+    """What the app needs from a recognition engine.
+
+    A backend is one gallery of labelled samples, each stored as a fixed-size
+    feature vector produced by :meth:`encode`; :meth:`match_features` ranks
+    identities by a distance where smaller is closer and anything below
+    :attr:`threshold` counts as recognised. Galleries are versioned like
+    :class:`GalleryMatcher`: :meth:`fork` appends without disturbing readers
+    of the original and :meth:`without` returns a compacted copy.
+    """
+
+    name: str
+    threshold: float
+
+    def __len__(self) -> int: ...
+
+    @property
+    def labels(self) -> np.ndarray: ...
+
+    @property
+    def ids(self) -> np.ndarray: ...
+
+    def encode(self, faces: Sequence[np.ndarray]) -> np.ndarray: ...
+
+    def encode_one(self, face: np.ndarray) -> np.ndarray: ...
+
+    def train(self, faces: Sequence[np.ndarray], labels: Sequence[int], ids: Optional[Sequence[int]] = None) -> None: ...
+
+    def add(self, faces: Sequence[np.ndarray], labels: Sequence[int], ids: Optional[Sequence[int]] = None) -> None: ...
+
+    def add_features(self, features: np.ndarray, labels: Sequence[int], ids: Optional[Sequence[int]] = None) -> None: ...
+
+    def predict(self, faces: Sequence[np.ndarray], top_k: int = 3) -> List[MatchResult]: ...
+
+    def match_features(self, queries: np.ndarray, top_k: int = 3) -> List[MatchResult]: ...
+
+    def features(self, columns: Optional[np.ndarray] = None) -> np.ndarray: ...
+
+    def pairwise(self, a: np.ndarray, b: np.ndarray) -> np.ndarray: ...
+
+    def fork(self) -> "RecognizerBackend": ...
+
+    def without(self, columns: Sequence[int]) -> "RecognizerBackend": ...
+
+    def save(self, directory: Path) -> None: ...
+
+    def memory_bytes(self) -> int: ...
+
+
+class VectorGallery(abc.ABC):
+    """Base of the feature-vector backends: a sample-major float32 gallery.
+
+    Subclasses provide :meth:`encode_one` and :meth:`distances`, and may keep
+    a derived model (a projection, say) up to date in :meth:`_added`.
+    Storage grows into spare rows and is shared by :meth:`fork` exactly like
+    :class:`GalleryMatcher`.
+    """
+
+    name = ""
+    threshold = 0.0
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._features = np.empty((0, dim), dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def labels(self) -> np.ndarray:
+        return self._labels[: self._count]
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[: self._count]
+
+    def features(self, columns: Optional[np.ndarray] = None) -> np.ndarray:
+        """``(n, dim)`` features of all (or *columns* of the) samples."""
+        stored = self._features[: self._count]
+        return stored if columns is None else stored[columns]
+
+    # -- encoding ---------------------------------------------------------
+
+    @abc.abstractmethod
+    def encode_one(self, face: np.ndarray) -> np.ndarray:
+        """The ``(dim,)`` feature vector of one ``FACE_SIZE`` grayscale face."""
+
+    def encode(self, faces: Sequence[np.ndarray]) -> np.ndarray:
+        """Stacks the features of *faces* into an ``(n, dim)`` matrix."""
+        out = np.empty((len(faces), self.dim), dtype=np.float32)
+        for i, face in enumerate(faces):
+            out[i] = self.encode_one(face)
+        return out
+
+    # -- gallery ----------------------------------------------------------
+
+    def train(self, faces: Sequence[np.ndarray], labels: Sequence[int], ids: Optional[Sequence[int]] = None) -> None:
+        """Replaces the gallery with *faces*."""
+        self._count = 0
+        self._features = np.empty((0, self.dim), dtype=np.float32)
+        self.add(faces, labels, ids)
+
+    def add(self, faces: Sequence[np.ndarray], labels: Sequence[int], ids: Optional[Sequence[int]] = None) -> None:
+        """Appends grayscale face crops with their identity labels (and sample ids)."""
+        self.add_features(self.encode(faces), labels, ids)
+
+    def add_features(self, features: np.ndarray, labels: Sequence[int], ids: Optional[Sequence[int]] = None) -> None:
+        """Appends precomputed ``(n, dim)`` features with their labels (and sample ids)."""
+        n = len(features)
+        if n == 0:
+            return
+        first, needed = self._count, self._count + n
+        if needed > len(self._features) or not self._features.flags.writeable:
+            capacity = max(needed, 2 * len(self._features), 64)
+            grown = np.empty((capacity, self.dim), dtype=np.float32)
+            grown[: self._count] = self._features[: self._count]
+            self._features = grown
+            self._labels = np.resize(self._labels[: self._count], capacity)
+            self._ids = np.resize(self._ids[: self._count], capacity)
+        self._features[first:needed] = features
+        self._labels[first:needed] = labels
+        self._ids[first:needed] = -1 if ids is None else ids
+        self._count = needed
+        self._added(first)
+
+    def _added(self, first: int) -> None:
+        """Called after rows ``first:len(self)`` were appended."""
+
+    def fork(self) -> "VectorGallery":
+        """Returns a gallery that can be appended to without disturbing this one."""
+        return copy.copy(self)
+
+    def without(self, columns: Sequence[int]) -> "VectorGallery":
+        """Returns a compacted copy of this gallery with *columns* dropped."""
+        keep = np.ones(self._count, dtype=bool)
+        keep[np.asarray(columns, dtype=np.intp)] = False
+        clone = copy.copy(self)
+        clone._features = np.ascontiguousarray(self.features()[keep])
+        clone._labels = self.labels[keep].copy()
+        clone._ids = self.ids[keep].copy()
+        clone._count = int(keep.sum())
+        clone._compacted(self, keep)
+        return clone
+
+    def _compacted(self, source: "VectorGallery", keep: np.ndarray) -> None:
+        """Lets subclasses compact derived per-sample state after :meth:`without`."""
+
+    # -- matching ---------------------------------------------------------
+
+    @abc.abstractmethod
+    def distances(self, queries: np.ndarray) -> np.ndarray:
+        """``(len(queries), len(self))`` distances to every gallery sample."""
+
+    def pairwise(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Euclidean distances between two ``(n, dim)`` feature sets."""
+        d = (a * a).sum(axis=1)[:, None] - 2.0 * a @ b.T + (b * b).sum(axis=1)[None, :]
+        return np.sqrt(np.maximum(d, 0, out=d))
+
+    def match_features(self, queries: np.ndarray, top_k: int = 3) -> List[MatchResult]:
+        """Ranks the identities of the gallery for each precomputed query."""
+        if self._count == 0:
+            return [MatchResult(-1, float("inf"), []) for _ in range(len(queries))]
+        return [rank_identities(row, self.labels, top_k) for row in self.distances(queries)]
+
+    def predict(self, faces: Sequence[np.ndarray], top_k: int = 3) -> List[MatchResult]:
+        """Scores every face of a frame against the whole gallery."""
+        if not len(faces):
+            return []
+        return self.match_features(self.encode(faces), top_k)
+
+    # -- persistence ------------------------------------------------------
+
+    def memory_bytes(self) -> int:
+        """Bytes held by the gallery arrays, spare capacity included."""
+        return self._features.nbytes + self._labels.nbytes + self._ids.nbytes
+
+    def _params(self) -> Dict[str, Any]:
+        """Settings the stored features depend on; a mismatch invalidates a saved gallery."""
+        return {"backend": self.name, "dim": self.dim}
+
+    def save(self, directory: Path) -> None:
+        """Writes ``features``/``labels``/``ids.npy`` and ``backend.json`` into *directory*."""
+        arrays = (("features", self.features()), ("labels", self.labels), ("ids", self.ids))
+        for name, data in arrays:
+            tmp = directory / f"{name}.tmp.npy"
+            np.save(tmp, data)
+            tmp.replace(directory / f"{name}.npy")
+        with (directory / "backend.json").open("w", encoding="utf-8") as f:
+            json.dump(self._params(), f)
+
+    @classmethod
+    def load(cls, directory: Path, **options) -> "VectorGallery":
+        """Restores a gallery written by :meth:`save` into a backend built with *options*."""
+        gallery = cls(**options)
+        with (directory / "backend.json").open("r", encoding="utf-8") as f:
+            if json.load(f) != gallery._params():
+                raise ValueError(f"cached {cls.name} gallery was built with other settings")
+        features = np.load(directory / "features.npy")
+        labels = np.load(directory / "labels.npy")
+        ids = np.load(directory / "ids.npy")
+        if features.ndim != 2 or features.shape[1] != gallery.dim or not len(features) == len(labels) == len(ids):
+            raise ValueError("gallery feature/label shapes do not match")
+        gallery.add_features(features, labels, ids)
+        return gallery
+
+
+class EigenfaceBackend(VectorGallery):
+    """Eigenfaces: nearest neighbour in a PCA subspace of the face pixels.
+
+    Faces are histogram-equalised and downscaled to *size* x *size*; the
+    gallery keeps those pixel vectors plus their projection onto the top
+    *components* principal axes. New samples are projected onto the current
+    basis, which is refitted (on up to *train_sample* samples) once the
+    gallery has doubled since it was last fitted - the same policy as the
+    ANN index. Cheapest to match and smallest in memory; the least robust to
+    pose and lighting.
+    """
+
+    name = "eigen"
+    threshold = 12.0
+
+    def __init__(self, size: int = 48, components: int = 80, train_sample: int = 4096):
+        super().__init__(size * size)
+        self.size = size
+        self.components = components
+        self.train_sample = train_sample
+        self._basis: Optional[np.ndarray] = None  # (k, dim)
+        self._mean = np.zeros(size * size, dtype=np.float32)
+        self._proj = np.empty((0, 0), dtype=np.float32)
+        self._fitted_count = 0
+
+    def encode_one(self, face: np.ndarray) -> np.ndarray:
+        small = cv2.resize(cv2.equalizeHist(face), (self.size, self.size), interpolation=cv2.INTER_AREA)
+        return small.ravel().astype(np.float32) * np.float32(1.0 / 255.0)
+
+    def train(self, faces: Sequence[np.ndarray], labels: Sequence[int], ids: Optional[Sequence[int]] = None) -> None:
+        self._basis = None
+        super().train(faces, labels, ids)
+
+    def _added(self, first: int) -> None:
+        if self._basis is None or self._count >= 2 * self._fitted_count:
+            self._fit()
+            return
+        proj = self.project(self._features[first : self._count])
+        if self._count > len(self._proj):
+            grown = np.empty((len(self._features), self._proj.shape[1]), dtype=np.float32)
+            grown[:first] = self._proj[:first]
+            self._proj = grown
+        self._proj[first : self._count] = proj
+
+    def _fit(self) -> None:
+        """Refits the basis on (a sample of) the gallery and reprojects it."""
+        rng = np.random.default_rng(0)
+        rows = np.sort(rng.choice(self._count, size=min(self._count, self.train_sample), replace=False))
+        sample = self._features[rows]
+        self._mean = sample.mean(axis=0)
+        self._basis = self._fit_basis(sample - self._mean, self._labels[rows], rng)
+        self._proj = np.empty((len(self._features), self._basis.shape[0]), dtype=np.float32)
+        self._proj[: self._count] = self.project(self._features[: self._count])
+        self._fitted_count = self._count
+
+    def _fit_basis(self, centred: np.ndarray, labels: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        return top_components(centred, max(1, min(self.components, len(centred) - 1)), rng)
+
+    def project(self, features: np.ndarray) -> np.ndarray:
+        """Projects ``(n, dim)`` pixel vectors onto the basis."""
+        return (np.asarray(features, dtype=np.float32) - self._mean) @ self._basis.T
+
+    def _compacted(self, source: VectorGallery, keep: np.ndarray) -> None:
+        self._proj = np.ascontiguousarray(source._proj[: source._count][keep])
+
+    def distances(self, queries: np.ndarray) -> np.ndarray:
+        return self.pairwise(self.project(queries), self._proj[: self._count])
+
+    def memory_bytes(self) -> int:
+        basis = self._basis.nbytes if self._basis is not None else 0
+        return super().memory_bytes() + self._proj.nbytes + basis
+
+    def _params(self) -> Dict[str, Any]:
+        return {**super()._params(), "size": self.size}
+
+
+class FisherfaceBackend(EigenfaceBackend):
+    """Fisherfaces: like :class:`EigenfaceBackend`, with an LDA basis.
+
+    The pixels are first reduced by PCA to at most ``n - classes`` (and
+    *pca_components*) dimensions, then projected onto the directions that
+    best separate the enrolled identities (at most ``classes - 1``). That
+    discounts lighting and expression changes shared by everyone. The basis
+    is also refitted once the number of identities grew by a quarter, since
+    new people were not part of the separation it learnt.
+    """
+
+    name = "fisher"
+    threshold = 2.5
+
+    def __init__(
+        self,
+        size: int = 48,
+        components: int = 64,
+        pca_components: int = 160,
+        train_sample: int = 4096,
+    ):
+        super().__init__(size, components, train_sample)
+        self.pca_components = pca_components
+        self._fitted_classes = 0
+
+    def _added(self, first: int) -> None:
+        classes = len(np.unique(self._labels[: self._count]))
+        if self._basis is not None and classes > 1.25 * self._fitted_classes:
+            self._basis = None
+        super()._added(first)
+
+    def _fit_basis(self, centred: np.ndarray, labels: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        classes, inverse = np.unique(labels, return_inverse=True)
+        self._fitted_classes = len(classes)
+        if len(classes) < 2 or len(centred) <= len(classes):
+            return super()._fit_basis(centred, labels, rng)
+        pca = top_components(centred, min(self.pca_components, len(centred) - len(classes)), rng)
+        reduced = centred @ pca.T
+        means = np.zeros((len(classes), reduced.shape[1]), dtype=np.float64)
+        np.add.at(means, inverse, reduced)
+        counts = np.bincount(inverse).astype(np.float64)
+        means /= counts[:, None]
+        within = reduced - means[inverse]
+        sw = within.T @ within
+        sb = (means * counts[:, None]).T @ means  # data is centred, so the overall mean is 0
+        sw += np.eye(len(sw)) * (1e-4 * np.trace(sw) / len(sw) + 1e-9)
+        whiten = np.linalg.inv(np.linalg.cholesky(sw))
+        values, vectors = np.linalg.eigh(whiten @ sb @ whiten.T)
+        k = min(self.components, len(classes) - 1)
+        lda = whiten.T @ vectors[:, np.argsort(values)[::-1][:k]]
+        return np.ascontiguousarray((lda.T @ pca).astype(np.float32))
+
+
+class EmbeddingBackend(VectorGallery):
+    """Face embeddings from an ONNX network run on the CPU by OpenCV DNN.
+
+    Defaults fit OpenCV Zoo's SFace model (``models/``, 112x112 BGR input,
+    128-d output). Embeddings are L2-normalised, so the whole gallery is
+    searched with one matrix multiply and the distance is ``1 - cosine``.
+    Each thread gets its own network instance, as a ``cv2.dnn.Net`` must not
+    run two inferences at once. The most accurate and the slowest to encode.
+    """
+
+    name = "dnn"
+    threshold = 0.637  # SFace's cosine similarity threshold of 0.363
+
+    def __init__(
+        self,
+        model: str | Path = DEFAULT_EMBEDDING_MODEL,
+        input_size: int = 112,
+        scale: float = 1.0,
+        mean: Sequence[float] = (0.0, 0.0, 0.0),
+        swap_rb: bool = True,
+    ):
+        self.model = Path(model)
+        if not self.model.is_file():
+            raise FileNotFoundError(f"embedding model not found: {self.model}")
+        self.input_size = input_size
+        self.scale = scale
+        self.mean = tuple(mean)
+        self.swap_rb = swap_rb
+        self._local = threading.local()
+        probe = self._forward([np.zeros((input_size, input_size), dtype=np.uint8)])
+        super().__init__(probe.shape[1])
+
+    def _net(self) -> "cv2.dnn.Net":
+        net = getattr(self._local, "net", None)
+        if net is None:
+            net = cv2.dnn.readNetFromONNX(str(self.model))
+            net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            self._local.net = net
+        return net
+
+    def _forward(self, faces: Sequence[np.ndarray]) -> np.ndarray:
+        images = [cv2.cvtColor(face, cv2.COLOR_GRAY2BGR) if face.ndim == 2 else face for face in faces]
+        size = (self.input_size, self.input_size)
+        blob = cv2.dnn.blobFromImages(images, self.scale, size, self.mean, self.swap_rb, False)
+        net = self._net()
+        net.setInput(blob)
+        return net.forward().reshape(len(images), -1).astype(np.float32)
+
+    def encode(self, faces: Sequence[np.ndarray]) -> np.ndarray:
+        """Embeds *faces* in one batch; rows are unit length."""
+        if not len(faces):
+            return np.empty((0, self.dim), dtype=np.float32)
+        emb = self._forward(faces)
+        emb /= np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+        return emb
+
+    def encode_one(self, face: np.ndarray) -> np.ndarray:
+        return self.encode([face])[0]
+
+    def distances(self, queries: np.ndarray) -> np.ndarray:
+        return 1.0 - queries @ self.features().T
+
+    def pairwise(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        return 1.0 - a @ b.T
+
+    def _params(self) -> Dict[str, Any]:
+        return {**super()._params(), "model": self.model.name, "input_size": self.input_size}
+
+
+BACKENDS: Dict[str, Type] = {
+    "lbph": GalleryMatcher,
+    "eigen": EigenfaceBackend,
+    "fisher": FisherfaceBackend,
+    "dnn": EmbeddingBackend,
+}
+
+
+def _backend_class(name: str) -> Type:
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"unknown recogniser backend {name!r} (expected one of {sorted(BACKENDS)})") from None
+
+
+def make_backend(name: str = DEFAULT_BACKEND, **options) -> RecognizerBackend:
+    """Creates an empty *name* backend; *options* go to its constructor.
+
+    ``threshold`` is accepted by every backend and overrides its default.
+    """
+    threshold = options.pop("threshold", None)
+    backend = _backend_class(name)(**options)
+    if threshold is not None:
+        backend.threshold = float(threshold)
+    return backend
+
+
+def load_backend(name: str, directory: Path, **options) -> RecognizerBackend:
+    """Restores a *name* backend saved in *directory* (see :func:`make_backend`)."""
+    threshold = options.pop("threshold", None)
+    backend = _backend_class(name).load(directory, **options)
+    if threshold is not None:
+        backend.threshold = float(threshold)
+    return backend
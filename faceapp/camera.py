@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from faceapp.common import Logger
+from faceapp.detection import DetectThenTrack, ScaleController
+from faceapp.motion import MotionGate
+from faceapp.preprocess import FramePreprocessor
+from faceapp.tracking import FaceTracker
+
+# A camera: device index or a path / URL OpenCV can open.
+CameraSource = Union[int, str]
+
+# ---------------------------------------------------------------------------
+# Camera grabbing, decoupled from frame processing
+# ---------------------------------------------------------------------------
+
+
+class GrabStats:
+    """Frames grabbed vs. processed, and how old frames were when faces were recognised."""
+
+    def __init__(self, window: int = 1000):
+        self.grabbed = 0
+        self.delivered = 0
+        self.failures = 0
+        self.ages_ms: deque = deque(maxlen=window)
+
+    @property
+    def skipped(self) -> int:
+        """Frames replaced by a newer one before anything processed them."""
+        return max(0, self.grabbed - self.delivered)
+
+    def record_age(self, captured_at: float) -> None:
+        """Notes the age of a frame (``time.monotonic()`` stamp) whose faces were just recognised."""
+        self.ages_ms.append(1000.0 * (time.monotonic() - captured_at))
+
+    def as_dict(self) -> dict:
+        """Snapshot for logging / the UI."""
+        ages = np.array(self.ages_ms or [0.0])
+        return {
+            "grabbed": self.grabbed,
+            "delivered": self.delivered,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "age_at_recognition_ms": round(float(ages.mean()), 1),
+            "p95_age_at_recognition_ms": round(float(np.percentile(ages, 95)), 1),
+        }
+
+
+class FrameGrabber:
+    """Reads a camera in its own thread and keeps only the newest frame.
+
+    OpenCV's ``read()`` returns the oldest frame the driver has buffered,
+    so a loop that processes slower than the camera delivers falls
+    further and further behind. Here a thread grabs and decodes frames
+    as fast as the camera produces them, stamping each with the
+    ``time.monotonic()`` of its grab, and :meth:`read` always hands out
+    the latest one - frames nobody got to in between are simply replaced.
+    The driver's own queue is shrunk to *buffer_size* frames where the
+    backend supports ``CAP_PROP_BUFFERSIZE``.
+
+    Only the grabber thread touches *capture* once :meth:`start` is called.
+    """
+
+    def __init__(self, capture: cv2.VideoCapture, buffer_size: int = 1, name: str = "FrameGrabber"):
+        self.capture = capture
+        self.name = name
+        self.stats = GrabStats()
+        if not capture.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size):
+            Logger("[INFO] Camera backend ignores CAP_PROP_BUFFERSIZE; relying on the grabber to drop stale frames.")
+        self._cond = threading.Condition()
+        self._frame: Optional[np.ndarray] = None
+        self._captured_at = 0.0
+        self._seq = 0
+        self._delivered_seq = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Starts the grabber thread."""
+        self._thread = threading.Thread(target=self._run, daemon=True, name=self.name)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        """Stops the grabber thread; the capture can be released afterwards."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if not self.capture.grab():
+                self.stats.failures += 1
+                time.sleep(0.01)
+                continue
+            captured_at = time.monotonic()
+            ok, frame = self.capture.retrieve()
+            if not ok:
+                self.stats.failures += 1
+                continue
+            with self._cond:
+                self._frame, self._captured_at = frame, captured_at
+                self._seq += 1
+                self.stats.grabbed += 1
+                self._cond.notify_all()
+
+    def read(self, timeout: float = 1.0) -> Tuple[bool, Optional[np.ndarray], float]:
+        """Waits for a frame newer than the last one read; ``(ok, frame, captured_at)``."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > self._delivered_seq or self._stop.is_set(), timeout):
+                return False, None, 0.0
+            if self._seq == self._delivered_seq:  # stopped
+                return False, None, 0.0
+            self._delivered_seq = self._seq
+            self.stats.delivered += 1
+            return True, self._frame, self._captured_at
+
+
+class FeedStats:
+    """Frames a camera feed got through the pipeline, and how long each took from grab to screen."""
+
+    def __init__(self, window: int = 1000):
+        self.frames = 0
+        self.latencies_ms: deque = deque(maxlen=window)
+        self._first: Optional[float] = None
+
+    @property
+    def fps(self) -> float:
+        """Processed frames per second since the first one."""
+        if self._first is None:
+            return 0.0
+        return self.frames / max(time.monotonic() - self._first, 1e-6)
+
+    def record(self, captured_at: float) -> None:
+        """Notes a processed frame grabbed at *captured_at* (``time.monotonic()``)."""
+        now = time.monotonic()
+        if self._first is None:
+            self._first = now
+        self.frames += 1
+        self.latencies_ms.append(1000.0 * (now - captured_at))
+
+    def as_dict(self) -> dict:
+        """Snapshot for logging / the UI."""
+        latencies = np.array(self.latencies_ms or [0.0])
+        return {
+            "frames": self.frames,
+            "fps": round(self.fps, 1),
+            "latency_ms": round(float(latencies.mean()), 1),
+            "p95_latency_ms": round(float(np.percentile(latencies, 95)), 1),
+        }
+
+
+class CameraFeed:
+    """One camera with its own grabber and the per-camera half of the pipeline.
+
+    Motion gating, detection scheduling and scale, preprocessing buffers
+    and face tracks all depend on what one camera saw in its previous
+    frames, so every feed has its own; the detector, the recogniser and the
+    attendance dedup are shared by all feeds. Processed frames for the
+    feed's preview tile go through :attr:`frame_queue` (newest only).
+
+    With detection workers the result thread tracks the faces while the
+    camera thread runs the motion gate, which resets :attr:`face_finder`
+    and :attr:`tracker` when it falls asleep; both threads use them under
+    :attr:`lock`.
+
+    :meth:`announce` is the per-camera cooldown for on-screen messages
+    about a person: each camera repeats them at most every *announce_s*
+    seconds, however many frames it recognises them in.
+    """
+
+    def __init__(
+        self,
+        index: int,
+        source: CameraSource,
+        grabber: FrameGrabber,
+        motion_gate: Optional[MotionGate],
+        scale_control: ScaleController,
+        face_finder: DetectThenTrack,
+        tracker: FaceTracker,
+        preprocessor: Optional[FramePreprocessor] = None,
+        announce_s: float = 3.0,
+        shape: Optional[Tuple[int, ...]] = None,
+    ):
+        self.index = index
+        self.source = source
+        self.name = f"Camera {index + 1}"
+        self.grabber = grabber
+        self.motion_gate = motion_gate
+        self.scale_control = scale_control
+        self.face_finder = face_finder
+        self.tracker = tracker
+        self.lock = threading.Lock()  # guards face_finder and tracker
+        self.preprocessor = preprocessor or FramePreprocessor()
+        self.announce_s = announce_s
+        self.stats = FeedStats()
+        self.frame_queue: "queue.Queue[np.ndarray]" = queue.Queue(maxsize=1)
+        self.faces_present = False
+        self.shape = shape  # of its frames as reported when opened; None if unknown
+        self._announced: Dict[Any, float] = {}
+
+    def announce(self, key: Any, now: float) -> bool:
+        """Whether this camera may show a message about *key* (an employee) again."""
+        if now - self._announced.get(key, float("-inf")) < self.announce_s:
+            return False
+        self._announced[key] = now
+        return True
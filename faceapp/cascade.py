@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import copy
+from typing import Optional
+
+import numpy as np
+
+from faceapp.recognition import (
+    HISTOGRAM_SIZE,
+    LBP_GRID_X,
+    LBP_GRID_Y,
+    LBP_NEIGHBORS,
+    LBP_PATTERNS,
+    chi_square_distances,
+)
+
+# ---------------------------------------------------------------------------
+# Coarse-to-fine matching cascade
+# ---------------------------------------------------------------------------
+
+
+def _uniform_patterns(neighbors: int) -> np.ndarray:
+    """Maps each LBP code to its uniform-pattern bin (non-uniform codes share the last one)."""
+    table = np.empty(1 << neighbors, dtype=np.intp)
+    uniform = 0
+    for code in range(1 << neighbors):
+        rotated = (code >> 1) | ((code & 1) << (neighbors - 1))
+        if bin(code ^ rotated).count("1") <= 2:
+            table[code] = uniform
+            uniform += 1
+        else:
+            table[code] = -1
+    table[table < 0] = uniform
+    return table
+
+
+_UNIFORM = _uniform_patterns(LBP_NEIGHBORS)
+UNIFORM_PATTERNS: int = int(_UNIFORM.max()) + 1
+
+
+class CascadeStats:
+    """Stage timings of the cascade, and how it compares with exact search.
+
+    Every query records its coarse (shortlist) and fine (exact re-scoring)
+    time; every ``audit_every``-th one is also searched exhaustively, which
+    gives the shortlist recall (the exact best identity was shortlisted),
+    top-1 agreement and the speed-up over the full-gallery comparison.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.audited = 0
+        self.shortlist_hits = 0
+        self.top1_agree = 0
+        self.coarse_ms = 0.0
+        self.fine_ms = 0.0
+        self.audit_cascade_ms = 0.0
+        self.exact_ms = 0.0
+
+    @property
+    def shortlist_recall(self) -> float:
+        """Share of audited queries whose exact best identity was shortlisted."""
+        return self.shortlist_hits / self.audited if self.audited else 1.0
+
+    @property
+    def top1_recall(self) -> float:
+        """Share of audited queries given the same identity as exact search."""
+        return self.top1_agree / self.audited if self.audited else 1.0
+
+    @property
+    def speedup(self) -> float:
+        """Exact search time over cascade time, on audited queries."""
+        return self.exact_ms / self.audit_cascade_ms if self.audit_cascade_ms else 1.0
+
+    def as_dict(self) -> dict:
+        """Snapshot for logging / the UI."""
+        queries = max(self.queries, 1)
+        return {
+            "queries": self.queries,
+            "audited": self.audited,
+            "shortlist_recall": round(self.shortlist_recall, 4),
+            "top1_recall": round(self.top1_recall, 4),
+            "coarse_ms": round(self.coarse_ms / queries, 3),
+            "fine_ms": round(self.fine_ms / queries, 3),
+            "exact_ms": round(self.exact_ms / max(self.audited, 1), 3),
+            "speedup": round(self.speedup, 2),
+        }
+
+
+class CoarseFilter:
+    """First stage of a coarse-to-fine matcher: shortlists likely identities.
+
+    Every gallery histogram is reduced to a small descriptor by summing the
+    ``LBP_GRID_Y x LBP_GRID_X`` cell histograms over ``grid x grid`` blocks
+    and folding the 256 LBP codes into their uniform-pattern bins - the
+    default ``grid=4`` gives 16 x 59 = 944 dimensions instead of 16384. A
+    query is compared (chi-square) with these descriptors, the
+    *shortlist* identities owning the nearest ones are kept, and only their
+    samples are compared with the full histogram.
+
+    Shortlisted identities get their exact LBPH distance, so the result
+    equals exhaustive search whenever the true best identity is
+    shortlisted; ``stats.shortlist_recall`` measures how often that is so.
+    """
+
+    def __init__(self, grid: int = 4, shortlist: int = 8, audit_every: int = 50):
+        if LBP_GRID_X % grid or LBP_GRID_Y % grid:
+            raise ValueError(f"grid {grid} does not divide the {LBP_GRID_Y}x{LBP_GRID_X} LBP grid")
+        self.grid = grid
+        self.shortlist = shortlist
+        self.audit_every = audit_every
+        self.stats = CascadeStats()
+        self.dims = grid * grid * UNIFORM_PATTERNS
+        self._fold = np.zeros((UNIFORM_PATTERNS, LBP_PATTERNS), dtype=np.float32)
+        self._fold[_UNIFORM, np.arange(LBP_PATTERNS)] = 1.0
+        self._bins = np.empty((self.dims, 0), dtype=np.float32)  # bin-major, spare capacity
+        self._sums = np.empty(0, dtype=np.float32)
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def trained(self) -> bool:
+        return self._count > 0
+
+    def fork(self) -> "CoarseFilter":
+        """Returns a copy that can be appended to without disturbing this one.
+
+        Descriptor storage is shared the same way as
+        :meth:`GalleryMatcher.fork`; statistics keep accumulating in one place.
+        """
+        return copy.copy(self)
+
+    def without(self, keep: np.ndarray) -> "CoarseFilter":
+        """Returns a copy with the descriptors of the gallery rows where boolean *keep* is set."""
+        clone = copy.copy(self)
+        keep = keep[: self._count]
+        clone._bins = np.ascontiguousarray(self._bins[:, : self._count][:, keep])
+        clone._sums = self._sums[: self._count][keep].copy()
+        clone._count = clone._bins.shape[1]
+        return clone
+
+    def describe(self, bins: np.ndarray, block: int = 1024) -> np.ndarray:
+        """Coarse descriptors ``(dims, n)`` of bin-major histograms ``(HISTOGRAM_SIZE, n)``."""
+        n = bins.shape[1]
+        out = np.empty((self.dims, n), dtype=np.float32)
+        step_y, step_x = LBP_GRID_Y // self.grid, LBP_GRID_X // self.grid
+        for start in range(0, n, block):
+            chunk = np.asarray(bins[:, start : start + block], dtype=np.float32)
+            cells = chunk.reshape(self.grid, step_y, self.grid, step_x, LBP_PATTERNS, -1).sum(axis=(1, 3))
+            folded = np.matmul(self._fold, cells.reshape(self.grid * self.grid, LBP_PATTERNS, -1))
+            out[:, start : start + block] = folded.reshape(self.dims, -1)
+        return out
+
+    def train(self, bins: np.ndarray) -> None:
+        """(Re)computes the descriptors of a whole bin-major gallery."""
+        self._bins = self.describe(bins)
+        self._sums = self._bins.sum(axis=0)
+        self._count = bins.shape[1]
+
+    def add(self, hists: np.ndarray) -> None:
+        """Appends ``(n, HISTOGRAM_SIZE)`` histograms (gallery rows ``len(self)`` onwards)."""
+        if len(hists) == 0:
+            return
+        coarse = self.describe(hists.T)
+        needed = self._count + coarse.shape[1]
+        if needed > self._bins.shape[1]:
+            capacity = max(needed, 2 * self._bins.shape[1], 64)
+            grown = np.empty((self.dims, capacity), dtype=np.float32)
+            grown[:, : self._count] = self._bins[:, : self._count]
+            self._bins = grown
+            self._sums = np.resize(self._sums[: self._count], capacity)
+        self._bins[:, self._count : needed] = coarse
+        self._sums[self._count : needed] = coarse.sum(axis=0)
+        self._count = needed
+
+    def search(self, query: np.ndarray, labels: np.ndarray) -> Optional[np.ndarray]:
+        """Gallery rows of the identities shortlisted for one query histogram.
+
+        Returns ``None`` when there are no more identities than the
+        shortlist holds, i.e. when exact search is just as cheap.
+        """
+        coarse = self.describe(query.reshape(HISTOGRAM_SIZE, 1))[:, 0]
+        dists = chi_square_distances(coarse[None, :], self._bins[:, : self._count], self._sums[: self._count])[0]
+        # The nearest descriptors usually cover the shortlist; widen once if
+        # a few identities own all of them.
+        for width in (8, 64):
+            k = min(len(dists), self.shortlist * width)
+            nearest = np.argpartition(dists, k - 1)[:k] if k < len(dists) else np.arange(len(dists))
+            nearest = nearest[np.argsort(dists[nearest], kind="stable")]
+            owners, first = np.unique(labels[nearest], return_index=True)
+            if len(owners) >= self.shortlist or k == len(dists):
+                break
+        if k == len(dists) and len(owners) <= self.shortlist:
+            return None
+        shortlisted = owners[np.argsort(first)][: self.shortlist]
+        return np.flatnonzero(np.isin(labels, shortlisted))
+
+    def audit_due(self) -> bool:
+        """Counts a query and tells whether it should be checked against exact search."""
+        self.stats.queries += 1
+        return self.audit_every > 0 and self.stats.queries % self.audit_every == 0
+
+    def record(self, coarse_s: float, fine_s: float) -> None:
+        """Adds one query's stage timings to :attr:`stats`."""
+        self.stats.coarse_ms += coarse_s * 1000.0
+        self.stats.fine_ms += fine_s * 1000.0
+
+    def record_audit(self, label: int, exact_label: int, shortlisted: bool, cascade_s: float, exact_s: float) -> None:
+        """Adds one cascade-vs-exact comparison to :attr:`stats`."""
+        self.stats.audited += 1
+        self.stats.shortlist_hits += int(shortlisted)
+        self.stats.top1_agree += int(label == exact_label)
+        self.stats.audit_cascade_ms += cascade_s * 1000.0
+        self.stats.exact_ms += exact_s * 1000.0
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+# Simple logger helper (replace with logging module for production).
+Logger = print
+
+# Side length (pixels) of the square grayscale face crops kept in the gallery.
+FACE_SIZE: int = 200
+
+# Bundled model files (ONNX networks, cascades) live here.
+MODELS_DIR: Path = Path(__file__).resolve().parent.parent / "models"
+
+
+def ensure_dir(path: str | Path) -> None:
+    """Create directory *path* (including parents) if it does not exist."""
+    Path(path).mkdir(parents=True, exist_ok=True)
+
+
+def write_json_atomic(path: Path, data: object) -> None:
+    """Writes *data* as JSON via a temporary file + rename."""
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
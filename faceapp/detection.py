@@ -0,0 +1,431 @@
+from __future__ import annotations
+
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from faceapp.tracking import Box, box_iou
+
+# ---------------------------------------------------------------------------
+# Detect-then-track: full face detection every few frames, optical flow between
+# ---------------------------------------------------------------------------
+
+# Processing modes: a full-frame detector scan, a scan of the regions around
+# the faces already known, or optical-flow tracking only.
+DETECT: str = "detect"
+ROI: str = "roi"
+TRACK: str = "track"
+
+_LK_PARAMS = dict(
+    winSize=(11, 11),
+    maxLevel=2,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+)
+
+
+def flow_boxes(
+    prev: np.ndarray, gray: np.ndarray, boxes: Sequence[Box], grid: int = 5, max_fb_error: float = 2.0
+) -> Tuple[List[Box], np.ndarray]:
+    """Moves *boxes* from grayscale frame *prev* to *gray* with median flow.
+
+    A *grid* x *grid* lattice of points inside every box is tracked with
+    pyramidal Lucas-Kanade, forwards and back; points that do not return
+    to within *max_fb_error* pixels are discarded. Each box is shifted by
+    the median displacement and scaled by the median change of the
+    distances between its points. Returns the new boxes and, per box, the
+    share of its points that tracked reliably (0 for boxes that left the
+    frame).
+    """
+    if not len(boxes):
+        return [], np.empty(0, dtype=np.float32)
+    steps = (np.arange(grid, dtype=np.float32) + 0.5) / grid
+    gx, gy = np.meshgrid(steps, steps)
+    lattice = np.stack([gx.ravel(), gy.ravel()], axis=1)  # (grid*grid, 2) in box units
+    b = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    points = (b[:, None, :2] + lattice[None, :, :] * b[:, None, 2:]).reshape(-1, 1, 2)
+
+    forward, status_f, _ = cv2.calcOpticalFlowPyrLK(prev, gray, points, None, **_LK_PARAMS)
+    backward, status_b, _ = cv2.calcOpticalFlowPyrLK(gray, prev, forward, None, **_LK_PARAMS)
+    fb_error = np.linalg.norm(points - backward, axis=2).ravel()
+    good = (status_f.ravel() == 1) & (status_b.ravel() == 1) & (fb_error < max_fb_error)
+
+    n = grid * grid
+    height, width = gray.shape[:2]
+    moved: List[Box] = []
+    confidence = np.zeros(len(b), dtype=np.float32)
+    for i, (x, y, w, h) in enumerate(b):
+        ok = good[i * n : (i + 1) * n]
+        if ok.sum() < 2:
+            moved.append((int(x), int(y), int(w), int(h)))
+            continue
+        before = points[i * n : (i + 1) * n, 0][ok]
+        after = forward[i * n : (i + 1) * n, 0][ok]
+        dx, dy = np.median(after - before, axis=0)
+        pairs = np.triu_indices(len(before), 1)
+        spread_before = np.linalg.norm(before[pairs[0]] - before[pairs[1]], axis=1)
+        spread_after = np.linalg.norm(after[pairs[0]] - after[pairs[1]], axis=1)
+        scale = float(np.median(spread_after / np.maximum(spread_before, 1e-3)))
+        nw, nh = w * scale, h * scale
+        nx, ny = x + dx - (nw - w) / 2, y + dy - (nh - h) / 2
+        moved.append((int(round(nx)), int(round(ny)), int(round(nw)), int(round(nh))))
+        cx, cy = nx + nw / 2, ny + nh / 2
+        if 0 <= cx < width and 0 <= cy < height:
+            confidence[i] = ok.mean()
+    return moved, confidence
+
+
+class DetectionStats:
+    """Frames, latency and camera-thread CPU time per mode (detect / roi / track)."""
+
+    def __init__(self):
+        self.frames: Dict[str, int] = {DETECT: 0, ROI: 0, TRACK: 0}
+        self.wall_ms: Dict[str, float] = {DETECT: 0.0, ROI: 0.0, TRACK: 0.0}
+        self.cpu_ms: Dict[str, float] = {DETECT: 0.0, ROI: 0.0, TRACK: 0.0}
+        self.forced = 0  # detections run because tracking was lost
+        self.scanned = 0.0  # share of the frame area covered by detector scans, summed
+        self._first = self._last = 0.0
+
+    def record(self, mode: str, started: float, cpu_started: float) -> None:
+        """Adds one frame processed in *mode* since the given clock readings."""
+        now = time.perf_counter()
+        self.frames[mode] += 1
+        self.wall_ms[mode] += (now - started) * 1000.0
+        self.cpu_ms[mode] += (time.thread_time() - cpu_started) * 1000.0
+        self._first = self._first or started
+        self._last = now
+
+    @property
+    def fps(self) -> float:
+        """Frames handled per second of wall-clock time, all modes together."""
+        total = sum(self.frames.values())
+        return total / (self._last - self._first) if self._last > self._first else 0.0
+
+    def as_dict(self) -> dict:
+        """Snapshot for logging / the UI."""
+        modes = {
+            mode: {
+                "frames": frames,
+                "ms": round(self.wall_ms[mode] / max(frames, 1), 3),
+                "cpu_ms": round(self.cpu_ms[mode] / max(frames, 1), 3),
+                "max_fps": round(1000.0 * frames / self.wall_ms[mode], 1) if self.wall_ms[mode] else 0.0,
+            }
+            for mode, frames in self.frames.items()
+        }
+        scans = max(self.frames[DETECT] + self.frames[ROI], 1)
+        return {
+            "fps": round(self.fps, 1),
+            "forced_detections": self.forced,
+            "scanned_area": round(self.scanned / scans, 4),
+            **modes,
+        }
+
+
+class DetectThenTrack:
+    """Runs the face detector every few frames and follows faces between.
+
+    *detect* maps a grayscale frame to face boxes. It is run every
+    *interval* frames; in between, the last boxes are carried forward with
+    :func:`flow_boxes`. A box whose points track with less than
+    *min_confidence* reliability forces a detection on that frame.
+
+    The interval adapts between 1 and *max_interval*: it grows by one
+    frame after each detection that finds the same faces as were being
+    tracked (every box matched at IoU *min_iou* or better), and halves as
+    soon as faces appear, disappear or are lost. A steady scene is
+    detected rarely, a busy one nearly every frame. With ``max_interval=1``
+    every frame is detected, as before.
+
+    While faces are known, detections only scan the regions around them,
+    padded by *roi_padding* times the face size on every side (overlapping
+    regions are merged), so their cost follows the number of faces rather
+    than the frame area. Newcomers are picked up by a full-frame scan every
+    *full_scan_every* detections, after lost tracks, and - given the
+    motion gate's change mask - as soon as more than *motion_outside* of
+    the frame changes outside those regions.
+    """
+
+    def __init__(
+        self,
+        detect: Callable[[np.ndarray], Sequence[Box]],
+        interval: int = 5,
+        max_interval: int = 10,
+        min_confidence: float = 0.5,
+        min_iou: float = 0.5,
+        roi_padding: float = 0.5,
+        full_scan_every: int = 4,
+        motion_outside: float = 0.01,
+    ):
+        self.detect = detect
+        self.max_interval = max(1, max_interval)
+        self.interval = max(1, min(interval, self.max_interval))
+        self.min_confidence = min_confidence
+        self.min_iou = min_iou
+        self.roi_padding = roi_padding
+        self.full_scan_every = max(1, full_scan_every)
+        self.motion_outside = motion_outside
+        self.stats = DetectionStats()
+        self._prev: Optional[np.ndarray] = None
+        self._boxes: List[Box] = []
+        self._since_detect = 0
+        self._since_full_scan = 0
+        self.mode: Optional[str] = None  # how the latest frame was handled
+
+    def process(self, gray: np.ndarray, motion: Optional[np.ndarray] = None) -> List[Box]:
+        """Returns the face boxes of grayscale frame *gray*.
+
+        *motion* is an optional boolean mask of changed pixels (any
+        resolution, covering the whole frame) used to trigger full scans.
+        """
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        mode, adaptive = None, self.max_interval > 1 and self._prev is not None
+        if adaptive and self._since_detect + 1 < self.interval:
+            boxes, confidence = flow_boxes(self._prev, gray, self._boxes)
+            if (confidence >= self.min_confidence).all():
+                mode = TRACK
+                self._boxes = _clip_boxes(boxes, gray.shape)
+                self._since_detect += 1
+            else:
+                self.stats.forced += 1
+                self._adapt(agreed=False)
+                adaptive = False
+                self._since_full_scan = self.full_scan_every
+        if mode is None:
+            regions = self._regions(gray.shape)
+            if regions and self._since_full_scan + 1 < self.full_scan_every and not self._moved_outside(regions, motion, gray.shape):
+                mode = ROI
+                detected = self._detect_regions(gray, regions)
+                self._since_full_scan += 1
+                self.stats.scanned += sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions) / gray.size
+            else:
+                mode = DETECT
+                detected = [tuple(int(v) for v in box) for box in self.detect(gray)]
+                self._since_full_scan = 0
+                self.stats.scanned += 1.0
+            detected = _clip_boxes(detected, gray.shape)
+            if adaptive:
+                self._adapt(agreed=self._agrees(detected))
+            self._boxes = detected
+            self._since_detect = 0
+        self._prev = gray
+        self.mode = mode
+        self.stats.record(mode, started, cpu_started)
+        return list(self._boxes)
+
+    def rescale(self, ratio: float) -> None:
+        """Follows a change of the detection resolution by *ratio*.
+
+        Known boxes are scaled (they still seed region scans); optical flow
+        needs two frames of one size, so the next frame is detected.
+        """
+        self._boxes = [tuple(int(round(v * ratio)) for v in box) for box in self._boxes]
+        self._prev = None
+
+    def reset(self) -> None:
+        """Forgets the tracked boxes; the next frame is detected afresh."""
+        self._prev = None
+        self._boxes = []
+        self._since_detect = 0
+        self._since_full_scan = 0
+
+    def _regions(self, shape: Tuple[int, ...]) -> List[Tuple[int, int, int, int]]:
+        """Padded search regions ``(x1, y1, x2, y2)`` around the known faces, overlaps merged."""
+        height, width = shape[:2]
+        regions = []
+        for x, y, w, h in self._boxes:
+            pad = int(self.roi_padding * max(w, h))
+            regions.append([max(0, x - pad), max(0, y - pad), min(width, x + w + pad), min(height, y + h + pad)])
+        merged = True
+        while merged and len(regions) > 1:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    a, b = regions[i], regions[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del regions[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return [tuple(r) for r in regions]
+
+    def _detect_regions(self, gray: np.ndarray, regions) -> List[Box]:
+        """Runs the detector on each region; returns boxes in frame coordinates."""
+        found: List[Box] = []
+        for x1, y1, x2, y2 in regions:
+            for x, y, w, h in self.detect(gray[y1:y2, x1:x2]):
+                found.append((int(x) + x1, int(y) + y1, int(w), int(h)))
+        return found
+
+    def _moved_outside(self, regions, motion: Optional[np.ndarray], shape: Tuple[int, ...]) -> bool:
+        """Whether the motion mask shows change outside the search regions."""
+        if motion is None or not self.motion_outside:
+            return False
+        scale_y = motion.shape[0] / shape[0]
+        scale_x = motion.shape[1] / shape[1]
+        outside = motion.copy()
+        for x1, y1, x2, y2 in regions:
+            outside[int(y1 * scale_y) : int(np.ceil(y2 * scale_y)), int(x1 * scale_x) : int(np.ceil(x2 * scale_x))] = False
+        return np.count_nonzero(outside) > self.motion_outside * outside.size
+
+    def _agrees(self, detected: List[Box]) -> bool:
+        """Whether *detected* are the boxes being tracked, one for one."""
+        if len(detected) != len(self._boxes):
+            return False
+        if not detected:
+            return True
+        iou = box_iou(self._boxes, detected)
+        return bool((iou.max(axis=1) >= self.min_iou).all() and (iou.max(axis=0) >= self.min_iou).all())
+
+    def _adapt(self, agreed: bool) -> None:
+        if agreed:
+            self.interval = min(self.max_interval, self.interval + 1)
+        else:
+            self.interval = max(1, self.interval // 2)
+
+
+class ScaleController:
+    """Picks the detection resolution and the face sizes the detector looks for.
+
+    Face widths seen in the full-size frame (:meth:`observe`) are kept for
+    the last *window* detections. Once there are *min_samples*, the
+    detector is limited to faces between the 5th percentile shrunk by
+    *margin* and the 95th grown by it (*min_size* / *max_size*), instead of
+    every scale from the cascade's window up to the whole frame. Every
+    *explore_every*-th call searches all sizes, so faces outside the learnt
+    range can still be found and widen it.
+
+    The down-scale *factor* is revisited every *adjust_every* frames from
+    the mean frame latency (:meth:`record_frame`): over *budget_ms* it
+    drops by *step*, under 70% of the budget it rises by *step*, always
+    within ``[min_factor, max_factor]`` and never so low that the smallest
+    expected face would be under *min_detect_px* pixels where the detector
+    sees it. The dead band between 70% and 100% of the budget keeps small
+    latency wobbles from changing the resolution back and forth.
+    """
+
+    def __init__(
+        self,
+        factor: float = 0.5,
+        min_factor: float = 0.25,
+        max_factor: float = 1.0,
+        budget_ms: float = 66.0,
+        min_detect_px: int = 40,
+        margin: float = 1.3,
+        step: float = 0.05,
+        window: int = 200,
+        min_samples: int = 20,
+        adjust_every: int = 30,
+        explore_every: int = 20,
+    ):
+        self.min_factor = min_factor
+        self.max_factor = max(min_factor, max_factor)
+        self.factor = min(self.max_factor, max(min_factor, factor))
+        self.budget_ms = budget_ms
+        self.min_detect_px = min_detect_px
+        self.margin = margin
+        self.step = step
+        self.min_samples = min_samples
+        self.adjust_every = adjust_every
+        self.explore_every = explore_every
+        self.adjustments = 0
+        self._widths: Deque[float] = deque(maxlen=window)
+        self._latency_ms = 0.0
+        self._frames = 0
+        self._frame_ms = 0.0
+        self._calls = 0
+
+    def observe(self, widths: Sequence[float]) -> None:
+        """Adds the widths (full-frame pixels) of freshly detected faces."""
+        self._widths.extend(float(w) for w in widths)
+
+    def face_range(self) -> Optional[Tuple[float, float]]:
+        """Expected face widths in full-frame pixels, or ``None`` while still learning."""
+        if len(self._widths) < self.min_samples:
+            return None
+        low, high = np.percentile(np.fromiter(self._widths, dtype=np.float32), (5, 95))
+        return float(low) / self.margin, float(high) * self.margin
+
+    def size_bounds(self) -> Dict[str, Tuple[int, int]]:
+        """``min_size`` / ``max_size`` for the next detector call at the current factor."""
+        self._calls += 1
+        expected = self.face_range()
+        if expected is None or (self.explore_every and self._calls % self.explore_every == 0):
+            return {}
+        low, high = (int(round(v * self.factor)) for v in expected)
+        return {"min_size": (low, low), "max_size": (high, high)}
+
+    def record_frame(self, seconds: float) -> Optional[float]:
+        """Adds one processed frame's latency; returns the new factor if it changed."""
+        self._frames += 1
+        self._frame_ms += seconds * 1000.0
+        if self._frames < self.adjust_every:
+            return None
+        self._latency_ms = self._frame_ms / self._frames
+        self._frames, self._frame_ms = 0, 0.0
+
+        factor = self.factor
+        if self._latency_ms > self.budget_ms:
+            factor -= self.step
+        elif self._latency_ms < 0.7 * self.budget_ms:
+            factor += self.step
+        floor = self.min_factor
+        expected = self.face_range()
+        if expected is not None:
+            floor = max(floor, self.min_detect_px / max(expected[0], 1.0))
+        factor = round(min(self.max_factor, max(floor, factor)), 3)
+        if abs(factor - self.factor) < 1e-3:
+            return None
+        self.factor = factor
+        self.adjustments += 1
+        return factor
+
+    def as_dict(self) -> dict:
+        """Current settings and latency, for logging / tuning."""
+        expected = self.face_range()
+        bounds = {} if expected is None else {
+            "face_px": [round(expected[0] * self.margin), round(expected[1] / self.margin)],
+            "min_size": round(expected[0] * self.factor),
+            "max_size": round(expected[1] * self.factor),
+        }
+        return {
+            "factor": self.factor,
+            "latency_ms": round(self._latency_ms, 2),
+            "budget_ms": self.budget_ms,
+            "adjustments": self.adjustments,
+            "faces_seen": len(self._widths),
+            **bounds,
+        }
+
+
+def _clip_boxes(boxes: Sequence[Box], shape: Tuple[int, ...]) -> List[Box]:
+    """Clips boxes to the frame, dropping ones left with no area."""
+    height, width = shape[:2]
+    clipped = []
+    for x, y, w, h in boxes:
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(width, x + w), min(height, y + h)
+        if x2 - x1 > 1 and y2 - y1 > 1:
+            clipped.append((x1, y1, x2 - x1, y2 - y1))
+    return clipped
+
+
+def full_frame_boxes(boxes: Sequence[Box], factor: float, shape: Tuple[int, ...]) -> List[Box]:
+    """Maps boxes found on a frame shrunk by *factor* back to the full frame.
+
+    Corner by corner, so boxes neither shrink by rounding nor spill over
+    the frame's edge; boxes left empty by that are dropped, as a crop of
+    them could not be resized.
+    """
+    height, width = shape[:2]
+    mapped = []
+    for x, y, w, h in boxes:
+        x1, y1 = max(0, int(x / factor)), max(0, int(y / factor))
+        x2 = min(width, int(round((x + w) / factor)))
+        y2 = min(height, int(round((y + h) / factor)))
+        if x2 > x1 and y2 > y1:
+            mapped.append((x1, y1, x2 - x1, y2 - y1))
+    return mapped
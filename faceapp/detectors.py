@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Protocol, Tuple, Type
+
+import cv2
+import numpy as np
+
+from faceapp.common import MODELS_DIR
+from faceapp.tracking import Box
+
+# ---------------------------------------------------------------------------
+# Face detector backends
+# ---------------------------------------------------------------------------
+
+DEFAULT_DETECTOR: str = "haar"
+HAAR_FRONTAL_FACE: str = "haarcascade_frontalface_default.xml"
+DEFAULT_LBP_CASCADE: Path = MODELS_DIR / "lbpcascade_frontalface_improved.xml"
+DEFAULT_YUNET_MODEL: Path = MODELS_DIR / "face_detection_yunet_2023mar.onnx"
+
+
+class FaceDetector(Protocol):
+    """What the app needs from a face detector.
+
+    :meth:`detect` takes a grayscale image (a whole down-scaled frame or a
+    region of one) and returns ``(x, y, w, h)`` boxes in its pixels, all
+    within the image and none empty.
+    *min_size* / *max_size* bound the face widths searched for; detectors
+    that cannot restrict their search filter their results instead.
+    """
+
+    name: str
+
+    def detect(self, gray: np.ndarray, min_size: Optional[Tuple[int, int]] = None,
+               max_size: Optional[Tuple[int, int]] = None) -> List[Box]: ...
+
+
+class CascadeDetector:
+    """An OpenCV cascade classifier (Haar or LBP features).
+
+    ``cv2.CascadeClassifier`` keeps per-call scratch state, so one instance
+    must not run :meth:`detect` from several threads at once; give each
+    thread its own through a :class:`DetectorPool`.
+    """
+
+    name = "cascade"
+
+    def __init__(self, cascade: str | Path, scale_factor: float = 1.1, min_neighbors: int = 5):
+        self.cascade = Path(cascade)
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        if not self.cascade.is_file():
+            raise FileNotFoundError(f"cascade not found: {self.cascade}")
+        self._classifier = cv2.CascadeClassifier(str(self.cascade))
+        if self._classifier.empty():
+            raise ValueError(f"could not load cascade {self.cascade}")
+
+    def detect(self, gray: np.ndarray, min_size: Optional[Tuple[int, int]] = None,
+               max_size: Optional[Tuple[int, int]] = None) -> List[Box]:
+        faces = self._classifier.detectMultiScale(
+            gray,
+            scaleFactor=self.scale_factor,
+            minNeighbors=self.min_neighbors,
+            minSize=min_size or (0, 0),
+            maxSize=max_size or (0, 0),
+        )
+        return [tuple(int(v) for v in face) for face in faces]
+
+
+class HaarDetector(CascadeDetector):
+    """OpenCV's Haar frontal-face cascade - the original detector."""
+
+    name = "haar"
+
+    def __init__(self, cascade: str | Path = Path(cv2.data.haarcascades) / HAAR_FRONTAL_FACE, **options):
+        super().__init__(cascade, **options)
+
+
+class LbpDetector(CascadeDetector):
+    """LBP frontal-face cascade: several times faster than Haar, a little less accurate.
+
+    The cascade (``lbpcascade_frontalface_improved.xml`` from OpenCV's
+    ``data/lbpcascades``) is not part of the Python OpenCV package and is
+    expected in ``models/``.
+    """
+
+    name = "lbp"
+
+    def __init__(self, cascade: str | Path = DEFAULT_LBP_CASCADE, **options):
+        super().__init__(cascade, **options)
+
+
+class YuNetDetector:
+    """OpenCV's YuNet CNN face detector (``cv2.FaceDetectorYN``) on the CPU.
+
+    The most robust to pose and lighting and the slowest of the three.
+    The ONNX model (OpenCV Zoo) is expected in ``models/``. YuNet wants
+    colour input, so grayscale images are replicated to three channels.
+    Its boxes can overhang the image; they are clipped to it.
+    Each thread gets its own detector, as the input size is per-instance
+    state.
+    """
+
+    name = "yunet"
+
+    def __init__(
+        self,
+        model: str | Path = DEFAULT_YUNET_MODEL,
+        score_threshold: float = 0.9,
+        nms_threshold: float = 0.3,
+        top_k: int = 5000,
+    ):
+        self.model = Path(model)
+        if not self.model.is_file():
+            raise FileNotFoundError(f"YuNet model not found: {self.model}")
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        self.top_k = top_k
+        self._local = threading.local()
+        self._detector((64, 64))  # fail early on an unreadable model
+
+    def _detector(self, size: Tuple[int, int]) -> "cv2.FaceDetectorYN":
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            detector = cv2.FaceDetectorYN.create(
+                str(self.model), "", size, self.score_threshold, self.nms_threshold, self.top_k
+            )
+            self._local.detector = detector
+        return detector
+
+    def detect(self, gray: np.ndarray, min_size: Optional[Tuple[int, int]] = None,
+               max_size: Optional[Tuple[int, int]] = None) -> List[Box]:
+        image = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR) if gray.ndim == 2 else gray
+        size = (image.shape[1], image.shape[0])
+        detector = self._detector(size)
+        detector.setInputSize(size)
+        _, faces = detector.detect(image)
+        if faces is None:
+            return []
+        low = min_size[0] if min_size else 0
+        high = max_size[0] if max_size else float("inf")
+        height, width = gray.shape[:2]
+        boxes = []
+        for face in faces:
+            if not low <= face[2] <= high:
+                continue
+            x, y, w, h = (int(round(v)) for v in face[:4])
+            x1, y1 = max(0, x), max(0, y)
+            x2, y2 = min(width, x + w), min(height, y + h)
+            if x2 > x1 and y2 > y1:
+                boxes.append((x1, y1, x2 - x1, y2 - y1))
+        return boxes
+
+
+class DetectorPool:
+    """One *name* detector per thread, created on the thread's first use.
+
+    The pool itself is a :class:`FaceDetector`: :meth:`detect` runs on the
+    calling thread's own instance, so the camera, result and enrolment
+    threads can share the pool and detect in parallel without locking.
+    :meth:`get` hands out that instance directly. Worker processes make
+    their own detectors and need no pool. The calling thread's detector
+    is created right away, so a bad model or option fails here.
+    """
+
+    def __init__(self, name: str = DEFAULT_DETECTOR, options: Optional[Dict[str, object]] = None):
+        self.name = name
+        self.options = dict(options or {})
+        self.instances = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.get()
+
+    def get(self) -> FaceDetector:
+        """The calling thread's detector."""
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            detector = self._local.detector = make_detector(self.name, **self.options)
+            with self._lock:
+                self.instances += 1
+        return detector
+
+    def detect(self, gray: np.ndarray, min_size: Optional[Tuple[int, int]] = None,
+               max_size: Optional[Tuple[int, int]] = None) -> List[Box]:
+        return self.get().detect(gray, min_size, max_size)
+
+
+DETECTORS: Dict[str, Type] = {
+    "haar": HaarDetector,
+    "lbp": LbpDetector,
+    "yunet": YuNetDetector,
+}
+
+
+def make_detector(name: str = DEFAULT_DETECTOR, **options) -> FaceDetector:
+    """Creates the *name* detector; *options* go to its constructor."""
+    try:
+        cls = DETECTORS[name]
+    except KeyError:
+        raise ValueError(f"unknown face detector {name!r} (expected one of {sorted(DETECTORS)})") from None
+    return cls(**options)
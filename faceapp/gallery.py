@@ -0,0 +1,485 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, TypeVar
+
+import cv2
+import numpy as np
+
+from faceapp.common import FACE_SIZE, Logger, ensure_dir, write_json_atomic
+from faceapp.backends import DEFAULT_BACKEND, RecognizerBackend, load_backend
+from faceapp.recognition import GalleryMatcher, lbp_histogram
+from faceapp.store import SampleStore
+
+# ---------------------------------------------------------------------------
+# Gallery layout
+# ---------------------------------------------------------------------------
+
+SAMPLE_EXTENSIONS: Tuple[str, ...] = (".jpg", ".png")
+MODEL_CACHE_DIRNAME: str = ".model_cache"
+# Legacy sample files are moved here once they are in the packed store.
+MIGRATED_DIRNAME: str = ".migrated_samples"
+# ...and the ones that could not be migrated (unreadable, badly named) here,
+# so they are reported once rather than on every start.
+QUARANTINE_DIRNAME: str = ".unreadable_samples"
+MIGRATION_BATCH: int = 256
+
+# Bump whenever the on-disk cache layout changes so stale caches are rebuilt.
+MODEL_CACHE_VERSION: int = 5
+
+# file name -> (size in bytes, mtime in ns)
+Manifest = Dict[str, Tuple[int, int]]
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def parse_sample_name(file: str) -> Optional[Tuple[str, str]]:
+    """Splits ``<name>_<EMP_ID>_<nnn>.jpg`` into ``(name, emp_id)``.
+
+    Names may contain underscores (spaces are stored as ``_``), so the
+    employee id and sample number are taken from the right.
+    """
+    parts = file.rsplit("_", 2)
+    if len(parts) != 3 or not parts[0] or not parts[1]:
+        return None
+    return parts[0].lower(), parts[1].upper()
+
+
+def scan_manifest(gallery_dir: str | Path) -> Manifest:
+    """Stats every sample image in *gallery_dir* without decoding it."""
+    manifest: Manifest = {}
+    with os.scandir(gallery_dir) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(SAMPLE_EXTENSIONS) or not entry.is_file():
+                continue
+            st = entry.stat()
+            manifest[entry.name] = (st.st_size, st.st_mtime_ns)
+    return manifest
+
+
+# ---------------------------------------------------------------------------
+# Parallel sample loading
+# ---------------------------------------------------------------------------
+
+
+class DecodedFile(NamedTuple):
+    file: str
+    name: str
+    emp_id: str
+    image: np.ndarray
+
+
+class EncodedSample(NamedTuple):
+    row: int
+    id: int
+    name: str
+    emp_id: str
+    features: np.ndarray
+
+
+class SampleLoader:
+    """Runs per-sample work on a thread pool and streams results in input order.
+
+    :meth:`encode_rows` encodes faces straight from a :class:`SampleStore`
+    (no decoding); :meth:`decode_files` reads and resizes legacy JPEG/PNG
+    samples for migration. OpenCV and the large NumPy kernels release the
+    GIL, so both scale with cores. At most *max_in_flight* samples are queued
+    or finished-but-unconsumed at any time, which bounds memory no matter how
+    large the gallery is, and results come out in the order they were asked
+    for, so label assignment is deterministic.
+
+    Per-stage timings (summed over workers) and the wall time are kept in
+    :attr:`timings`; *progress* is called as ``progress(done, total)``.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_in_flight: Optional[int] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or 4 * self.workers
+        self._progress = progress
+        self._timing_lock = threading.Lock()
+        self.timings: Dict[str, float] = {}
+
+    def _add_timing(self, stage: str, seconds: float) -> None:
+        with self._timing_lock:
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def encode_rows(
+        self,
+        store: SampleStore,
+        rows: Sequence[int],
+        encode: Callable[[np.ndarray], np.ndarray] = lbp_histogram,
+    ) -> Iterator[EncodedSample]:
+        """Yields the features (*encode* of the face, LBP by default) of every store row in *rows*, in order."""
+        faces, records = store.faces(), store.records()
+
+        def _encode(row: int) -> np.ndarray:
+            started = time.perf_counter()
+            face = np.array(faces[row])  # pages the sample in from the mapping
+            read = time.perf_counter()
+            features = encode(face)
+            self._add_timing("read", read - started)
+            self._add_timing("encode", time.perf_counter() - read)
+            return features
+
+        for row, features in self._ordered(list(rows), _encode):
+            record = records[row]
+            yield EncodedSample(row, int(record["id"]), *store.person(int(record["identity"])), features)
+
+    def decode_files(self, gallery_dir: str | Path, files: Sequence[str]) -> Iterator[DecodedFile]:
+        """Yields a resized face per readable, well-named sample file, in order."""
+        gallery_dir = Path(gallery_dir)
+        jobs = []
+        for file in files:
+            if not file.lower().endswith(SAMPLE_EXTENSIONS):
+                continue
+            parsed = parse_sample_name(file)
+            if parsed is None:
+                Logger(f"[WARN] Skipping unrecognised filename format: {file}")
+                continue
+            jobs.append((file, *parsed))
+
+        def _decode(job: Tuple[str, str, str]) -> Optional[np.ndarray]:
+            started = time.perf_counter()
+            img_gray = cv2.imread(str(gallery_dir / job[0]), cv2.IMREAD_GRAYSCALE)
+            decoded = time.perf_counter()
+            self._add_timing("decode", decoded - started)
+            if img_gray is None:
+                Logger(f"[WARN] Could not read sample file: {job[0]}")
+                return None
+            # Samples are kept at FACE_SIZE x FACE_SIZE, whatever was on disk.
+            img_resized = cv2.resize(img_gray, (FACE_SIZE, FACE_SIZE))
+            self._add_timing("resize", time.perf_counter() - decoded)
+            return img_resized
+
+        for (file, name, emp_id), image in self._ordered(jobs, _decode):
+            if image is not None:
+                yield DecodedFile(file, name, emp_id, image)
+
+    def _ordered(self, jobs: Sequence[T], fn: Callable[[T], R]) -> Iterator[Tuple[T, R]]:
+        """Maps *fn* over *jobs* on the pool, yielding ``(job, result)`` in job order."""
+        self.timings = {}
+        wall_start = time.perf_counter()
+        total = len(jobs)
+        pending: Deque[Tuple[T, Future]] = deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="SampleLoader") as pool:
+            submitted = 0
+            for done in range(total):
+                while submitted < total and len(pending) < self.max_in_flight:
+                    pending.append((jobs[submitted], pool.submit(fn, jobs[submitted])))
+                    submitted += 1
+                job, future = pending.popleft()
+                result = future.result()
+                if self._progress is not None:
+                    self._progress(done + 1, total)
+                yield job, result
+        self.timings["wall"] = time.perf_counter() - wall_start
+
+
+def migrate_sample_files(gallery_dir: str | Path, store: SampleStore, loader: SampleLoader) -> int:
+    """Moves legacy one-file-per-sample images in *gallery_dir* into *store*.
+
+    Files are decoded on *loader*'s pool and appended in name order, keeping
+    their sample number and modification time. Once a batch is safely in the
+    store its files are moved to ``MIGRATED_DIRNAME`` (never deleted), so an
+    interrupted migration simply resumes on the next start. Files that cannot
+    be decoded or whose names do not parse are moved to
+    ``QUARANTINE_DIRNAME`` at the end, so the next start does not rescan them.
+    Returns the number of samples migrated.
+    """
+    gallery_dir = Path(gallery_dir)
+    manifest = scan_manifest(gallery_dir)
+    if not manifest:
+        return 0
+    Logger(f"[INFO] Migrating {len(manifest)} sample files into the packed store…")
+    migrated_dir = gallery_dir / MIGRATED_DIRNAME
+    ensure_dir(migrated_dir)
+
+    batch: List[DecodedFile] = []
+
+    def _flush() -> None:
+        name, emp_id = batch[0].name, batch[0].emp_id
+        store.append(
+            [item.image for item in batch],
+            name,
+            emp_id,
+            samples=_sample_numbers([item.file for item in batch]),
+            timestamps=[manifest[item.file][1] / 1e9 for item in batch],
+        )
+        for item in batch:
+            os.replace(gallery_dir / item.file, migrated_dir / item.file)
+        batch.clear()
+
+    migrated = 0
+    decoded = set()
+    for item in loader.decode_files(gallery_dir, sorted(manifest)):
+        if batch and (item.emp_id != batch[0].emp_id or len(batch) >= MIGRATION_BATCH):
+            _flush()
+        batch.append(item)
+        decoded.add(item.file)
+        migrated += 1
+    if batch:
+        _flush()
+    Logger(f"[INFO] Migrated {migrated} samples; original files kept in {migrated_dir}.")
+
+    rejected = sorted(set(manifest) - decoded)
+    if rejected:
+        quarantine_dir = gallery_dir / QUARANTINE_DIRNAME
+        ensure_dir(quarantine_dir)
+        for file in rejected:
+            os.replace(gallery_dir / file, quarantine_dir / file)
+        Logger(f"[WARN] Moved {len(rejected)} sample files that could not be migrated to {quarantine_dir}.")
+    return migrated
+
+
+def _sample_numbers(files: Sequence[str]) -> Optional[List[int]]:
+    """Sample numbers encoded in legacy file names (``None``: let the store number them)."""
+    digits = [Path(file).stem.rsplit("_", 1)[-1] for file in files]
+    if not all(d.isdigit() for d in digits):
+        return None
+    return [int(d) for d in digits]
+
+
+# ---------------------------------------------------------------------------
+# Identity index
+# ---------------------------------------------------------------------------
+
+
+class IdentityIndex:
+    """One recogniser label per employee, indexed both ways.
+
+    Every sample of an employee is trained under the same label, so the label
+    space grows with the workforce rather than with the number of images.
+    Lookups by label (recognition) and by emp_id (enrolment, photo updates)
+    are both dictionary hits. A published index is treated as read-only;
+    updates work on a :meth:`copy`.
+    """
+
+    def __init__(self):
+        self._by_label: Dict[int, Tuple[str, str]] = {}
+        self._by_emp_id: Dict[str, int] = {}
+        self.sample_counts: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_label)
+
+    def __contains__(self, emp_id: str) -> bool:
+        return emp_id in self._by_emp_id
+
+    def get(self, label: int, default: Tuple[str, str] = ("unknown", "")) -> Tuple[str, str]:
+        """Returns ``(name, emp_id)`` for a recogniser *label*."""
+        return self._by_label.get(label, default)
+
+    def label_for(self, emp_id: str) -> Optional[int]:
+        """Returns the recogniser label of *emp_id*, if enrolled."""
+        return self._by_emp_id.get(emp_id)
+
+    def name_for(self, emp_id: str) -> Optional[str]:
+        """Returns the stored name of *emp_id*, if enrolled."""
+        label = self._by_emp_id.get(emp_id)
+        return None if label is None else self._by_label[label][0]
+
+    def ensure(self, name: str, emp_id: str) -> int:
+        """Returns the label of *emp_id*, allocating the next free one if new."""
+        label = self._by_emp_id.get(emp_id)
+        if label is None:
+            label = max(self._by_label, default=-1) + 1
+            self._by_label[label] = (name, emp_id)
+            self._by_emp_id[emp_id] = label
+            self.sample_counts.setdefault(emp_id, 0)
+        return label
+
+    def add_samples(self, emp_id: str, count: int = 1) -> None:
+        """Records *count* more training samples for *emp_id*."""
+        self.sample_counts[emp_id] = self.sample_counts.get(emp_id, 0) + count
+
+    def copy(self) -> "IdentityIndex":
+        """Returns an independent copy (used to build the next model version)."""
+        clone = IdentityIndex()
+        clone._by_label = dict(self._by_label)
+        clone._by_emp_id = dict(self._by_emp_id)
+        clone.sample_counts = dict(self.sample_counts)
+        return clone
+
+    def items(self):
+        """Iterates ``(label, (name, emp_id))`` pairs."""
+        return self._by_label.items()
+
+    def to_json(self) -> dict:
+        """Serialises the index for the model cache."""
+        return {
+            "labels": {str(lbl): list(ident) for lbl, ident in self._by_label.items()},
+            "sample_counts": dict(self.sample_counts),
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "IdentityIndex":
+        """Rebuilds an index written by :meth:`to_json`."""
+        index = cls()
+        for lbl, (name, emp_id) in data["labels"].items():
+            index._by_label[int(lbl)] = (name, emp_id)
+            index._by_emp_id[emp_id] = int(lbl)
+        index.sample_counts = {k: int(v) for k, v in data.get("sample_counts", {}).items()}
+        return index
+
+
+# ---------------------------------------------------------------------------
+# Trained-model cache
+# ---------------------------------------------------------------------------
+
+
+class ModelCache:
+    """Persists a recogniser backend and its identity index next to the gallery.
+
+    Every cached sample carries its :class:`SampleStore` id, so the cache is
+    reconciled with the store rather than invalidated by it (see
+    :func:`gallery_delta`): samples appended since are topped up and retired
+    ones dropped. Only a recreated store (new generation) forces a retrain.
+
+    Each named *shard* has its own cache under ``shards/<shard>``; ``None``
+    is the global model over the whole gallery. Backends other than the
+    default LBPH one (built with *options*, see
+    :func:`~faceapp.backends.make_backend`) are kept in a subdirectory named
+    after them.
+    """
+
+    def __init__(
+        self,
+        gallery_dir: str | Path,
+        shard: Optional[str] = None,
+        backend: str = DEFAULT_BACKEND,
+        options: Optional[dict] = None,
+    ):
+        self._dir = Path(gallery_dir) / MODEL_CACHE_DIRNAME
+        if shard is not None:
+            self._dir = self._dir / "shards" / shard
+        if backend != DEFAULT_BACKEND:
+            self._dir = self._dir / backend
+        self._backend = backend
+        self._options = dict(options or {})
+        self._labels_file = self._dir / "identities.json"
+        self._manifest_file = self._dir / "manifest.json"
+
+    def load(self) -> Optional[Tuple[RecognizerBackend, IdentityIndex, str]]:
+        """Returns the cached (matcher, identities, store generation), if any."""
+        if not self._manifest_file.is_file():
+            return None
+        try:
+            with self._manifest_file.open("r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("version") != MODEL_CACHE_VERSION:
+                return None
+            if stored.get("backend", DEFAULT_BACKEND) != self._backend:
+                return None
+            generation = stored["store"]
+            with self._labels_file.open("r", encoding="utf-8") as f:
+                identities = IdentityIndex.from_json(json.load(f))
+            matcher = load_backend(self._backend, self._dir, **self._options)
+        except (OSError, ValueError, KeyError, IndexError) as exc:
+            Logger(f"[WARN] Ignoring unreadable model cache: {exc}")
+            return None
+        return matcher, identities, generation
+
+    def save(
+        self,
+        matcher: RecognizerBackend,
+        identities: IdentityIndex,
+        generation: str,
+    ) -> None:
+        """Writes the model, identities and manifest (manifest last, as commit marker)."""
+        try:
+            ensure_dir(self._dir)
+            # Drop the old manifest first so a crash mid-write never leaves a
+            # manifest that vouches for a half-written model.
+            self._manifest_file.unlink(missing_ok=True)
+            matcher.save(self._dir)
+            write_json_atomic(self._labels_file, identities.to_json())
+            write_json_atomic(
+                self._manifest_file,
+                {"version": MODEL_CACHE_VERSION, "store": generation, "backend": self._backend},
+            )
+        except OSError as exc:
+            Logger(f"[WARN] Could not write model cache: {exc}")
+
+
+def gallery_delta(
+    matcher: RecognizerBackend, store: SampleStore, live_rows: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Compares *matcher* with the live samples of *store*, by sample id.
+
+    Returns ``(stale_columns, new_rows)``: matcher columns whose samples are
+    no longer live (retired, never stored, or outside *live_rows* when the
+    matcher covers only part of the store) and store rows the matcher does
+    not have yet.
+    """
+    if live_rows is None:
+        live_rows = store.live_rows()
+    live_ids = store.records()["id"][live_rows]
+    stale_columns = np.flatnonzero(~np.isin(matcher.ids, live_ids))
+    new_rows = live_rows[~np.isin(live_ids, matcher.ids)]
+    return stale_columns, new_rows
+
+
+# ---------------------------------------------------------------------------
+# Per-identity sample budget
+# ---------------------------------------------------------------------------
+
+
+def select_representatives(
+    hists: np.ndarray,
+    budget: int,
+    max_iter: int = 20,
+    distance: Callable[[np.ndarray, np.ndarray], np.ndarray] = GalleryMatcher.pairwise,
+) -> np.ndarray:
+    """Picks *budget* of the ``(n, D)`` samples that best cover them all.
+
+    k-medoids under the recogniser's own *distance* (LBPH chi-square by
+    default; pass the backend's :meth:`pairwise`): seeded with the overall
+    medoid plus farthest-point picks, then refined by alternating
+    assignment / medoid updates (n is one person's samples, so the n x n
+    distance matrix is tiny). Returns sorted sample indices.
+    """
+    n = len(hists)
+    if n <= budget:
+        return np.arange(n)
+    hists = np.asarray(hists, dtype=np.float32)
+    dist = np.asarray(distance(hists, hists), dtype=np.float32)
+    np.maximum(dist, 0, out=dist)
+
+    medoids = [int(dist.sum(axis=1).argmin())]
+    nearest = dist[medoids[0]].copy()
+    # Chosen samples are masked out: with duplicate samples every distance
+    # left can be 0, and argmax would pick a chosen one again.
+    nearest[medoids[0]] = -np.inf
+    while len(medoids) < budget:
+        far = int(nearest.argmax())
+        medoids.append(far)
+        np.minimum(nearest, dist[far], out=nearest)
+        nearest[far] = -np.inf
+
+    medoids = np.array(medoids)
+    for _ in range(max_iter):
+        assign = dist[:, medoids].argmin(axis=1)
+        # Each medoid stays in its own cluster (ties at 0 could move it), so
+        # the clusters - and the medoids picked from them - stay distinct.
+        assign[medoids] = np.arange(budget)
+        updated = medoids.copy()
+        for cluster in range(budget):
+            members = np.flatnonzero(assign == cluster)
+            if len(members):
+                updated[cluster] = members[dist[np.ix_(members, members)].sum(axis=1).argmin()]
+        if np.array_equal(np.sort(updated), np.sort(medoids)):
+            break
+        medoids = updated
+    return np.sort(medoids)
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, NamedTuple, Optional, Sequence, Tuple
+
+from faceapp.common import Logger
+from faceapp.gallery import IdentityIndex
+from faceapp.backends import RecognizerBackend
+
+# ---------------------------------------------------------------------------
+# Versioned, double-buffered recognition model
+# ---------------------------------------------------------------------------
+
+
+class ModelSnapshot(NamedTuple):
+    """A matcher and the identity index it was trained with, published together."""
+
+    version: int
+    matcher: RecognizerBackend
+    identities: IdentityIndex
+
+
+# A model update receives the current snapshot and returns the next
+# (matcher, identities) pair. It must not mutate the snapshot it was given.
+ModelUpdate = Callable[[ModelSnapshot], Tuple[RecognizerBackend, IdentityIndex]]
+
+
+class ModelHolder:
+    """Holds the live recognition model and swaps in new versions atomically.
+
+    Readers call :meth:`snapshot` and use the returned tuple for a whole
+    frame; that is a single reference read, so they never block and can
+    never pair a new matcher with an old identity index.
+
+    Writers go through :meth:`submit`: updates run one at a time on a
+    background worker, each starting from the latest snapshot, and their
+    result is published with one reference assignment. Updates build a new
+    matcher (usually a cheap :meth:`~RecognizerBackend.fork`) instead of
+    mutating the one readers are using.
+
+    Several holders may share one single-worker *executor* (see
+    :class:`faceapp.shards.ShardRegistry`); its owner then shuts it down.
+    """
+
+    def __init__(
+        self,
+        matcher: RecognizerBackend,
+        identities: IdentityIndex,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        self._snapshot = ModelSnapshot(1, matcher, identities)
+        self._publish_lock = threading.Lock()
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="ModelTrainer")
+
+    def snapshot(self) -> ModelSnapshot:
+        """Returns the current model; safe to call from any thread, never blocks."""
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def publish(self, matcher: RecognizerBackend, identities: IdentityIndex) -> int:
+        """Makes (*matcher*, *identities*) the live model; returns its version."""
+        with self._publish_lock:
+            self._snapshot = ModelSnapshot(self._snapshot.version + 1, matcher, identities)
+            return self._snapshot.version
+
+    def submit(self, update: ModelUpdate, description: str = "model update") -> Future:
+        """Runs *update* on the background worker and publishes its result.
+
+        The returned future resolves to the published version (or raises
+        the update's exception, which is also logged).
+        """
+        def _run() -> int:
+            try:
+                matcher, identities = update(self._snapshot)
+            except Exception as exc:
+                Logger(f"[ERROR] {description} failed: {exc}")
+                raise
+            version = self.publish(matcher, identities)
+            Logger(f"[INFO] {description} published as model v{version}.")
+            return version
+
+        return self._executor.submit(_run)
+
+    def shutdown(self, wait: bool = False) -> None:
+        """Stops accepting updates (pending ones are dropped unless *wait*)."""
+        if self._owns_executor:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def gather(futures: Sequence[Future]) -> Future:
+    """Returns a future that resolves once all *futures* are done.
+
+    Its result is the list of their results; it fails with the first
+    exception (or cancellation) among them.
+    """
+    combined: Future = Future()
+    if not futures:
+        combined.set_result([])
+        return combined
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _done(_future: Future) -> None:
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        for future in futures:
+            if future.cancelled():
+                combined.cancel()
+                return
+            if future.exception() is not None:
+                combined.set_exception(future.exception())
+                return
+        combined.set_result([future.result() for future in futures])
+
+    for future in futures:
+        future.add_done_callback(_done)
+    return combined
+
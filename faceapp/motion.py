@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import time
+from collections import deque
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+# ---------------------------------------------------------------------------
+# Motion gate: keep detection asleep while nothing moves
+# ---------------------------------------------------------------------------
+
+
+class MotionStats:
+    """Idle/active time of the gate and how quickly it woke up (the last *window* wakes)."""
+
+    def __init__(self, window: int = 1000):
+        self.idle_s = 0.0
+        self.active_s = 0.0
+        self.wakes = 0
+        self.wake_latencies_ms: deque = deque(maxlen=window)
+
+    @property
+    def idle_share(self) -> float:
+        """Share of the time detection and recognition were asleep."""
+        total = self.idle_s + self.active_s
+        return self.idle_s / total if total else 0.0
+
+    def as_dict(self) -> dict:
+        """Snapshot for logging / the UI."""
+        latencies = self.wake_latencies_ms or [0.0]
+        return {
+            "idle_s": round(self.idle_s, 1),
+            "active_s": round(self.active_s, 1),
+            "idle_share": round(self.idle_share, 4),
+            "wakes": self.wakes,
+            "wake_latency_ms": round(float(np.mean(latencies)), 1),
+            "max_wake_latency_ms": round(float(np.max(latencies)), 1),
+        }
+
+
+class MotionGate:
+    """Frame differencing on a tiny thumbnail decides when to wake up.
+
+    Every frame is shrunk to *thumbnail* (w, h) pixels, converted to gray
+    and blurred, and compared with a running-average background. The
+    scene has changed when more than *min_changed* of the thumbnail
+    pixels differ from it by over *pixel_delta* grey levels for
+    *confirm_frames* frames in a row, which ignores single-frame flicker
+    and sensor noise. The background slowly follows the scene (*learning_rate*)
+    so lighting drift does not count as motion.
+
+    The gate then stays active while there is motion or faces, and falls
+    asleep *hold_s* seconds after the last of either. Wake latency is
+    measured from the first changed frame to the wake-up. :attr:`motion_mask`
+    holds the changed thumbnail pixels of the latest frame, for callers
+    that want to know *where* something moved.
+    """
+
+    def __init__(
+        self,
+        thumbnail: Tuple[int, int] = (64, 48),
+        pixel_delta: int = 12,
+        min_changed: float = 0.01,
+        confirm_frames: int = 2,
+        hold_s: float = 5.0,
+        learning_rate: float = 0.05,
+    ):
+        self.thumbnail = thumbnail
+        self.pixel_delta = pixel_delta
+        self.min_changed = min_changed
+        self.confirm_frames = max(1, confirm_frames)
+        self.hold_s = hold_s
+        self.learning_rate = learning_rate
+        self.stats = MotionStats()
+        self.active = True  # until the background has been learnt
+        self.motion_mask: Optional[np.ndarray] = None
+        self._background: Optional[np.ndarray] = None
+        self._changed_frames = 0
+        self._first_change = 0.0
+        self._last_busy = time.monotonic()
+        self._last_update = self._last_busy
+
+    def update(self, frame: np.ndarray, faces_present: bool = False) -> bool:
+        """Feeds one BGR camera frame; returns whether it should be processed.
+
+        *faces_present* tells the gate that the previous processed frame
+        had faces in it, which keeps it awake even if the person stands
+        still.
+        """
+        now = time.monotonic()
+        elapsed, self._last_update = now - self._last_update, now
+        if self.active:
+            self.stats.active_s += elapsed
+        else:
+            self.stats.idle_s += elapsed
+
+        small = cv2.cvtColor(cv2.resize(frame, self.thumbnail, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        small = cv2.GaussianBlur(small, (5, 5), 0).astype(np.float32)
+        if self._background is None:
+            self._background = small
+            return self.active
+        self.motion_mask = cv2.absdiff(small, self._background) > self.pixel_delta
+        changed = np.count_nonzero(self.motion_mask) / small.size
+        cv2.accumulateWeighted(small, self._background, self.learning_rate)
+
+        if changed > self.min_changed:
+            if not self._changed_frames:
+                self._first_change = now
+            self._changed_frames += 1
+        else:
+            self._changed_frames = 0
+        if self._changed_frames >= self.confirm_frames or faces_present:
+            self._last_busy = now
+            if not self.active:
+                self.active = True
+                self.stats.wakes += 1
+                started = self._first_change if self._changed_frames else now
+                self.stats.wake_latencies_ms.append((now - started) * 1000.0)
+        elif self.active and now - self._last_busy > self.hold_s:
+            self.active = False
+        return self.active
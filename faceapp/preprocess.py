@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from faceapp.common import FACE_SIZE
+from faceapp.tracking import Box
+
+# ---------------------------------------------------------------------------
+# Per-frame preprocessing into reused buffers
+# ---------------------------------------------------------------------------
+
+
+class PreprocessStats:
+    """Time spent preprocessing and how often a buffer had to be allocated."""
+
+    def __init__(self):
+        self.frames = 0
+        self.crops = 0
+        self.allocations = 0
+        self.seconds = 0.0
+
+    def as_dict(self) -> dict:
+        """Snapshot for logging / the UI."""
+        frames = max(self.frames, 1)
+        return {
+            "frames": self.frames,
+            "crops": self.crops,
+            "allocations": self.allocations,
+            "allocations_per_frame": round(self.allocations / frames, 4),
+            "ms": round(1000.0 * self.seconds / frames, 3),
+        }
+
+
+class FramePreprocessor:
+    """One pass over each camera frame: grayscale once, everything else from it.
+
+    :meth:`prepare` converts the BGR frame to grayscale (:attr:`gray`) and
+    shrinks that for detection; :meth:`crops` cuts faces out of the same
+    full-resolution gray image (or of another frame's, when that was
+    detected elsewhere), resized to *face_size* x *face_size* - the
+    size the recognisers were trained on. Results are written into buffers
+    kept from frame to frame through OpenCV's ``dst=`` arguments, which are
+    only reallocated when the frame or detection size changes or more
+    faces are in view than ever before.
+
+    The down-scaled images alternate between two buffers because the
+    detector keeps the previous one for optical flow; crops are only valid
+    until the next call of :meth:`crops`.
+    """
+
+    def __init__(self, face_size: int = FACE_SIZE):
+        self.face_size = face_size
+        self.stats = PreprocessStats()
+        self.gray: Optional[np.ndarray] = None
+        self._small: List[Optional[np.ndarray]] = [None, None]
+        self._turn = 0
+        self._crops = np.empty((0, face_size, face_size), dtype=np.uint8)
+
+    def _buffer(self, current: Optional[np.ndarray], shape: Tuple[int, ...]) -> np.ndarray:
+        if current is not None and current.shape == shape:
+            return current
+        self.stats.allocations += 1
+        return np.empty(shape, dtype=np.uint8)
+
+    def _to_gray(self, frame: np.ndarray) -> None:
+        self.gray = self._buffer(self.gray, frame.shape[:2])
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+    def prepare(self, frame: np.ndarray, factor: float) -> np.ndarray:
+        """Converts *frame* to gray and returns it shrunk by *factor* for detection."""
+        started = time.perf_counter()
+        h, w = frame.shape[:2]
+        self._to_gray(frame)
+        size = (int(w * factor), int(h * factor))
+        self._turn ^= 1
+        small = self._small[self._turn] = self._buffer(self._small[self._turn], (size[1], size[0]))
+        cv2.resize(self.gray, size, dst=small)
+        self.stats.frames += 1
+        self.stats.seconds += time.perf_counter() - started
+        return small
+
+    def crops(self, boxes: Sequence[Box], frame: Optional[np.ndarray] = None) -> List[np.ndarray]:
+        """Face crops of the last prepared frame (or of BGR *frame*), ``face_size`` square, in box order."""
+        if not len(boxes):
+            return []
+        started = time.perf_counter()
+        if frame is not None:
+            self._to_gray(frame)
+        if len(boxes) > len(self._crops):
+            self._crops = np.empty((len(boxes), self.face_size, self.face_size), dtype=np.uint8)
+            self.stats.allocations += 1
+        out = []
+        for crop, (x, y, w, h) in zip(self._crops, boxes):
+            cv2.resize(self.gray[y : y + h, x : x + w], (self.face_size, self.face_size), dst=crop)
+            out.append(crop)
+        self.stats.crops += len(out)
+        self.stats.seconds += time.perf_counter() - started
+        return out
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from faceapp.recognition import HISTOGRAM_SIZE, chi_square_distances, lbp_histogram
+
+# ---------------------------------------------------------------------------
+# Enrolment sample quality gate
+# ---------------------------------------------------------------------------
+
+# Rejection reasons, worded for the status label.
+REASON_TOO_SMALL = "Move closer to the camera"
+REASON_TOO_DARK = "Too dark – face the light"
+REASON_TOO_BRIGHT = "Too bright – avoid strong backlight"
+REASON_BLURRED = "Hold still – photo is blurred"
+REASON_DUPLICATE = "Turn your head slightly"
+
+
+class QualityReport(NamedTuple):
+    accepted: bool
+    reason: str  # empty when accepted
+    face_px: int
+    brightness: float
+    clipped: float
+    sharpness: float
+    novelty: float  # chi-square distance to the closest kept sample
+    histogram: Optional[np.ndarray]  # LBP histogram, when it was computed
+
+
+class QualityStats:
+    """Accepted / rejected candidate counts, by rejection reason."""
+
+    def __init__(self):
+        self.candidates = 0
+        self.accepted = 0
+        self.rejected: Dict[str, int] = {}
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.candidates if self.candidates else 1.0
+
+    def record(self, report: QualityReport) -> None:
+        self.candidates += 1
+        if report.accepted:
+            self.accepted += 1
+        else:
+            self.rejected[report.reason] = self.rejected.get(report.reason, 0) + 1
+
+    def merge(self, other: "QualityStats") -> None:
+        """Adds *other*'s counts to these."""
+        self.candidates += other.candidates
+        self.accepted += other.accepted
+        for reason, count in other.rejected.items():
+            self.rejected[reason] = self.rejected.get(reason, 0) + count
+
+    def as_dict(self) -> dict:
+        """Snapshot for logging / the UI."""
+        return {
+            "candidates": self.candidates,
+            "accepted": self.accepted,
+            "acceptance_rate": round(self.acceptance_rate, 3),
+            "rejected": dict(self.rejected),
+        }
+
+
+class SampleQualityGate:
+    """Decides whether a captured face adds information to the gallery.
+
+    Checks run cheapest first and stop at the first failure:
+
+    * size - the detected face must be at least *min_face_px* wide/high in
+      the camera frame (upscaled tiny faces carry no texture);
+    * exposure - mean brightness within *brightness* and at most
+      *max_clipped* of the pixels crushed to black or blown to white;
+    * sharpness - variance of the Laplacian of the ``FACE_SIZE`` crop at
+      least *min_sharpness* (motion blur and defocus flatten it);
+    * novelty - the LBP chi-square distance to every sample already kept
+      for this person (gallery samples passed as *reference* plus the ones
+      accepted in this session) must be at least *min_novelty*, so
+      near-identical consecutive frames are dropped.
+
+    The LBP histogram computed for the novelty check is returned in the
+    report so enrolment does not compute it again.
+    """
+
+    def __init__(
+        self,
+        reference: Optional[np.ndarray] = None,
+        *,
+        min_face_px: int = 80,
+        brightness: Tuple[float, float] = (50.0, 200.0),
+        max_clipped: float = 0.25,
+        min_sharpness: float = 35.0,
+        min_novelty: float = 8.0,
+    ):
+        self.min_face_px = min_face_px
+        self.brightness = brightness
+        self.max_clipped = max_clipped
+        self.min_sharpness = min_sharpness
+        self.min_novelty = min_novelty
+        self.stats = QualityStats()
+        self._kept: List[np.ndarray] = []
+        if reference is not None and len(reference):
+            self._kept.extend(np.asarray(reference, dtype=np.float32).reshape(-1, HISTOGRAM_SIZE))
+
+    def check(self, face: np.ndarray, face_px: int) -> QualityReport:
+        """Scores a resized grayscale *face* detected *face_px* pixels wide.
+
+        Accepted faces are remembered for later novelty checks.
+        """
+        report = self._score(face, face_px)
+        self.stats.record(report)
+        if report.accepted:
+            self._kept.append(report.histogram)
+        return report
+
+    def _score(self, face: np.ndarray, face_px: int) -> QualityReport:
+        brightness = clipped = sharpness = 0.0
+        novelty = float("inf")
+
+        def _reject(reason: str, hist: Optional[np.ndarray] = None) -> QualityReport:
+            return QualityReport(False, reason, face_px, brightness, clipped, sharpness, novelty, hist)
+
+        if face_px < self.min_face_px:
+            return _reject(REASON_TOO_SMALL)
+
+        brightness = float(face.mean())
+        clipped = float(np.count_nonzero((face <= 10) | (face >= 245))) / face.size
+        if brightness < self.brightness[0] or (clipped > self.max_clipped and brightness < 128):
+            return _reject(REASON_TOO_DARK)
+        if brightness > self.brightness[1] or clipped > self.max_clipped:
+            return _reject(REASON_TOO_BRIGHT)
+
+        sharpness = float(cv2.Laplacian(face, cv2.CV_32F).var())
+        if sharpness < self.min_sharpness:
+            return _reject(REASON_BLURRED)
+
+        hist = lbp_histogram(face)
+        if self._kept:
+            kept = np.stack(self._kept)
+            novelty = float(chi_square_distances(hist[None, :], kept.T, kept.sum(axis=1)).min())
+            if novelty < self.min_novelty:
+                return _reject(REASON_DUPLICATE, hist)
+        return QualityReport(True, "", face_px, brightness, clipped, sharpness, novelty, hist)
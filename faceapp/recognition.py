@@ -0,0 +1,456 @@
+from __future__ import annotations
+
+import math
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from faceapp.ann import IVFIndex, RecallStats
+
+if TYPE_CHECKING:
+    from faceapp.cascade import CoarseFilter
+
+# ---------------------------------------------------------------------------
+# LBP feature extraction (bit-compatible with cv2.face.LBPHFaceRecognizer)
+# ---------------------------------------------------------------------------
+
+LBP_RADIUS: int = 1
+LBP_NEIGHBORS: int = 8
+LBP_GRID_X: int = 8
+LBP_GRID_Y: int = 8
+LBP_PATTERNS: int = 1 << LBP_NEIGHBORS
+HISTOGRAM_SIZE: int = LBP_GRID_X * LBP_GRID_Y * LBP_PATTERNS
+
+_FLT_EPSILON = np.finfo(np.float32).eps
+
+
+def _sampling_points(radius: int, neighbors: int):
+    """Yields the (fy, fx, cy, cx, w1..w4) interpolation taps of OpenCV's elbp."""
+    for n in range(neighbors):
+        # Same double -> float rounding as the C++ implementation, so the
+        # near-zero cos/sin terms produce identical taps.
+        x = np.float32(radius * math.cos(2.0 * math.pi * n / float(np.float32(neighbors))))
+        y = np.float32(-radius * math.sin(2.0 * math.pi * n / float(np.float32(neighbors))))
+        fx, fy = int(math.floor(x)), int(math.floor(y))
+        cx, cy = int(math.ceil(x)), int(math.ceil(y))
+        ty, tx = np.float32(y - fy), np.float32(x - fx)
+        one = np.float32(1)
+        yield n, fy, fx, cy, cx, (one - tx) * (one - ty), tx * (one - ty), (one - tx) * ty, tx * ty
+
+
+_TAPS = tuple(_sampling_points(LBP_RADIUS, LBP_NEIGHBORS))
+
+
+def lbp_codes(gray: np.ndarray) -> np.ndarray:
+    """Returns the extended (circular) LBP code image of a grayscale crop."""
+    r = LBP_RADIUS
+    src = np.asarray(gray, dtype=np.float32)
+    rows, cols = src.shape
+    centre = src[r : rows - r, r : cols - r]
+    codes = np.zeros(centre.shape, dtype=np.int32)
+
+    def shifted(dy: int, dx: int) -> np.ndarray:
+        return src[r + dy : rows - r + dy, r + dx : cols - r + dx]
+
+    for n, fy, fx, cy, cx, w1, w2, w3, w4 in _TAPS:
+        t = w1 * shifted(fy, fx) + w2 * shifted(fy, cx) + w3 * shifted(cy, fx) + w4 * shifted(cy, cx)
+        codes |= ((t > centre) | (np.abs(t - centre) < _FLT_EPSILON)).astype(np.int32) << n
+    return codes
+
+
+def lbp_histogram(gray: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Returns the normalised spatial LBP histogram of *gray* (float32 vector).
+
+    Matches ``LBPHFaceRecognizer`` with its default parameters: an 8x8 grid
+    of 256-bin histograms, each normalised by its cell area.
+    """
+    codes = lbp_codes(gray)
+    height = codes.shape[0] // LBP_GRID_Y
+    width = codes.shape[1] // LBP_GRID_X
+    if out is None:
+        out = np.empty(HISTOGRAM_SIZE, dtype=np.float32)
+    if height == 0 or width == 0:
+        out.fill(0)
+        return out
+    cells = codes[: height * LBP_GRID_Y, : width * LBP_GRID_X]
+    cell_index = (np.arange(LBP_GRID_Y).repeat(height)[:, None] * LBP_GRID_X
+                  + np.arange(LBP_GRID_X).repeat(width)[None, :])
+    counts = np.bincount((cell_index * LBP_PATTERNS + cells).ravel(), minlength=HISTOGRAM_SIZE)
+    np.multiply(counts, np.float32(1.0 / (height * width)), out=out, casting="unsafe")
+    return out
+
+
+def lbp_histograms(faces: Iterable[np.ndarray]) -> np.ndarray:
+    """Stacks the LBP histograms of *faces* into an ``(N, HISTOGRAM_SIZE)`` matrix."""
+    faces = list(faces)
+    hists = np.empty((len(faces), HISTOGRAM_SIZE), dtype=np.float32)
+    for i, face in enumerate(faces):
+        lbp_histogram(face, out=hists[i])
+    return hists
+
+
+def chi_square_distances(
+    queries: np.ndarray,
+    gallery_bins: np.ndarray,
+    gallery_sums: np.ndarray,
+    *,
+    columns: Optional[np.ndarray] = None,
+    block_elems: int = 1 << 22,
+) -> np.ndarray:
+    """Batched ``HISTCMP_CHISQR_ALT`` distances, shape ``(len(queries), N)``.
+
+    *gallery_bins* is the bin-major ``(HISTOGRAM_SIZE, N)`` gallery matrix and
+    *gallery_sums* its per-sample totals; *columns* restricts scoring to a
+    subset of gallery samples (``N == len(columns)``). Uses the identity
+
+        (q - g)^2 / (q + g) == q + g - 4 q g / (q + g)
+
+    so only the bins a query actually populates (typically a quarter of
+    them) are read, each as one contiguous gallery row.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    if columns is not None:
+        gallery_sums = gallery_sums[columns]
+    n = len(gallery_sums)
+    out = np.empty((queries.shape[0], n), dtype=np.float32)
+    if n == 0:
+        return out
+    step = min(1024, max(8, block_elems // n))
+    acc = np.empty(n, dtype=np.float32)
+    for i, query in enumerate(queries):
+        bins = np.flatnonzero(query)
+        acc.fill(0)
+        for start in range(0, len(bins), step):
+            rows = bins[start : start + step]
+            if columns is None:
+                g = gallery_bins[rows]  # contiguous row gather -> (len(rows), N) copy
+            else:
+                g = gallery_bins[np.ix_(rows, columns)]
+            q = query[rows][:, None]
+            den = g + q
+            np.multiply(g, q, out=g)
+            np.divide(g, den, out=g)
+            acc += g.sum(axis=0)
+        np.multiply(acc, -4.0, out=out[i])
+        out[i] += gallery_sums
+        out[i] += query.sum()
+    out *= 2.0
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Gallery matcher
+# ---------------------------------------------------------------------------
+
+
+class MatchResult(NamedTuple):
+    """Best identity for one face plus the runner-up candidates."""
+
+    label: int
+    distance: float
+    candidates: List[Tuple[int, float]]  # (label, distance), best first, one per identity
+
+
+class GalleryMatcher:
+    """Nearest-neighbour LBPH matcher over one contiguous float32 matrix.
+
+    Produces the same labels and distances as ``LBPHFaceRecognizer.predict``
+    (distance == LBPH "confidence") but scores the faces of a frame against
+    the whole gallery with vectorised NumPy, and also reports the top-k
+    identities. The matrix is stored bin-major, ``(HISTOGRAM_SIZE, capacity)``,
+    so the chi-square kernel reads whole rows; samples are appended into
+    spare columns, so enrolment is amortised O(new samples).
+
+    With an :class:`~faceapp.ann.IVFIndex` attached (:meth:`attach_index`)
+    only the index's shortlist is scored exactly, trading a measured amount
+    of recall (``index.stats``) for sub-linear search. Smaller galleries can
+    use a :class:`~faceapp.cascade.CoarseFilter` instead (:meth:`attach_cascade`),
+    which shortlists identities on compact descriptors before the exact
+    comparison (``cascade.stats``).
+
+    Each sample may carry an id (its sample store id, ``-1`` if unknown) so
+    retired samples can later be found and dropped with :meth:`without`.
+
+    This is the ``"lbph"`` engine of :mod:`faceapp.backends`; its features
+    are the LBP histograms themselves.
+    """
+
+    name = "lbph"
+    # LBPH distance below which a face counts as recognised.
+    threshold = 60.0
+    encode = staticmethod(lbp_histograms)
+    encode_one = staticmethod(lbp_histogram)
+
+    def __init__(
+        self,
+        bins: Optional[np.ndarray] = None,
+        labels: Optional[np.ndarray] = None,
+        sums: Optional[np.ndarray] = None,
+        ids: Optional[np.ndarray] = None,
+    ):
+        if bins is None or labels is None:
+            bins = np.empty((HISTOGRAM_SIZE, 0), dtype=np.float32)
+            labels = np.empty(0, dtype=np.int32)
+        self._count = len(labels)
+        self._bins = bins
+        self._labels = np.asarray(labels, dtype=np.int32)
+        if sums is None:
+            sums = bins[:, : self._count].sum(axis=0, dtype=np.float32)
+        self._sums = np.asarray(sums, dtype=np.float32)
+        if ids is None:
+            ids = np.full(self._count, -1, dtype=np.int64)
+        self._ids = np.asarray(ids, dtype=np.int64)
+        self.index: Optional[IVFIndex] = None
+        self.cascade: Optional[CoarseFilter] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def bins(self) -> np.ndarray:
+        """The bin-major ``(HISTOGRAM_SIZE, N)`` gallery matrix."""
+        return self._bins[:, : self._count]
+
+    @property
+    def labels(self) -> np.ndarray:
+        """Identity label of each gallery sample."""
+        return self._labels[: self._count]
+
+    @property
+    def ids(self) -> np.ndarray:
+        """Sample id of each gallery sample (``-1`` where unknown)."""
+        return self._ids[: self._count]
+
+    def histograms_for(self, label: int) -> np.ndarray:
+        """Returns a ``(n, HISTOGRAM_SIZE)`` copy of the samples stored under *label*."""
+        return self.bins[:, np.flatnonzero(self.labels == label)].T.copy()
+
+    def features(self, columns: Optional[np.ndarray] = None) -> np.ndarray:
+        """Sample-major ``(n, HISTOGRAM_SIZE)`` view of all (or *columns* of the) samples."""
+        return (self.bins if columns is None else self.bins[:, columns]).T
+
+    @staticmethod
+    def pairwise(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Chi-square distances between two ``(n, HISTOGRAM_SIZE)`` sets of histograms."""
+        b = np.asarray(b, dtype=np.float32)
+        return chi_square_distances(a, np.ascontiguousarray(b.T), b.sum(axis=1))
+
+    def memory_bytes(self) -> int:
+        """Bytes held by the gallery arrays, spare capacity included."""
+        return self._bins.nbytes + self._labels.nbytes + self._sums.nbytes + self._ids.nbytes
+
+    def train(self, faces: Sequence[np.ndarray], labels: Sequence[int], ids: Optional[Sequence[int]] = None) -> None:
+        """Replaces the gallery with *faces*."""
+        self.__init__()
+        self.add(faces, labels, ids)
+
+    def add(self, faces: Sequence[np.ndarray], labels: Sequence[int], ids: Optional[Sequence[int]] = None) -> None:
+        """Appends grayscale face crops with their identity labels (and sample ids)."""
+        self.add_histograms(lbp_histograms(faces), labels, ids)
+
+    def add_histograms(self, hists: np.ndarray, labels: Sequence[int], ids: Optional[Sequence[int]] = None) -> None:
+        """Appends precomputed ``(n, HISTOGRAM_SIZE)`` histograms with their labels (and sample ids)."""
+        n = len(hists)
+        if n == 0:
+            return
+        needed = self._count + n
+        capacity = self._bins.shape[1]
+        if needed > capacity or not self._bins.flags.writeable:
+            capacity = max(needed, 2 * capacity, 64)
+            grown = np.empty((HISTOGRAM_SIZE, capacity), dtype=np.float32)
+            grown[:, : self._count] = self.bins
+            self._bins = grown
+            self._labels = np.resize(self._labels[: self._count], capacity)
+            self._sums = np.resize(self._sums[: self._count], capacity)
+            self._ids = np.resize(self._ids[: self._count], capacity)
+        self._bins[:, self._count : needed] = hists.T
+        self._labels[self._count : needed] = labels
+        self._ids[self._count : needed] = -1 if ids is None else ids
+        self._sums[self._count : needed] = hists.sum(axis=1, dtype=np.float32)
+        self._count = needed
+        if self.index is not None:
+            if self.index.needs_retrain(self._count):
+                self.index.train(self.bins)
+            else:
+                self.index.add(hists)
+        if self.cascade is not None:
+            self.cascade.add(hists)
+
+    add_features = add_histograms
+
+    def fork(self) -> "GalleryMatcher":
+        """Returns a matcher that can be appended to without disturbing this one.
+
+        Storage is shared, not copied: the fork writes new samples into the
+        spare capacity past this matcher's row count, which this matcher
+        never reads. Only the newest version of a gallery may be forked
+        (see :class:`faceapp.model.ModelHolder`), otherwise two forks would
+        write into the same spare rows.
+        """
+        clone = GalleryMatcher.__new__(GalleryMatcher)
+        clone._count = self._count
+        clone._bins, clone._labels, clone._sums, clone._ids = self._bins, self._labels, self._sums, self._ids
+        clone.index = self.index.fork() if self.index is not None else None
+        clone.cascade = self.cascade.fork() if self.cascade is not None else None
+        return clone
+
+    def without(self, columns: Sequence[int]) -> "GalleryMatcher":
+        """Returns a compacted copy of this matcher with gallery *columns* dropped.
+
+        Costs one copy of the kept histograms. An attached index or cascade
+        is compacted along with the gallery rather than rebuilt.
+        """
+        keep = np.ones(self._count, dtype=bool)
+        keep[np.asarray(columns, dtype=np.intp)] = False
+        clone = GalleryMatcher(
+            np.ascontiguousarray(self.bins[:, keep]),
+            self.labels[keep],
+            self._sums[: self._count][keep],
+            self.ids[keep],
+        )
+        clone.index = self.index.without(keep) if self.index is not None else None
+        clone.cascade = self.cascade.without(keep) if self.cascade is not None else None
+        return clone
+
+    def attach_index(self, index: IVFIndex) -> None:
+        """Routes matching through *index*, training it unless it is already current."""
+        if not index.trained or len(index) != self._count:
+            index.train(self.bins)
+        self.index = index
+
+    def attach_cascade(self, cascade: CoarseFilter) -> None:
+        """Routes matching through a coarse-to-fine *cascade*, filling it unless it is current."""
+        if len(cascade) != self._count:
+            cascade.train(self.bins)
+        self.cascade = cascade
+
+    def match(self, faces: Sequence[np.ndarray], top_k: int = 3) -> List[MatchResult]:
+        """Scores every face of a frame against the whole gallery."""
+        if not faces:
+            return []
+        return self.match_histograms(lbp_histograms(faces), top_k)
+
+    def match_histograms(self, queries: np.ndarray, top_k: int = 3) -> List[MatchResult]:
+        """Like :meth:`match` for precomputed query histograms."""
+        if self._count == 0:
+            return [MatchResult(-1, float("inf"), []) for _ in range(len(queries))]
+        if self.index is not None and self.index.trained:
+            return [self._match_indexed(query, top_k) for query in queries]
+        if self.cascade is not None and self.cascade.trained:
+            return [self._match_cascade(query, top_k) for query in queries]
+        dists = chi_square_distances(queries, self.bins, self._sums[: self._count])
+        return [rank_identities(row, self.labels, top_k) for row in dists]
+
+    predict = match
+    match_features = match_histograms
+
+    def _match_indexed(self, query: np.ndarray, top_k: int) -> MatchResult:
+        """Scores one query against the index shortlist (auditing some queries)."""
+        started = time.perf_counter()
+        rows = self.index.search(query)
+        if len(rows) == 0:
+            return self._match_exact(query, top_k)[0][0]
+        dists = chi_square_distances(query[None, :], self.bins, self._sums[: self._count], columns=rows)[0]
+        result = rank_identities(dists, self.labels[rows], top_k)
+        if self.index.audit_due():
+            ann_s = time.perf_counter() - started
+            exact, exact_s = self._match_exact(query, top_k)
+            nearest = int(np.argmin(exact[1]))
+            self.index.record_audit(result.label, exact[0].label, nearest in set(rows.tolist()), ann_s, exact_s)
+        return result
+
+    def _match_cascade(self, query: np.ndarray, top_k: int) -> MatchResult:
+        """Scores one query against the cascade's identity shortlist (auditing some queries)."""
+        started = time.perf_counter()
+        rows = self.cascade.search(query, self.labels)
+        if rows is None:
+            return self._match_exact(query, top_k)[0][0]
+        shortlisted = time.perf_counter()
+        dists = chi_square_distances(query[None, :], self.bins, self._sums[: self._count], columns=rows)[0]
+        result = rank_identities(dists, self.labels[rows], top_k)
+        finished = time.perf_counter()
+        self.cascade.record(shortlisted - started, finished - shortlisted)
+        if self.cascade.audit_due():
+            exact, exact_s = self._match_exact(query, top_k)
+            exact_label = exact[0].label
+            self.cascade.record_audit(
+                result.label, exact_label, bool(np.any(self.labels[rows] == exact_label)), finished - started, exact_s
+            )
+        return result
+
+    def _match_exact(self, query: np.ndarray, top_k: int):
+        started = time.perf_counter()
+        dists = chi_square_distances(query[None, :], self.bins, self._sums[: self._count])[0]
+        return (rank_identities(dists, self.labels, top_k), dists), time.perf_counter() - started
+
+    def evaluate_recall(self, faces: Sequence[np.ndarray], top_k: int = 1) -> dict:
+        """Compares indexed and exact search on *faces*; returns recall and latency.
+
+        ``top1_recall`` is the share of faces given the same identity by both,
+        ``nn_recall`` the share whose exact nearest sample was shortlisted.
+        """
+        if self.index is None or not self.index.trained:
+            raise RuntimeError("no trained ANN index attached")
+        saved_stats, saved_every = self.index.stats, self.index.audit_every
+        self.index.stats, self.index.audit_every = RecallStats(), 1
+        try:
+            self.match(faces, top_k)
+            return self.index.stats.as_dict()
+        finally:
+            self.index.stats, self.index.audit_every = saved_stats, saved_every
+
+    # -- persistence -------------------------------------------------------
+
+    def save(self, directory: Path) -> None:
+        """Writes ``bins``/``labels``/``sums``/``ids.npy`` (and ``ann.npz``) into *directory*."""
+        arrays = (("bins", self.bins), ("labels", self.labels), ("sums", self._sums[: self._count]), ("ids", self.ids))
+        for name, data in arrays:
+            tmp = directory / f"{name}.tmp.npy"
+            np.save(tmp, data)
+            tmp.replace(directory / f"{name}.npy")
+        ann_file = directory / "ann.npz"
+        if self.index is not None and self.index.trained:
+            self.index.save(ann_file)
+        else:
+            ann_file.unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, directory: Path) -> "GalleryMatcher":
+        """Memory-maps a gallery written by :meth:`save`.
+
+        Loading is O(1) in gallery size: histogram pages are faulted in by
+        the first match, and copied out only if the gallery is appended to.
+        """
+        bins = np.load(directory / "bins.npy", mmap_mode="r")
+        labels = np.load(directory / "labels.npy")
+        sums = np.load(directory / "sums.npy")
+        ids = np.load(directory / "ids.npy")
+        if bins.ndim != 2 or bins.shape[0] != HISTOGRAM_SIZE or not bins.shape[1] == len(labels) == len(sums) == len(ids):
+            raise ValueError("gallery histogram/label shapes do not match")
+        matcher = cls(bins, labels, sums, ids)
+        ann_file = directory / "ann.npz"
+        if ann_file.is_file():
+            index = IVFIndex.load(ann_file)
+            if len(index) == len(labels):
+                matcher.index = index
+        return matcher
+
+
+def rank_identities(dists: np.ndarray, labels: np.ndarray, top_k: int) -> MatchResult:
+    """Reduces per-sample distances to the best *top_k* identities."""
+    k = min(len(dists), max(top_k, 1) * 8)
+    nearest = np.argpartition(dists, k - 1)[:k] if k < len(dists) else np.arange(len(dists))
+    nearest = nearest[np.argsort(dists[nearest], kind="stable")]
+    candidates: List[Tuple[int, float]] = []
+    seen = set()
+    for idx in nearest:
+        lbl = int(labels[idx])
+        if lbl in seen:
+            continue
+        seen.add(lbl)
+        candidates.append((lbl, float(dists[idx])))
+        if len(candidates) >= top_k:
+            break
+    return MatchResult(candidates[0][0], candidates[0][1], candidates)
@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+from faceapp.backends import BACKENDS, DEFAULT_BACKEND
+from faceapp.camera import CameraSource
+from faceapp.detectors import DEFAULT_DETECTOR, DETECTORS
+from faceapp.common import Logger, write_json_atomic
+from faceapp.model import ModelHolder
+
+# ---------------------------------------------------------------------------
+# Gallery shards and kiosk configuration
+# ---------------------------------------------------------------------------
+
+# The implicit shard that contains every enrolled employee.
+GLOBAL_SHARD: str = "global"
+SHARDS_FILENAME: str = "shards.json"
+
+_SHARD_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+
+class KioskConfig(NamedTuple):
+    """Which shards one kiosk matches against (``kiosk.json``).
+
+    ``{"name": "north-gate", "shards": ["building-a", "night-shift"],
+    "fallback_to_global": true, "memory_budget_mb": 256,
+    "backend": "fisher", "backend_options": {"threshold": 3.0},
+    "detector": "lbp", "detector_options": {"min_neighbors": 4},
+    "cameras": [0, 1]}``
+
+    Faces are matched against *shards* in order; with *fallback_to_global*
+    the ones none of them recognised are retried against the global shard.
+    New registrations join the first named shard (the kiosk's home shard).
+    *backend* picks the recognition engine (see :mod:`faceapp.backends`)
+    and *backend_options* are passed to it; *detector* and
+    *detector_options* likewise pick the face detector (see
+    :mod:`faceapp.detectors`). *cameras* are the kiosk's camera sources -
+    device indices, or paths / URLs OpenCV can open - each shown in its own
+    preview tile.
+    """
+
+    name: str = "default"
+    shards: Tuple[str, ...] = (GLOBAL_SHARD,)
+    fallback_to_global: bool = False
+    memory_budget_mb: int = 256
+    backend: str = DEFAULT_BACKEND
+    backend_options: Optional[Dict[str, Any]] = None
+    detector: str = DEFAULT_DETECTOR
+    detector_options: Optional[Dict[str, Any]] = None
+    cameras: Tuple[CameraSource, ...] = (0,)
+
+    @property
+    def home_shard(self) -> Optional[str]:
+        """The shard new registrations at this kiosk are added to."""
+        return next((s for s in self.shards if s != GLOBAL_SHARD), None)
+
+
+def load_kiosk_config(path: str | Path) -> KioskConfig:
+    """Reads a kiosk configuration; a missing file means "global shard only"."""
+    path = Path(path)
+    if not path.is_file():
+        return KioskConfig()
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        shards = tuple(data.get("shards") or (GLOBAL_SHARD,))
+        bad = [s for s in shards if not isinstance(s, str) or not _SHARD_NAME.match(s)]
+        if bad:
+            raise ValueError(f"invalid shard names {bad}")
+        backend = str(data.get("backend", DEFAULT_BACKEND))
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown backend {backend!r}")
+        backend_options = data.get("backend_options") or {}
+        if not isinstance(backend_options, dict):
+            raise ValueError("backend_options must be an object")
+        detector = str(data.get("detector", DEFAULT_DETECTOR))
+        if detector not in DETECTORS:
+            raise ValueError(f"unknown detector {detector!r}")
+        detector_options = data.get("detector_options") or {}
+        if not isinstance(detector_options, dict):
+            raise ValueError("detector_options must be an object")
+        cameras = tuple(data.get("cameras") or (0,))
+        bad = [c for c in cameras if isinstance(c, bool) or not isinstance(c, (int, str)) or c == ""]
+        if bad:
+            raise ValueError(f"invalid camera sources {bad}")
+        config = KioskConfig(
+            name=str(data.get("name", "default")),
+            shards=shards,
+            fallback_to_global=bool(data.get("fallback_to_global", False)),
+            memory_budget_mb=int(data.get("memory_budget_mb", KioskConfig._field_defaults["memory_budget_mb"])),
+            backend=backend,
+            backend_options=backend_options,
+            detector=detector,
+            detector_options=detector_options,
+            cameras=cameras,
+        )
+    except (OSError, ValueError, TypeError) as exc:
+        Logger(f"[WARN] Ignoring invalid kiosk config {path}: {exc}")
+        return KioskConfig()
+    Logger(f"[INFO] Kiosk '{config.name}' matches shards {list(config.shards)}"
+           f"{' with global fallback' if config.fallback_to_global else ''} using the {config.detector} detector and {config.backend} backend"
+           f" on {len(config.cameras)} camera{'s' if len(config.cameras) > 1 else ''}.")
+    return config
+
+
+class ShardMembership:
+    """Which employees belong to which named shard (``shards.json`` in the gallery).
+
+    ``{"building-a": ["E001", "E002"], "night-shift": ["E002"]}`` - an
+    employee may be in several shards. :data:`GLOBAL_SHARD` is implicit and
+    contains everyone.
+    """
+
+    def __init__(self, gallery_dir: str | Path):
+        self._file = Path(gallery_dir) / SHARDS_FILENAME
+        self._lock = threading.Lock()
+        self._members: Dict[str, FrozenSet[str]] = {}
+        if self._file.is_file():
+            try:
+                with self._file.open("r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self._members = {
+                    shard: frozenset(ids) for shard, ids in data.items() if _SHARD_NAME.match(shard)
+                }
+            except (OSError, ValueError, AttributeError) as exc:
+                Logger(f"[WARN] Ignoring unreadable shard membership file: {exc}")
+
+    def members(self, shard: str) -> Optional[FrozenSet[str]]:
+        """Employee ids of *shard*; ``None`` for the global shard (everyone)."""
+        if shard == GLOBAL_SHARD:
+            return None
+        return self._members.get(shard, frozenset())
+
+    def contains(self, shard: str, emp_id: str) -> bool:
+        return shard == GLOBAL_SHARD or emp_id in self._members.get(shard, ())
+
+    def add(self, shard: str, emp_id: str) -> None:
+        """Adds *emp_id* to *shard* and saves the membership file."""
+        if self.contains(shard, emp_id):
+            return
+        with self._lock:
+            self._members[shard] = self._members.get(shard, frozenset()) | {emp_id}
+            write_json_atomic(self._file, {s: sorted(ids) for s, ids in self._members.items()})
+
+
+class ShardRegistry:
+    """Per-shard recognition models, loaded on demand and evicted LRU.
+
+    *open_shard* builds (or restores from its cache) the model of one shard
+    and is run on the registry's single ``ModelTrainer`` worker, which every
+    shard's :class:`ModelHolder` shares, so loads, enrolments and rebuilds
+    never overlap. :meth:`try_get` never waits for a load - the camera
+    thread gets ``None`` until the shard is ready - while :meth:`get` does.
+
+    Once the loaded galleries exceed *memory_budget* bytes the least
+    recently used shards are dropped, except the *pinned* ones (the kiosk's
+    own shards and its fallback), which would otherwise be reloaded over
+    and over; a warning says when those alone do not fit. Readers still
+    holding a snapshot of an evicted shard keep working, and it is
+    reloaded (from its model cache) the next time it is asked for.
+
+    A shard that fails to load is not retried for *retry_s* seconds; until
+    then :meth:`try_get` returns ``None`` and :meth:`get` raises the error
+    again, rather than queueing (and logging) a new load per frame.
+    """
+
+    def __init__(
+        self,
+        open_shard: Callable[[str, ThreadPoolExecutor], ModelHolder],
+        memory_budget: int,
+        pinned: Iterable[str] = (),
+        retry_s: float = 60.0,
+    ):
+        self._open_shard = open_shard
+        self.memory_budget = memory_budget
+        self.pinned = frozenset(pinned)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ModelTrainer")
+        self._lock = threading.Lock()
+        self._loaded: "OrderedDict[str, ModelHolder]" = OrderedDict()
+        self._loading: Dict[str, Future] = {}
+        self.retry_s = retry_s
+        self._failed: Dict[str, Tuple[float, BaseException]] = {}  # shard -> (when, error)
+        self.loads = 0
+        self.evictions = 0
+
+    def try_get(self, shard: str) -> Optional[ModelHolder]:
+        """The model holder of *shard* if it is loaded; otherwise starts loading it and returns ``None``."""
+        return self._lookup(shard)[0]
+
+    def get(self, shard: str) -> ModelHolder:
+        """Returns the model holder of *shard*, waiting for it to load if necessary."""
+        holder, future = self._lookup(shard)
+        if holder is not None:
+            return holder
+        if threading.current_thread().name.startswith("ModelTrainer"):
+            return self._load(shard)  # the queued load would wait behind us
+        return future.result()
+
+    def _lookup(self, shard: str) -> Tuple[Optional[ModelHolder], Optional[Future]]:
+        with self._lock:
+            holder = self._loaded.get(shard)
+            if holder is not None:
+                self._loaded.move_to_end(shard)
+                return holder, None
+            future = self._loading.get(shard)
+            if future is None:
+                failed_at, error = self._failed.get(shard, (None, None))
+                if failed_at is not None and time.monotonic() - failed_at < self.retry_s:
+                    future = Future()
+                    future.set_exception(error)
+                    return None, future
+                future = self._loading[shard] = self.executor.submit(self._load, shard)
+            return None, future
+
+    def _load(self, shard: str) -> ModelHolder:
+        """Runs on the ``ModelTrainer`` worker: opens *shard* unless it already is."""
+        with self._lock:
+            holder = self._loaded.get(shard)
+        if holder is not None:
+            return holder
+        try:
+            holder = self._open_shard(shard, self.executor)
+        except Exception as exc:
+            Logger(f"[ERROR] Could not load shard '{shard}' (retrying in {self.retry_s:.0f}s): {exc}")
+            with self._lock:
+                self._failed[shard] = (time.monotonic(), exc)
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(shard, None)
+        with self._lock:
+            self._failed.pop(shard, None)
+            self._loaded[shard] = holder
+            self.loads += 1
+            self._evict(keep=shard)
+        return holder
+
+    def loaded(self) -> List[Tuple[str, ModelHolder]]:
+        """Currently loaded ``(shard, holder)`` pairs, least recently used first."""
+        with self._lock:
+            return list(self._loaded.items())
+
+    def memory_bytes(self) -> int:
+        """Approximate size of all loaded galleries."""
+        return sum(_gallery_bytes(holder) for _, holder in self.loaded())
+
+    def shutdown(self, wait: bool = False) -> None:
+        """Drops pending model updates (unless *wait*) and stops the worker."""
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _evict(self, keep: str) -> None:
+        sizes = {shard: _gallery_bytes(holder) for shard, holder in self._loaded.items()}
+        total = sum(sizes.values())
+        for shard in list(self._loaded):
+            if total <= self.memory_budget:
+                break
+            if shard == keep or shard in self.pinned:
+                continue
+            total -= sizes[shard]
+            del self._loaded[shard]
+            self.evictions += 1
+            Logger(f"[INFO] Evicted shard '{shard}' to stay within {self.memory_budget >> 20} MB.")
+        pinned = sum(size for shard, size in sizes.items() if shard in self.pinned)
+        if keep in self.pinned and pinned > self.memory_budget:
+            Logger(f"[WARN] The kiosk's own shards need {pinned >> 20} MB, more than the "
+                   f"{self.memory_budget >> 20} MB memory budget; they are kept loaded regardless.")
+
+
+def _gallery_bytes(holder: ModelHolder) -> int:
+    return holder.snapshot().matcher.memory_bytes()
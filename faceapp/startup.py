@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from faceapp.common import Logger
+
+# ---------------------------------------------------------------------------
+# Staged start-up and readiness state
+# ---------------------------------------------------------------------------
+
+# Readiness stages, in the order a kiosk goes through them. The camera
+# preview runs from the start; faces are detected from DETECTING on and
+# recognised once READY. FAILED means the face detector could not be loaded;
+# a recogniser that fails to load leaves the kiosk at DETECTING.
+LOADING: str = "loading"
+DETECTING: str = "detecting"
+READY: str = "ready"
+FAILED: str = "failed"
+STAGES: Tuple[str, ...] = (LOADING, DETECTING, READY)
+
+
+class StartupTimeline:
+    """Readiness stage of a staged start-up and when each milestone was hit.
+
+    The app is usable in steps - UI and camera preview first, then face
+    detection, then recognition once the models are warm - so the stage is
+    advanced from whichever thread finishes a step. Milestones (stages as
+    well as events like ``"first frame"``) are recorded and logged once, in
+    seconds since the timeline was created.
+    """
+
+    def __init__(self):
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._marks: Dict[str, float] = {}
+        self.stage = LOADING
+
+    def reached(self, stage: str) -> bool:
+        """True once the start-up has got to *stage*; never true after a failure."""
+        if FAILED in (self.stage, stage):
+            return False
+        return STAGES.index(self.stage) >= STAGES.index(stage)
+
+    def advance(self, stage: str) -> None:
+        """Moves to *stage* and records it as a milestone."""
+        self.stage = stage
+        self.mark(stage)
+
+    def mark(self, milestone: str) -> bool:
+        """Records *milestone* the first time it is reached; returns whether it was new."""
+        if milestone in self._marks:  # per-frame callers take no lock
+            return False
+        with self._lock:
+            if milestone in self._marks:
+                return False
+            self._marks[milestone] = elapsed = time.perf_counter() - self._started
+        Logger(f"[INFO] Startup: reached '{milestone}' after {elapsed:.2f}s.")
+        return True
+
+    def elapsed(self, milestone: str) -> Optional[float]:
+        """Seconds from start-up to *milestone*, or ``None`` if not reached yet."""
+        return self._marks.get(milestone)
+
+    def as_dict(self) -> dict:
+        """Snapshot for logging / the UI."""
+        return {"stage": self.stage, **{m: round(t, 3) for m, t in self._marks.items()}}
@@ -0,0 +1,391 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Collection, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import cv2
+import numpy as np
+
+from faceapp.common import FACE_SIZE, Logger, ensure_dir
+
+# ---------------------------------------------------------------------------
+# Packed sample store
+# ---------------------------------------------------------------------------
+
+SAMPLE_STORE_DIRNAME: str = ".sample_store"
+SAMPLE_STORE_VERSION: int = 2
+FACE_BYTES: int = FACE_SIZE * FACE_SIZE
+
+# Retired samples are physically dropped once they exceed this share of the rows.
+STORE_COMPACT_RATIO: float = 0.25
+
+# One fixed-size index record per stored face, in row order. Ids are never
+# reused, so they stay valid across compactions (rows do not).
+RECORD_DTYPE = np.dtype([("id", "<i8"), ("identity", "<u4"), ("sample", "<u4"), ("timestamp", "<f8")])
+_V1_RECORD_DTYPE = np.dtype([("identity", "<u4"), ("sample", "<u4"), ("timestamp", "<f8")])
+
+
+class StoredSample(NamedTuple):
+    row: int
+    id: int
+    name: str
+    emp_id: str
+    sample: int
+    timestamp: float
+
+
+class SampleStore:
+    """Append-only packed store of ``FACE_SIZE`` x ``FACE_SIZE`` grayscale faces.
+
+    Lives in ``<gallery>/.sample_store/``:
+
+    * ``faces-<files>.u8`` - raw ``uint8[N, FACE_SIZE, FACE_SIZE]``,
+      memory-mapped for reading, so training touches pixels without decoding
+      anything;
+    * ``index-<files>.bin`` - ``RECORD_DTYPE[N]``: sample id, identity number,
+      per-identity sample number and capture time of every row;
+    * ``store.json`` - format version, generation, current file set, the
+      identity table (``[[name, emp_id], ...]``) and the retired sample ids.
+
+    Appends write the pixels first and the index records last, both at the
+    offset implied by the current row count, so a crash leaves at worst a
+    torn tail that is truncated on the next open. Retiring samples only
+    records their ids; once enough are retired the live rows are copied to a
+    new file set, which ``store.json`` then switches to atomically. Sample
+    ids survive that, and the generation changes only if the store is
+    recreated, so a model built from the store can be reconciled with it by
+    id (see :func:`faceapp.gallery.gallery_delta`).
+
+    Compaction renumbers rows: callers that hold row numbers must not retire
+    samples concurrently (the app does both on its single model worker).
+    """
+
+    def __init__(self, gallery_dir: str | Path):
+        self._dir = Path(gallery_dir) / SAMPLE_STORE_DIRNAME
+        self._meta_file = self._dir / "store.json"
+        self._lock = threading.Lock()
+        self._people: List[Tuple[str, str]] = []
+        self._people_by_emp_id: Dict[str, int] = {}
+        self._next_sample: Dict[int, int] = {}
+        self._next_id = 0
+        self._retired: Set[int] = set()
+        self._records = np.empty(0, dtype=RECORD_DTYPE)
+        self._count = 0
+        self._view: Optional[np.ndarray] = None
+        self._files = ""
+        self.generation = ""
+        self._open()
+
+    def __len__(self) -> int:
+        """Number of live (not retired) samples."""
+        return self._count - len(self._retired)
+
+    @property
+    def _faces_file(self) -> Path:
+        return self._dir / f"faces-{self._files}.u8"
+
+    @property
+    def _index_file(self) -> Path:
+        return self._dir / f"index-{self._files}.bin"
+
+    # -- reading ------------------------------------------------------------
+
+    def faces(self) -> np.ndarray:
+        """Read-only ``uint8[rows, FACE_SIZE, FACE_SIZE]`` view of all stored faces."""
+        count = self._count
+        view = self._view
+        if view is None or len(view) != count:
+            if count == 0:
+                return np.empty((0, FACE_SIZE, FACE_SIZE), dtype=np.uint8)
+            view = np.memmap(self._faces_file, dtype=np.uint8, mode="r", shape=(count, FACE_SIZE, FACE_SIZE))
+            self._view = view
+        return view
+
+    def records(self) -> np.ndarray:
+        """Index records of all stored rows (``RECORD_DTYPE``), retired ones included."""
+        return self._records[: self._count]
+
+    def live_rows(self, emp_ids: Optional[Collection[str]] = None) -> np.ndarray:
+        """Rows of the samples that are not retired, in order.
+
+        Restricted to the samples of *emp_ids* when given.
+        """
+        records, retired = self.records(), self._retired
+        rows = np.arange(len(records))
+        if retired:
+            rows = np.flatnonzero(~np.isin(records["id"], np.fromiter(retired, dtype=np.int64, count=len(retired))))
+        if emp_ids is not None:
+            identities = [self._people_by_emp_id[e] for e in emp_ids if e in self._people_by_emp_id]
+            rows = rows[np.isin(records["identity"][rows], identities)]
+        return rows
+
+    def name_for(self, emp_id: str) -> Optional[str]:
+        """Returns the stored name of *emp_id*, if any samples were ever stored."""
+        identity = self._people_by_emp_id.get(emp_id)
+        return None if identity is None else self._people[identity][0]
+
+    def person(self, identity: int) -> Tuple[str, str]:
+        """Returns ``(name, emp_id)`` of a record's identity number."""
+        return self._people[identity]
+
+    def sample(self, row: int) -> StoredSample:
+        """Returns the index entry of *row*."""
+        record = self._records[row]
+        name, emp_id = self._people[int(record["identity"])]
+        return StoredSample(
+            row, int(record["id"]), name, emp_id, int(record["sample"]), float(record["timestamp"])
+        )
+
+    # -- writing ------------------------------------------------------------
+
+    def append(
+        self,
+        faces: Sequence[np.ndarray],
+        name: str,
+        emp_id: str,
+        *,
+        samples: Optional[Sequence[int]] = None,
+        timestamps: Optional[Sequence[float]] = None,
+    ) -> np.ndarray:
+        """Durably appends *faces* of one employee; returns their sample ids.
+
+        Sample numbers continue the employee's sequence and timestamps
+        default to now, unless given (as when migrating old files).
+        """
+        if not len(faces):
+            return np.empty(0, dtype=np.int64)
+        pixels = np.stack([np.asarray(face, dtype=np.uint8) for face in faces])
+        if pixels.shape[1:] != (FACE_SIZE, FACE_SIZE):
+            raise ValueError(f"Faces must be {FACE_SIZE}x{FACE_SIZE} grayscale, got {pixels.shape[1:]}")
+
+        with self._lock:
+            identity = self._people_by_emp_id.get(emp_id)
+            if identity is None:
+                identity = len(self._people)
+                self._people.append((name, emp_id))
+                self._people_by_emp_id[emp_id] = identity
+                self._write_meta()
+
+            records = np.empty(len(pixels), dtype=RECORD_DTYPE)
+            records["id"] = np.arange(self._next_id, self._next_id + len(pixels))
+            records["identity"] = identity
+            if samples is None:
+                first_sample = self._next_sample.get(identity, 0)
+                samples = range(first_sample, first_sample + len(pixels))
+            records["sample"] = samples
+            records["timestamp"] = timestamps if timestamps is not None else time.time()
+
+            first = self._count
+            _write_at(self._faces_file, first * FACE_BYTES, pixels.tobytes())
+            _write_at(self._index_file, first * RECORD_DTYPE.itemsize, records.tobytes())
+            self._append_records(records)
+            return records["id"].copy()
+
+    def retire(self, ids: Iterable[int]) -> None:
+        """Marks samples as retired; they stop being live immediately.
+
+        Their rows are reclaimed by a compaction once retired samples exceed
+        ``STORE_COMPACT_RATIO`` of the store.
+        """
+        with self._lock:
+            known = set(self.records()["id"].tolist())
+            # Replaced, not mutated, so lock-free readers never see it change size.
+            self._retired = self._retired | {i for i in (int(i) for i in ids) if i in known}
+            if len(self._retired) > STORE_COMPACT_RATIO * self._count:
+                self._compact()
+            else:
+                self._write_meta()
+
+    def export_jpegs(self, out_dir: str | Path, emp_id: Optional[str] = None) -> int:
+        """Writes live faces as ``<name>_<EMP_ID>_<nnn>.jpg`` files for audits.
+
+        Only *emp_id*'s faces are exported if given. Returns the file count.
+        """
+        ensure_dir(out_dir)
+        faces = self.faces()
+        written = 0
+        for row in self.live_rows():
+            entry = self.sample(row)
+            if emp_id is not None and entry.emp_id != emp_id:
+                continue
+            path = Path(out_dir) / f"{entry.name}_{entry.emp_id}_{entry.sample:03d}.jpg"
+            if cv2.imwrite(str(path), np.asarray(faces[row])):
+                written += 1
+            else:
+                Logger(f"[WARN] Could not export sample {row} to {path}")
+        return written
+
+    # -- internals ----------------------------------------------------------
+
+    def _open(self) -> None:
+        ensure_dir(self._dir)
+        if not self._meta_file.is_file():
+            self.generation = uuid.uuid4().hex
+            self._files = uuid.uuid4().hex[:8]
+            for path in (self._faces_file, self._index_file):
+                path.write_bytes(b"")
+            self._write_meta()
+            return
+
+        with self._meta_file.open("r", encoding="utf-8") as f:
+            meta = json.load(f)
+        version = meta.get("version")
+        if version not in (1, SAMPLE_STORE_VERSION):
+            raise ValueError(f"Unsupported sample store version {version!r} in {self._dir}")
+        self.generation = meta["generation"]
+        for name, emp_id in meta["people"]:
+            self._people_by_emp_id[emp_id] = len(self._people)
+            self._people.append((name, emp_id))
+        if version == 1:
+            self._upgrade_v1()
+            return
+
+        self._files = meta["files"]
+        self._next_id = int(meta["next_id"])
+        raw = self._index_file.read_bytes() if self._index_file.is_file() else b""
+        count = min(len(raw) // RECORD_DTYPE.itemsize, _file_size(self._faces_file) // FACE_BYTES)
+        records = np.frombuffer(raw[: count * RECORD_DTYPE.itemsize], dtype=RECORD_DTYPE)
+        unknown = np.flatnonzero(records["identity"] >= len(self._people))
+        if len(unknown):
+            records = records[: unknown[0]]
+        count = len(records)
+
+        # Drop whatever a crashed append left past the last complete row.
+        for path, size in ((self._faces_file, count * FACE_BYTES), (self._index_file, count * RECORD_DTYPE.itemsize)):
+            if _file_size(path) != size:
+                Logger(f"[WARN] Truncating torn tail of {path.name} to {count} samples.")
+                with path.open("ab") as f:
+                    f.truncate(size)
+        self._append_records(records)
+        self._retired = set(meta.get("retired", [])) & set(records["id"].tolist())
+        self._remove_stale_files()
+
+    def _upgrade_v1(self) -> None:
+        """Converts the single-file-set layout of version 1 (no sample ids)."""
+        faces_file, index_file = self._dir / "faces.u8", self._dir / "index.bin"
+        raw = index_file.read_bytes() if index_file.is_file() else b""
+        count = min(len(raw) // _V1_RECORD_DTYPE.itemsize, _file_size(faces_file) // FACE_BYTES)
+        old = np.frombuffer(raw[: count * _V1_RECORD_DTYPE.itemsize], dtype=_V1_RECORD_DTYPE)
+        records = np.empty(count, dtype=RECORD_DTYPE)
+        records["id"] = np.arange(count)
+        for field in _V1_RECORD_DTYPE.names:
+            records[field] = old[field]
+        faces = np.fromfile(faces_file, dtype=np.uint8, count=count * FACE_BYTES) if count else np.empty(0, np.uint8)
+        self._next_id = count
+        self._write_file_set(faces, records)
+        self._append_records(records)
+        for path in (faces_file, index_file):
+            path.unlink(missing_ok=True)
+        Logger(f"[INFO] Upgraded sample store to version {SAMPLE_STORE_VERSION} ({count} samples).")
+
+    def _compact(self) -> None:
+        """Copies the live rows to a new file set and switches to it (lock held)."""
+        started = time.perf_counter()
+        live = self.live_rows()
+        records = self.records()[live].copy()
+        dropped = self._count - len(live)
+        self._write_file_set(self.faces()[live], records)
+        self._records = np.empty(0, dtype=RECORD_DTYPE)
+        self._count = 0
+        self._view = None
+        self._append_records(records)
+        Logger(
+            f"[INFO] Compacted sample store: dropped {dropped} retired samples, "
+            f"{len(live)} kept, in {time.perf_counter() - started:.2f}s."
+        )
+
+    def _write_file_set(self, faces: np.ndarray, records: np.ndarray) -> None:
+        """Writes *faces*/*records* as a new file set and commits it in ``store.json``."""
+        old_files = self._files
+        self._files = uuid.uuid4().hex[:8]
+        _write_at(self._faces_file, 0, np.ascontiguousarray(faces).tobytes())
+        _write_at(self._index_file, 0, records.tobytes())
+        self._retired = set()
+        self._write_meta()
+        if old_files:
+            for path in (self._dir / f"faces-{old_files}.u8", self._dir / f"index-{old_files}.bin"):
+                path.unlink(missing_ok=True)
+
+    def _remove_stale_files(self) -> None:
+        """Deletes file sets left behind by an interrupted compaction."""
+        current = {self._faces_file.name, self._index_file.name}
+        for path in self._dir.iterdir():
+            if path.name.startswith(("faces-", "index-")) and path.name not in current:
+                path.unlink(missing_ok=True)
+
+    def _append_records(self, records: np.ndarray) -> None:
+        needed = self._count + len(records)
+        if needed > len(self._records):
+            # Readers may still hold the old array; it stays valid for them.
+            grown = np.empty(max(needed, 2 * len(self._records), 64), dtype=RECORD_DTYPE)
+            grown[: self._count] = self._records[: self._count]
+            self._records = grown
+        self._records[self._count : needed] = records
+        for identity, sample in zip(records["identity"].tolist(), records["sample"].tolist()):
+            self._next_sample[identity] = max(self._next_sample.get(identity, 0), sample + 1)
+        if len(records):
+            self._next_id = max(self._next_id, int(records["id"].max()) + 1)
+        self._count = needed
+
+    def _write_meta(self) -> None:
+        tmp = self._meta_file.with_suffix(".json.tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": SAMPLE_STORE_VERSION,
+                    "generation": self.generation,
+                    "files": self._files,
+                    "next_id": self._next_id,
+                    "people": [list(person) for person in self._people],
+                    "retired": sorted(self._retired),
+                },
+                f,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._meta_file)
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def _write_at(path: Path, offset: int, data: bytes) -> None:
+    """Writes *data* at *offset*, drops anything after it and syncs."""
+    with path.open("r+b" if path.exists() else "w+b") as f:
+        f.seek(offset)
+        f.write(data)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# ---------------------------------------------------------------------------
+# Command line: JPEG export for audits
+# ---------------------------------------------------------------------------
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export the packed face store as JPEG files.")
+    parser.add_argument("gallery_dir", help="known_faces directory that holds .sample_store/")
+    parser.add_argument("out_dir", help="directory to write <name>_<EMP_ID>_<nnn>.jpg files to")
+    parser.add_argument("--emp-id", help="only export this employee's samples")
+    args = parser.parse_args(argv)
+
+    store = SampleStore(args.gallery_dir)
+    written = store.export_jpegs(args.out_dir, args.emp_id.upper() if args.emp_id else None)
+    Logger(f"[INFO] Exported {written} of {len(store)} samples to {args.out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import itertools
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# ---------------------------------------------------------------------------
+# Face tracks with cached identities
+# ---------------------------------------------------------------------------
+
+# (x, y, w, h) in full-frame pixels.
+Box = Tuple[int, int, int, int]
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Intersection over union of every pair of ``(x, y, w, h)`` boxes, ``(len(a), len(b))``."""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2])
+    y2 = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+class FaceTrack:
+    """One face followed across frames, with the identity last found for it.
+
+    *identity* is whatever the recogniser returned for the face (the app
+    stores ``(match, name, emp_id)``); *confident* says whether that match
+    was clearly below the recognition threshold. *recognised_box* is the
+    box the identity was computed on, to notice when the face has moved
+    enough for a fresh look to be worthwhile.
+    """
+
+    def __init__(self, track_id: int, box: Box, frame: int):
+        self.id = track_id
+        self.box = box
+        self.last_frame = frame
+        self.identity = None
+        self.confident = False
+        self.recognised_frame = -1
+        self.recognised_box: Optional[Box] = None
+
+
+class TrackStats:
+    """How much recognition work the track cache saved."""
+
+    def __init__(self):
+        self.frames = 0
+        self.faces = 0
+        self.recognitions = 0
+        self.tracks = 0
+
+    @property
+    def recognition_rate(self) -> float:
+        """Share of detected faces that were actually sent to the recogniser."""
+        return self.recognitions / self.faces if self.faces else 1.0
+
+    def as_dict(self) -> dict:
+        """Snapshot for logging / the UI."""
+        return {
+            "frames": self.frames,
+            "faces": self.faces,
+            "tracks": self.tracks,
+            "recognitions": self.recognitions,
+            "recognition_rate": round(self.recognition_rate, 4),
+        }
+
+
+class FaceTracker:
+    """Associates face detections across frames and caches their identities.
+
+    Each frame's boxes are matched to the live tracks greedily by IoU (at
+    least *min_iou*); boxes left over are matched by centroid distance (at
+    most *max_shift* times the track's width), which catches fast movement
+    at low frame rates. Unmatched boxes start new tracks and tracks unseen
+    for more than *max_missed* frames are dropped.
+
+    :meth:`needs_recognition` decides which faces the recogniser has to
+    look at: new tracks, confident ones every *refresh_frames* frames,
+    unrecognised or borderline ones every *retry_frames* frames, and any
+    track whose box has grown or shrunk by more than *rescale* since it was
+    recognised (a person walking up to the kiosk gives a better crop).
+    Everything else reuses the cached identity.
+    """
+
+    def __init__(
+        self,
+        min_iou: float = 0.3,
+        max_shift: float = 0.5,
+        max_missed: int = 5,
+        refresh_frames: int = 30,
+        retry_frames: int = 5,
+        rescale: float = 0.3,
+    ):
+        self.min_iou = min_iou
+        self.max_shift = max_shift
+        self.max_missed = max_missed
+        self.refresh_frames = refresh_frames
+        self.retry_frames = retry_frames
+        self.rescale = rescale
+        self.stats = TrackStats()
+        self._tracks: List[FaceTrack] = []
+        self._ids = itertools.count(1)
+        self._frame = 0
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def update(self, boxes: Sequence[Box]) -> List[FaceTrack]:
+        """Advances one frame; returns the track of each box, in box order."""
+        self._frame += 1
+        self.stats.frames += 1
+        self.stats.faces += len(boxes)
+        assigned: List[Optional[FaceTrack]] = [None] * len(boxes)
+        free = list(self._tracks)
+        if free and len(boxes):
+            for t, b in self._associate(free, boxes):
+                assigned[b] = free[t]
+        for b, box in enumerate(boxes):
+            track = assigned[b]
+            if track is None:
+                track = FaceTrack(next(self._ids), tuple(box), self._frame)
+                self._tracks.append(track)
+                self.stats.tracks += 1
+                assigned[b] = track
+            track.box = tuple(box)
+            track.last_frame = self._frame
+        self._tracks = [t for t in self._tracks if self._frame - t.last_frame <= self.max_missed]
+        return assigned
+
+    def reset(self) -> None:
+        """Ends every track (their cached identities go with them)."""
+        self._tracks = []
+
+    def _associate(self, tracks: List[FaceTrack], boxes: Sequence[Box]) -> List[Tuple[int, int]]:
+        prev = np.array([t.box for t in tracks], dtype=np.float32)
+        cur = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        iou = box_iou(prev, cur)
+        # Centroid distance relative to the track's width.
+        centre_prev = prev[:, :2] + prev[:, 2:] / 2
+        centre_cur = cur[:, :2] + cur[:, 2:] / 2
+        shift = np.linalg.norm(centre_prev[:, None, :] - centre_cur[None, :, :], axis=2) / np.maximum(prev[:, None, 2], 1.0)
+
+        pairs: List[Tuple[int, int]] = []
+        used_t, used_b = set(), set()
+        candidates = [(-iou, iou >= self.min_iou), (shift, shift <= self.max_shift)]
+        for cost, allowed in candidates:
+            for flat in np.argsort(cost, axis=None, kind="stable"):
+                t, b = np.unravel_index(flat, cost.shape)
+                if allowed[t, b] and t not in used_t and b not in used_b:
+                    pairs.append((int(t), int(b)))
+                    used_t.add(t)
+                    used_b.add(b)
+        return pairs
+
+    def needs_recognition(self, track: FaceTrack) -> bool:
+        """Whether *track*'s face should be (re-)recognised this frame."""
+        if track.identity is None:
+            return True
+        since = self._frame - track.recognised_frame
+        if since >= (self.refresh_frames if track.confident else self.retry_frames):
+            return True
+        old_w = track.recognised_box[2]
+        return abs(track.box[2] - old_w) > self.rescale * old_w
+
+    def record(self, track: FaceTrack, identity, confident: bool) -> None:
+        """Caches the recogniser's answer for *track*."""
+        track.identity = identity
+        track.confident = confident
+        track.recognised_frame = self._frame
+        track.recognised_box = track.box
+        self.stats.recognitions += 1
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import contextlib
+import itertools
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from faceapp.common import Logger
+from faceapp.detection import full_frame_boxes
+from faceapp.detectors import DEFAULT_DETECTOR, make_detector
+from faceapp.preprocess import FramePreprocessor
+from faceapp.tracking import Box
+
+# ---------------------------------------------------------------------------
+# Detection worker processes fed through a shared-memory frame ring
+# ---------------------------------------------------------------------------
+
+
+class PoolResult(NamedTuple):
+    """A frame out of a :class:`DetectionPool`, with what the worker found in it."""
+
+    frame: np.ndarray
+    boxes: Optional[List[Box]]  # full-frame; None if passed through
+    seconds: float  # worker time
+    captured_at: float
+    source: int
+
+
+class FrameRing:
+    """Frames of up to *slot_bytes* bytes in one shared-memory block, one slot each.
+
+    Created by the owning process (``name=None``) and attached to by name
+    in the workers. Frames of different sizes (one per camera) share the
+    ring; :meth:`frame` views the start of a slot as a frame of *shape*.
+    """
+
+    def __init__(self, slots: int, slot_bytes: int, name: Optional[str] = None):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        size = slots * slot_bytes
+        self._shm = shared_memory.SharedMemory(name=name, create=name is None, size=size if name is None else 0)
+        self.name = self._shm.name
+        self._slots: Optional[np.ndarray] = np.ndarray((slots, slot_bytes), dtype=np.uint8, buffer=self._shm.buf)
+
+    def frame(self, slot: int, shape: Tuple[int, ...]) -> np.ndarray:
+        """Slot *slot* as a ``uint8`` frame of *shape*."""
+        return self._slots[slot, : int(np.prod(shape))].reshape(shape)
+
+    def close(self) -> None:
+        """Detaches this process from the block."""
+        self._slots = None  # the view must go before the mapping
+        self._shm.close()
+
+    def unlink(self) -> None:
+        """Frees the block; only the creator calls this, after every close."""
+        self._shm.unlink()
+
+
+def _detection_worker(ring_name: str, slots: int, slot_bytes: int, detector: str,
+                      options: Dict[str, Any], tasks, results) -> None:
+    """Worker process: detects faces in ring slots until it gets ``None``."""
+    cv2.setNumThreads(1)  # the pool is the parallelism
+    ring = FrameRing(slots, slot_bytes, name=ring_name)
+    face_detector = make_detector(detector, **options)
+    preprocessor = FramePreprocessor()
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot, shape, factor, bounds, captured_at, source = task
+            started = time.perf_counter()
+            small = preprocessor.prepare(ring.frame(slot, shape), factor)
+            try:
+                faces = face_detector.detect(small, **bounds)
+            except cv2.error:
+                faces = []
+            boxes = full_frame_boxes(faces, factor, shape)
+            results.put((seq, slot, shape, boxes, time.perf_counter() - started, captured_at, source))
+    finally:
+        ring.close()
+
+
+@contextlib.contextmanager
+def _main_module_hidden():
+    """Keeps spawned processes from re-importing ``__main__``.
+
+    The workers need nothing from it, and the app's main module opens a
+    Kivy window as a side effect of being imported.
+    """
+    main = sys.modules["__main__"]
+    saved = {key: vars(main)[key] for key in ("__file__", "__spec__") if key in vars(main)}
+    main.__file__ = main.__spec__ = None
+    try:
+        yield
+    finally:
+        for key in ("__file__", "__spec__"):
+            if key in saved:
+                setattr(main, key, saved[key])
+            else:
+                delattr(main, key)
+
+
+class PoolStats:
+    """Throughput of a :class:`DetectionPool` and the frames it could not take."""
+
+    def __init__(self):
+        self.frames = 0
+        self.passed_through = 0
+        self.dropped = 0
+        self.lost = 0
+        self.worker_s = 0.0
+        self._started = time.perf_counter()
+
+    @property
+    def fps(self) -> float:
+        """Frames delivered per second since the pool started."""
+        return self.frames / max(time.perf_counter() - self._started, 1e-6)
+
+    def as_dict(self) -> dict:
+        """Snapshot for logging / the UI."""
+        detected = max(self.frames - self.passed_through, 1)
+        return {
+            "frames": self.frames,
+            "fps": round(self.fps, 1),
+            "passed_through": self.passed_through,
+            "dropped": self.dropped,
+            "lost": self.lost,
+            "worker_ms": round(1000.0 * self.worker_s / detected, 3),
+        }
+
+
+class DetectionPool:
+    """Face detection on *workers* processes, with results delivered in frame order.
+
+    :meth:`submit` copies a camera frame (of at most *frame_bytes* bytes)
+    into a free slot of a :class:`FrameRing` (*slots* of them, two per
+    worker by default) and queues the slot, frame shape, detection scale
+    and size bounds for the workers, which detect with their own
+    *detector* and send back the full-frame boxes - only this metadata is
+    pickled, never pixels. Several cameras can feed one pool; each frame
+    carries its *source* and its capture time through to the result. When
+    every slot is busy the frame is dropped, as a serial loop would have
+    missed it too. Frames that need no detection (the motion gate is
+    asleep) take :meth:`pass_through` so they keep their place in the
+    sequence.
+
+    :meth:`next_result` hands out :class:`PoolResult` strictly in
+    submission order, which keeps every camera's frames in order too,
+    copying each frame out of the ring so its slot can be reused at once.
+    A sequence number still missing after *stall_s* while later ones are
+    waiting (a worker died or fell behind) is given up on; should its
+    result turn up after all, it is discarded.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        frame_bytes: int,
+        detector: str = DEFAULT_DETECTOR,
+        options: Optional[Dict[str, Any]] = None,
+        slots: Optional[int] = None,
+        stall_s: float = 1.0,
+    ):
+        context = multiprocessing.get_context("spawn")
+        self.ring = FrameRing(slots or 2 * workers, frame_bytes)
+        self.stall_s = stall_s
+        self.stats = PoolStats()
+        self._free: "queue.Queue[int]" = queue.Queue()
+        for slot in range(self.ring.slots):
+            self._free.put(slot)
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._seq = itertools.count()
+        self._next = 0
+        self._waiting_since: Optional[float] = None
+        self._lock = threading.Lock()
+        # Pass-through frames wait here, in this process, for their turn.
+        self._held: Dict[int, np.ndarray] = {}
+        self._ready: Dict[int, PoolResult] = {}
+        self._processes = [
+            context.Process(
+                target=_detection_worker,
+                args=(self.ring.name, self.ring.slots, self.ring.slot_bytes, detector, options or {},
+                      self._tasks, self._results),
+                daemon=True,
+                name=f"DetectionWorker-{i}",
+            )
+            for i in range(workers)
+        ]
+        with _main_module_hidden():
+            for process in self._processes:
+                process.start()
+
+    def submit(self, frame: np.ndarray, factor: float, bounds: Dict[str, Any],
+               captured_at: float = 0.0, source: int = 0) -> bool:
+        """Queues *frame* for detection; ``False`` if it was dropped (ring full)."""
+        if frame.nbytes > self.ring.slot_bytes:
+            raise ValueError(f"frame of {frame.nbytes} bytes does not fit the {self.ring.slot_bytes}-byte ring slots")
+        try:
+            slot = self._free.get_nowait()
+        except queue.Empty:
+            self.stats.dropped += 1
+            return False
+        np.copyto(self.ring.frame(slot, frame.shape), frame)
+        self._tasks.put((next(self._seq), slot, frame.shape, factor, bounds, captured_at, source))
+        return True
+
+    def pass_through(self, frame: np.ndarray, captured_at: float = 0.0, source: int = 0) -> None:
+        """Queues *frame* behind the frames in flight, without detection."""
+        seq = next(self._seq)
+        with self._lock:
+            self._held[seq] = frame
+        self._results.put((seq, None, None, None, 0.0, captured_at, source))  # wakes up next_result()
+        self.stats.passed_through += 1
+
+    def next_result(self, timeout: float = 0.1) -> Optional[PoolResult]:
+        """The next frame in order with its boxes, or ``None`` if it is not in yet."""
+        deadline = time.monotonic() + timeout
+        while True:
+            result = self._ready.pop(self._next, None)
+            if result is not None:
+                self._next += 1
+                self._waiting_since = None
+                self.stats.frames += 1
+                return result
+            if self._ready and self._stalled():
+                Logger(f"[WARN] Detection result {self._next} never arrived; skipping it.")
+                self.stats.lost += 1
+                self._next += 1
+                continue
+            try:
+                seq, slot, shape, boxes, seconds, captured_at, source = self._results.get(
+                    timeout=max(0.0, deadline - time.monotonic())
+                )
+            except queue.Empty:
+                return None
+            if seq < self._next:
+                # Given up on already: nobody will collect it, so release
+                # its slot (or held frame) instead of keeping it forever.
+                if slot is None:
+                    with self._lock:
+                        self._held.pop(seq, None)
+                else:
+                    self._free.put(slot)
+                continue
+            if slot is None:
+                with self._lock:
+                    frame = self._held.pop(seq)
+            else:
+                frame = self.ring.frame(slot, shape).copy()
+                self._free.put(slot)
+                self.stats.worker_s += seconds
+            self._ready[seq] = PoolResult(frame, boxes, seconds, captured_at, source)
+
+    def _stalled(self) -> bool:
+        now = time.monotonic()
+        if self._waiting_since is None:
+            self._waiting_since = now
+        return now - self._waiting_since > self.stall_s
+
+    def close(self) -> None:
+        """Stops the workers and frees the ring."""
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+        self._tasks.close()
+        self._results.close()
+        self.ring.close()
+        self.ring.unlink()
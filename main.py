@@ -1,18 +1,20 @@
 from __future__ import annotations
 
-import glob
+import functools
 import json
+import math
 import os
 import queue
 import random
 import smtplib
 import threading
 import time
+from concurrent.futures import Future
 from datetime import datetime
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import cv2
 import numpy as np
@@ -26,21 +28,138 @@ from kivy.metrics import dp
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
 from kivy.uix.floatlayout import FloatLayout
+from kivy.uix.gridlayout import GridLayout
 from kivy.uix.image import Image
 from kivy.uix.label import Label
 from kivy.uix.popup import Popup
 from kivy.uix.textinput import TextInput
 
+from faceapp.common import FACE_SIZE, Logger, ensure_dir
+from faceapp.gallery import (
+    IdentityIndex,
+    ModelCache,
+    SampleLoader,
+    gallery_delta,
+    migrate_sample_files,
+    select_representatives,
+)
+from faceapp.ann import IVFIndex
+from faceapp.backends import DEFAULT_BACKEND, RecognizerBackend, make_backend
+from faceapp.camera import CameraFeed, CameraSource, FrameGrabber
+from faceapp.cascade import CoarseFilter
+from faceapp.detection import TRACK, DetectThenTrack, ScaleController, full_frame_boxes
+from faceapp.detectors import DEFAULT_DETECTOR, DetectorPool, FaceDetector
+from faceapp.model import ModelHolder, gather
+from faceapp.motion import MotionGate
+from faceapp.quality import QualityStats, SampleQualityGate
+from faceapp.recognition import GalleryMatcher, MatchResult, lbp_histograms
+from faceapp.shards import GLOBAL_SHARD, KioskConfig, ShardMembership, ShardRegistry, load_kiosk_config
+from faceapp.startup import DETECTING, FAILED, LOADING, READY, StartupTimeline
+from faceapp.store import SampleStore
+from faceapp.tracking import FaceTracker
+from faceapp.workers import DetectionPool
+
 # ---------------------------------------------------------------------------
 # Configuration constants
 # ---------------------------------------------------------------------------
 
 # KNOWN_FACES_DIR: str = "known_faces" # This will now be dynamically set
 SAMPLES_PER_USER: int = 10
+# Camera frames are down-scaled by FRAME_REDUCE_FACTOR for detection at
+# first. The factor then adapts within [DETECT_MIN_FACTOR, DETECT_MAX_FACTOR]
+# so processed frames stay within FRAME_BUDGET_MS, without letting the
+# smallest face seen so far drop below DETECT_MIN_FACE_PX pixels; the
+# detector's min/max face size follows the observed face sizes. Current
+# settings and latency are logged on exit.
 FRAME_REDUCE_FACTOR: float = 0.5
+DETECT_MIN_FACTOR: float = 0.25
+DETECT_MAX_FACTOR: float = 1.0
+FRAME_BUDGET_MS: float = 66.0
+DETECT_MIN_FACE_PX: int = 40
 RECOGNITION_INTERVAL: int = 5 * 60  # seconds between repeated recognitions of same face
 AUDIO_FILE: str = "thank_you.mp3"
 TICK_ICON_PATH: str = "tick.png"
+# Kiosk configuration (which gallery shards to match against, with which
+# face detector and recognition backend); defaults to kiosk.json in the app's
+# data directory.
+KIOSK_CONFIG_PATH: Optional[str] = os.environ.get("FACEAPP_KIOSK_CONFIG")
+# Re-save the model cache at start-up once samples added since it was written
+# exceed this fraction of the cached gallery.
+MODEL_CACHE_REFRESH_RATIO: float = 0.25
+# Approximate nearest-neighbour search kicks in at this many gallery samples
+# (0 disables it). More probed cells / re-ranked samples = higher recall,
+# slower search; watch the logged recall figures when tuning.
+ANN_INDEX_MIN_SAMPLES: int = 5000
+ANN_NPROBE: int = 16
+ANN_RERANK: int = 64
+# Below that, galleries of at least CASCADE_MIN_SAMPLES are matched coarse to
+# fine: compact descriptors (LBP pooled over a CASCADE_GRID x CASCADE_GRID
+# grid) shortlist CASCADE_SHORTLIST identities, whose samples alone get the
+# full LBPH comparison. Shortlist recall and speed-up are logged on exit.
+CASCADE_MIN_SAMPLES: int = 2000
+CASCADE_GRID: int = 4
+CASCADE_SHORTLIST: int = 8
+# Samples are appended to the matcher in batches of this size while loading.
+GALLERY_LOAD_BATCH: int = 256
+# Enrolment quality gate: minimum detected face size (px), Laplacian variance
+# and LBP distance to already kept samples of the same person; captures give
+# up after CAPTURE_TIMEOUT seconds and keep whatever passed.
+CAPTURE_MIN_FACE_PX: int = 80
+CAPTURE_MIN_SHARPNESS: float = 35.0
+CAPTURE_MIN_NOVELTY: float = 8.0
+CAPTURE_TIMEOUT: float = 60.0
+# Per-identity gallery budget (0 = unlimited). Photo updates beyond it keep
+# the most representative samples and retire the rest, so gallery size and
+# matching cost stay bounded however often people refresh their photos.
+MAX_SAMPLES_PER_IDENTITY: int = 20
+# Face detection runs every DETECT_EVERY_N_FRAMES frames at first; faces are
+# followed with optical flow in between. The interval adapts between 1 and
+# DETECT_MAX_INTERVAL (longer while the same faces stay, shorter when people
+# come and go or tracking is lost); make both equal for a fixed interval, or
+# 1 to detect on every frame. Per-mode FPS and CPU time are logged on exit.
+DETECT_EVERY_N_FRAMES: int = 5
+DETECT_MAX_INTERVAL: int = 10
+# While faces are present, detection only scans the regions around them
+# (padded by DETECT_ROI_PADDING x the face size); the whole frame is scanned
+# every DETECT_FULL_SCAN_EVERY detections, when tracking is lost, or when
+# the motion gate sees movement elsewhere. 1 scans the full frame every time.
+DETECT_ROI_PADDING: float = 0.5
+DETECT_FULL_SCAN_EVERY: int = 4
+# Motion gate: detection and recognition sleep while the scene is static and
+# empty, and wake once more than MOTION_MIN_CHANGED of a tiny thumbnail
+# changes; they go back to sleep MOTION_HOLD_SECONDS after the last motion or
+# face. Idle/active time and wake latency are logged on exit.
+MOTION_GATING: bool = True
+MOTION_MIN_CHANGED: float = 0.01
+MOTION_HOLD_SECONDS: float = 5.0
+# Faces are tracked across frames and keep their identity: confident matches
+# (distance below TRACK_CONFIDENT_RATIO x the threshold) are re-checked every
+# TRACK_REFRESH_FRAMES frames, unknown or borderline faces every
+# TRACK_RETRY_FRAMES, and tracks unseen for TRACK_MAX_MISSED frames end.
+TRACK_CONFIDENT_RATIO: float = 0.85
+TRACK_REFRESH_FRAMES: int = 30
+TRACK_RETRY_FRAMES: int = 5
+TRACK_MAX_MISSED: int = 5
+# Detection worker processes. 0 runs capture, detection, recognition and
+# drawing in the camera thread. N > 0 copies camera frames into a
+# shared-memory ring that N processes detect faces in (full frame, every
+# frame, no optical flow), while a result thread tracks, recognises and
+# draws them in frame order - use it on multi-core kiosks where detection
+# is the bottleneck. Not available on Android, which has no POSIX shared
+# memory.
+DETECTION_WORKERS: int = 0
+# The workers' shared-memory ring is sized for the largest camera frame, as
+# reported by the cameras when opened; this is assumed for cameras that do
+# not report their resolution. Larger frames skip detection.
+DETECTION_MAX_FRAME_SIZE: Tuple[int, int] = (1920, 1080)  # width, height
+# Banner shown while the kiosk warms up in the background; empty once faces
+# are recognised.
+READINESS_TEXT: Dict[str, str] = {
+    LOADING: "Starting up – loading face detector…",
+    DETECTING: "Loading face recogniser – attendance is not recorded yet…",
+    READY: "",
+    FAILED: "Face detector failed to load – please reinstall the app.",
+}
 
 # Google-Form configuration: View URL is used as referer header, POST goes to
 # the *formResponse* endpoint.
@@ -64,18 +183,10 @@ EMAIL_PASSWORD: str = os.environ.get("FACEAPP_PASS", "ytup bjrd pupf tuuj")
 SMTP_SERVER: str = "smtp.gmail.com"
 SMTP_PORT: int = 587
 
-# Simple logger helper (replace with logging module for production).
-Logger = print
-
 # ---------------------------------------------------------------------------
 # Utility helpers
 # ---------------------------------------------------------------------------
 
-def ensure_dir(path: str | Path) -> None:
-    """Create directory *path* (including parents) if it does not exist."""
-    Path(path).mkdir(parents=True, exist_ok=True)
-
-
 def python_time_now() -> str:
     """Returns the current time formatted as a string."""
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -91,51 +202,59 @@ class FaceApp(App):
 
     def __init__(self, **kwargs: Any):
         super().__init__(**kwargs)
+        # Start-up is staged so the kiosk never shows a black screen: build()
+        # brings up the UI and camera preview at once, and everything slow is
+        # loaded by a background warm-up (see _warm_up). Detection starts when
+        # the face cascade is ready and recognition when the models are.
+        self.startup = StartupTimeline()
         
         # Set the known faces directory to a writable location on mobile devices
         self._known_faces_dir = Path(self.user_data_dir) / "known_faces"
         ensure_dir(self._known_faces_dir)
         Logger(f"[INFO] Known faces directory set to: {self._known_faces_dir}")
 
-        # Haar cascade for face detection.
-        self.face_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-        )
-        # Check if the cascade classifier loaded successfully
-        if self.face_cascade.empty():
-            Logger(f"[ERROR] Failed to load Haar cascade classifier. "
-                   f"Path tried: {cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'}. "
-                   f"Please ensure 'haarcascade_frontalface_default.xml' is present and accessible, "
-                   f"and that opencv-python is correctly installed.")
-            # It's critical to exit or handle this gracefully, as face detection won't work.
-            # For a Kivy app, you might want to show a popup and then stop the app.
-            # For now, we'll raise a runtime error to halt execution.
-            raise RuntimeError("Failed to load face cascade classifier. Exiting.")
-
-
-        # Train recogniser on existing samples.
-        self.recognizer, self.label_map = self._train_recognizer()
+        # Set by the warm-up: the kiosk configuration and face detector, then
+        # the sample store and shard models for recognition.
+        self.kiosk = KioskConfig()
+        self.face_detector: Optional[FaceDetector] = None
+        self.sample_store: Optional[SampleStore] = None
+        self.face_encoder: Optional[RecognizerBackend] = None
+        self.recognition_threshold = float("-inf")
+        self.shard_members: Optional[ShardMembership] = None
+        self.models: Optional[ShardRegistry] = None
 
         # State dictionaries.
         self.last_seen_time: Dict[str, float] = {}
         self.otp_storage: Dict[str, str] = {}
         self.pending_names: Dict[str, Optional[str]] = {}
+        # Enrolment quality-gate outcomes across all capture sessions.
+        self.capture_stats = QualityStats()
 
-        # Load stored e-mail addresses (OTP delivery).
-        self.user_emails: Dict[str, str] = self._load_emails()
+        # Stored e-mail addresses (OTP delivery); loaded by the warm-up.
+        self.user_emails: Dict[str, str] = {}
 
-        # Frame queue between capture-thread and UI thread.
-        self.frame_queue: queue.Queue[np.ndarray] = queue.Queue(maxsize=1)
+        # One feed per camera of the kiosk, opened by build(); see
+        # _open_feed() for what each camera has to itself. Recognition and
+        # the attendance dedup above are shared: a person seen by two
+        # cameras is recorded once.
+        self.feeds: List[CameraFeed] = []
+        self._attendance_lock = threading.Lock()
 
-        # Tick overlay icon (RGBA PNG) – optional.
-        self.tick_icon: Optional[np.ndarray] = self._load_tick_icon()
+        # With DETECTION_WORKERS: the worker pool shared by all cameras,
+        # created once the detector is known.
+        self.detection_pool: Optional[DetectionPool] = None
+        self._pool_lock = threading.Lock()
 
-        # Optional success sound.
-        self.sound = SoundLoader.load(AUDIO_FILE) or None
+        # Tick overlay icon (RGBA PNG) and success sound – optional, loaded
+        # by the warm-up.
+        self.tick_icon: Optional[np.ndarray] = None
+        self.sound = None
 
         # Thread/co-ordination primitives.
         self._stop_event = threading.Event()
-        self.capture_thread: Optional[threading.Thread] = None
+        self.camera_threads: List[threading.Thread] = []
+        self.result_thread: Optional[threading.Thread] = None
+        self.warmup_thread: Optional[threading.Thread] = None
 
         # Attributes for visual flash
         self.flash_event = None
@@ -150,9 +269,17 @@ class FaceApp(App):
         """Builds the Kivy UI layout."""
         root = FloatLayout()
 
-        # Live camera frame display.
-        self.image_widget = Image(allow_stretch=True, keep_ratio=True)
-        root.add_widget(self.image_widget)
+        # The kiosk configuration says which cameras to open.
+        self.kiosk = load_kiosk_config(KIOSK_CONFIG_PATH or Path(self.user_data_dir) / "kiosk.json")
+
+        # Live camera frame display, one tile per camera. Registration
+        # photos come from the first one.
+        tiles = GridLayout(cols=math.ceil(math.sqrt(len(self.kiosk.cameras))))
+        self.image_widgets = [Image(allow_stretch=True, keep_ratio=True) for _ in self.kiosk.cameras]
+        for image_widget in self.image_widgets:
+            tiles.add_widget(image_widget)
+        root.add_widget(tiles)
+        self.image_widget = self.image_widgets[0]
 
         # Button bar.
         button_bar = BoxLayout(
@@ -163,11 +290,13 @@ class FaceApp(App):
             spacing=dp(10),
             padding=dp(10),
         )
+        # Both flows need the gallery, so they stay disabled until the
+        # recogniser is ready.
         self.register_btn = Button(
-            text="Register New Face", background_color=(0.13, 0.59, 0.95, 1)
+            text="Register New Face", background_color=(0.13, 0.59, 0.95, 1), disabled=True
         )
         self.update_btn = Button(
-            text="Update Photos", background_color=(0.20, 0.80, 0.20, 1)
+            text="Update Photos", background_color=(0.20, 0.80, 0.20, 1), disabled=True
         )
         button_bar.add_widget(self.register_btn)
         button_bar.add_widget(self.update_btn)
@@ -184,16 +313,32 @@ class FaceApp(App):
         self.register_btn.bind(on_press=self._register_popup)
         self.update_btn.bind(on_press=self._update_photos_popup)
 
-        # Open webcam (index 0) – raise if unavailable to fail fast.
-        self.capture = cv2.VideoCapture(0)
-        if not self.capture.isOpened():
-            raise RuntimeError("Cannot open webcam – please check camera device.")
-
-        # Start capture/processing thread.
-        self.capture_thread = threading.Thread(
-            target=self._camera_loop, daemon=True, name="CameraThread"
+        # Load the detector and recogniser while the camera comes up.
+        self.warmup_thread = threading.Thread(
+            target=self._warm_up, daemon=True, name="WarmupThread"
         )
-        self.capture_thread.start()
+        self.warmup_thread.start()
+
+        # Open the cameras – raise if one is unavailable to fail fast.
+        self.feeds = [self._open_feed(i, source) for i, source in enumerate(self.kiosk.cameras)]
+
+        # Start a grabber and a capture/processing thread per camera (and,
+        # with detection workers, the thread that collects their results).
+        for feed in self.feeds:
+            feed.grabber.start()
+            thread = threading.Thread(
+                target=self._pipelined_camera_loop if DETECTION_WORKERS else self._camera_loop,
+                args=(feed,),
+                daemon=True,
+                name=f"CameraThread-{feed.index + 1}",
+            )
+            thread.start()
+            self.camera_threads.append(thread)
+        if DETECTION_WORKERS:
+            self.result_thread = threading.Thread(
+                target=self._result_loop, daemon=True, name="ResultThread"
+            )
+            self.result_thread.start()
 
         # Schedule UI texture updates at ~30 FPS.
         Clock.schedule_interval(self._update_texture, 1 / 30)
@@ -212,18 +357,65 @@ class FaceApp(App):
         )
         root.add_widget(self.status_label)
 
+        # Readiness banner shown until the recogniser is warm.
+        self.readiness_label = Label(
+            text=READINESS_TEXT[self.startup.stage],
+            size_hint=(1, None),
+            height=dp(30),
+            pos_hint={"center_x": 0.5, "y": 0.1},
+            color=(0.8, 0.8, 0.8, 1),
+            font_size=dp(16),
+        )
+        root.add_widget(self.readiness_label)
+
 
         return root
 
     def on_stop(self) -> None:  # noqa: D401 (Kivy signature)
         """Called by Kivy when the application is shutting down."""
         self._stop_event.set()
+        for feed in self.feeds:
+            feed.grabber.stop()
+
+        for thread in (*self.camera_threads, self.result_thread):
+            if thread and thread.is_alive():
+                thread.join(timeout=2.0)
+        if self.detection_pool is not None:
+            self.detection_pool.close()
 
-        if self.capture_thread and self.capture_thread.is_alive():
-            self.capture_thread.join(timeout=2.0)
+        for feed in self.feeds:
+            feed.grabber.capture.release()
 
-        if self.capture:
-            self.capture.release()
+        if self.models is None:  # still warming up
+            Logger(f"[INFO] Application closed during start-up – {self.startup.as_dict()}")
+            return
+        self.models.shutdown()
+        for shard, holder in self.models.loaded():
+            matcher = holder.snapshot().matcher
+            Logger(
+                f"[INFO] Shard '{shard}': {len(matcher)} samples, "
+                f"{matcher.memory_bytes() / 2**20:.1f} MB ({matcher.name} backend)."
+            )
+            index = getattr(matcher, "index", None)
+            if index is not None:
+                Logger(f"[INFO] ANN recall vs exact search ({shard}): {index.stats.as_dict()}")
+            cascade = getattr(matcher, "cascade", None)
+            if cascade is not None:
+                Logger(f"[INFO] Matching cascade vs exact search ({shard}): {cascade.stats.as_dict()}")
+        Logger(f"[INFO] Shard loads: {self.models.loads}, evictions: {self.models.evictions}.")
+        Logger(f"[INFO] Enrolment capture quality: {self.capture_stats.as_dict()}")
+        if self.detection_pool is not None:
+            Logger(f"[INFO] Detection workers ({DETECTION_WORKERS}): {self.detection_pool.stats.as_dict()}")
+        for feed in self.feeds:
+            Logger(f"[INFO] {feed.name} ({feed.source!r}) frames: { {**feed.stats.as_dict(), **feed.grabber.stats.as_dict()} }")
+            if self.detection_pool is None:
+                Logger(f"[INFO] {feed.name} face detection (interval now {feed.face_finder.interval}): {feed.face_finder.stats.as_dict()}")
+            Logger(f"[INFO] {feed.name} detection scale: {feed.scale_control.as_dict()}")
+            Logger(f"[INFO] {feed.name} frame preprocessing: {feed.preprocessor.stats.as_dict()}")
+            Logger(f"[INFO] {feed.name} face tracking: {feed.tracker.stats.as_dict()}")
+            if feed.motion_gate is not None:
+                Logger(f"[INFO] {feed.name} motion gate: {feed.motion_gate.stats.as_dict()}")
+        Logger(f"[INFO] Start-up timeline: {self.startup.as_dict()}")
 
         Logger(f"[INFO] Application closed cleanly – {python_time_now()}")
 
@@ -327,160 +519,652 @@ class FaceApp(App):
     # Camera capture + recognition thread
     # ------------------------------------------------------------------
 
-    def _camera_loop(self) -> None:
-        """Runs in a background thread: capture, detect & recognise faces."""
+    def _open_feed(self, index: int, source: CameraSource) -> CameraFeed:
+        """Opens camera *source* with its own grabber and per-camera pipeline state."""
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise RuntimeError(f"Cannot open camera {source!r} – please check camera device.")
+        # The resolution the camera reports (0 if it does not) sizes the
+        # detection workers' frame ring.
+        width, height = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        # Detection resolution and face-size bounds.
+        scale_control = ScaleController(
+            factor=FRAME_REDUCE_FACTOR,
+            min_factor=DETECT_MIN_FACTOR,
+            max_factor=DETECT_MAX_FACTOR,
+            budget_ms=FRAME_BUDGET_MS,
+            min_detect_px=DETECT_MIN_FACE_PX,
+        )
+        return CameraFeed(
+            index,
+            source,
+            # Frames are grabbed in their own thread so processing always
+            # gets the newest one instead of whatever the driver buffered.
+            grabber=FrameGrabber(capture, name=f"FrameGrabber-{index + 1}"),
+            # Wakes detection up when something moves.
+            motion_gate=(
+                MotionGate(min_changed=MOTION_MIN_CHANGED, hold_s=MOTION_HOLD_SECONDS) if MOTION_GATING else None
+            ),
+            scale_control=scale_control,
+            # Face detection on the down-scaled frames, alternating with
+            # optical-flow tracking.
+            face_finder=DetectThenTrack(
+                functools.partial(self._detect_faces, scale_control),
+                interval=DETECT_EVERY_N_FRAMES,
+                max_interval=DETECT_MAX_INTERVAL,
+                roi_padding=DETECT_ROI_PADDING,
+                full_scan_every=DETECT_FULL_SCAN_EVERY,
+            ),
+            # Faces followed across frames, with their cached identities.
+            tracker=FaceTracker(
+                max_missed=TRACK_MAX_MISSED,
+                refresh_frames=TRACK_REFRESH_FRAMES,
+                retry_frames=TRACK_RETRY_FRAMES,
+            ),
+            shape=(height, width, 3) if width > 0 and height > 0 else None,
+        )
+
+    def _camera_loop(self, feed: CameraFeed) -> None:
+        """Runs in a background thread per camera: capture, detect & recognise faces."""
+        while not self._stop_event.is_set():
+            ret, frame, captured_at = feed.grabber.read()
+            if not ret:
+                continue  # No new frame yet.
+
+            # Detection starts once the warm-up has loaded the detector and
+            # sleeps while the motion gate sees a static, empty scene; the
+            # preview runs on its own meanwhile.
+            faces = []
+            started = time.perf_counter()
+            factor = feed.scale_control.factor
+            detecting = self.startup.reached(DETECTING) and self._motion_gate_open(feed, frame)
+            if detecting:
+                # Gray once at full resolution (for the face crops), then
+                # down-scaled for faster detection.
+                gray_small = feed.preprocessor.prepare(frame, factor)
+
+                # Face detection every few frames - around the known faces
+                # when there are any - and optical flow in between.
+                motion = feed.motion_gate.motion_mask if feed.motion_gate is not None else None
+                faces = feed.face_finder.process(gray_small, motion)
+
+
+            # Map coordinates back to the original frame.
+            boxes = full_frame_boxes(faces, factor, frame.shape)
+            feed.faces_present = bool(boxes)
+            # Freshly detected (not merely tracked) faces teach the size range.
+            if detecting and feed.face_finder.mode != TRACK:
+                feed.scale_control.observe([w_full for (_, _, w_full, _) in boxes])
+
+            self._show_faces(feed, frame, boxes, captured_at)
+
+            # Keep processed frames within the budget by adapting the
+            # detection resolution; tracked boxes follow the new scale.
+            if detecting:
+                new_factor = feed.scale_control.record_frame(time.perf_counter() - started)
+                if new_factor is not None:
+                    feed.face_finder.rescale(new_factor / factor)
+
+            self._publish_frame(feed, frame, captured_at)
+
+    def _pipelined_camera_loop(self, feed: CameraFeed) -> None:
+        """Runs in a thread per camera with DETECTION_WORKERS: capture and hand frames to the pool."""
+        oversized = False
         while not self._stop_event.is_set():
-            ret, frame = self.capture.read()
+            ret, frame, captured_at = feed.grabber.read()
             if not ret:
-                continue  # Skip invalid frame.
+                continue  # No new frame yet.
 
-            # Down-scale for faster detection.
-            h, w = frame.shape[:2]
-            resized = cv2.resize(
-                frame, (int(w * FRAME_REDUCE_FACTOR), int(h * FRAME_REDUCE_FACTOR))
-            )
-            gray_small = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
+            if not self._detection_pool_ready():
+                self._publish_frame(feed, frame, captured_at)
+                continue
+            # From here on every frame goes through the pool, so that the
+            # result thread sees them in order.
+            if self._motion_gate_open(feed, frame):
+                try:
+                    self.detection_pool.submit(
+                        frame,
+                        feed.scale_control.factor,
+                        feed.scale_control.size_bounds(),
+                        captured_at,
+                        feed.index,
+                    )
+                    continue
+                except ValueError as exc:  # bigger than the camera said
+                    if not oversized:
+                        Logger(f"[WARN] {feed.name}: {exc}; its frames skip detection.")
+                        oversized = True
+            self.detection_pool.pass_through(frame, captured_at, feed.index)
+
+    def _detection_pool_ready(self) -> bool:
+        """Starts the shared worker pool once detection is on."""
+        if self.detection_pool is not None:
+            return True
+        with self._pool_lock:
+            if self.detection_pool is None:
+                if not self.startup.reached(DETECTING):
+                    return False
+                width, height = DETECTION_MAX_FRAME_SIZE
+                self.detection_pool = DetectionPool(
+                    DETECTION_WORKERS,
+                    max(int(np.prod(feed.shape or (height, width, 3))) for feed in self.feeds),
+                    self.kiosk.detector,
+                    self.kiosk.detector_options,
+                )
+        return True
 
-            # Haar face detection.
+    def _result_loop(self) -> None:
+        """Runs in the result thread: tracks, recognises and draws the pool's frames in order."""
+        while not self._stop_event.is_set():
+            if self.detection_pool is None:
+                self._stop_event.wait(0.05)
+                continue
+            result = self.detection_pool.next_result()
+            if result is None:
+                continue
+            feed = self.feeds[result.source]
             try:
-                faces = self.face_cascade.detectMultiScale(gray_small, scaleFactor=1.1, minNeighbors=5)
-            except cv2.error as e:
-                Logger(f"[ERROR] OpenCV error in detectMultiScale: {e}. This might indicate a corrupted cascade file or an issue with your OpenCV installation.")
-                # Attempt to continue, but repeated errors might require app restart or fix.
-                faces = [] # Treat as no faces detected if error occurs
-
-
-            for (x, y, w_s, h_s) in faces:
-                # Map coordinates back to original frame.
-                x_full, y_full, w_full, h_full = [
-                    int(v / FRAME_REDUCE_FACTOR) for v in (x, y, w_s, h_s)
-                ]
-
-                # Extract face ROI & recognise.
-                face_roi = cv2.cvtColor(
-                    frame[y_full : y_full + h_full, x_full : x_full + w_full], cv2.COLOR_BGR2GRAY
+                if result.boxes is not None:
+                    feed.scale_control.observe([w_full for (_, _, w_full, _) in result.boxes])
+                    # Workers pick the new scale up with the next frame.
+                    feed.scale_control.record_frame(result.seconds)
+                feed.faces_present = bool(result.boxes)
+                self._show_faces(feed, result.frame, result.boxes or [], result.captured_at, crop_from=result.frame)
+                self._publish_frame(feed, result.frame, result.captured_at)
+            except Exception as exc:  # one bad frame must not stop every camera
+                Logger(f"[ERROR] Could not process a frame from camera {result.source}: {exc}")
+
+    def _show_faces(self, feed: CameraFeed, frame: np.ndarray, boxes: List[Tuple[int, int, int, int]],
+                    captured_at: float, crop_from: Optional[np.ndarray] = None) -> None:
+        """Tracks, recognises and draws the faces in *boxes* onto *feed*'s *frame*.
+
+        Faces are cropped from the frame the feed's preprocessor prepared last, or
+        from *crop_from* when it was detected elsewhere. *captured_at* is the
+        frame's grab time, for the frame age at recognition.
+        """
+        # Faces are followed from frame to frame and keep their identity;
+        # only new tracks and ones due a re-check are cropped and
+        # recognised, in one batched pass per shard, at the size the
+        # recognisers were trained on. While the recogniser is still
+        # warming up faces are only boxed.
+        if self.startup.reached(READY):
+            with feed.lock:  # the camera thread may reset the tracker
+                tracks = feed.tracker.update(boxes)
+                due = [i for i, track in enumerate(tracks) if feed.tracker.needs_recognition(track)]
+                face_rois = feed.preprocessor.crops([boxes[i] for i in due], crop_from)
+                for i, result in zip(due, self._recognise(face_rois)):
+                    confident = result[0].distance < TRACK_CONFIDENT_RATIO * self.recognition_threshold
+                    feed.tracker.record(tracks[i], result, confident)
+            if due:
+                self.startup.mark("first recognition")
+                feed.grabber.stats.record_age(captured_at)
+            matches = [track.identity for track in tracks]
+        else:
+            for (x_full, y_full, w_full, h_full) in boxes:
+                cv2.rectangle(
+                    frame, (x_full, y_full), (x_full + w_full, y_full + h_full), (0, 255, 255), 2
                 )
-                try:
-                    label, conf = self.recognizer.predict(face_roi)
-                except Exception:
-                    label, conf = -1, 1000  # Unknown.
-
-                name, emp_id = self.label_map.get(label, ("unknown", ""))
-                now = time.time()
-
-                if conf < 60:  # Recognised.
-                    last_seen = self.last_seen_time.get(emp_id, 0)
-                    if now - last_seen > RECOGNITION_INTERVAL:
+            matches = []
+        for (x_full, y_full, w_full, h_full), (match, name, emp_id) in zip(boxes, matches):
+            conf = match.distance
+            now = time.time()
+
+            if conf < self.recognition_threshold:  # Recognised.
+                # Cameras share the dedup, so check and claim it atomically.
+                with self._attendance_lock:
+                    due_again = now - self.last_seen_time.get(emp_id, 0) > RECOGNITION_INTERVAL
+                    if due_again:
                         self.last_seen_time[emp_id] = now
-                        threading.Thread(
-                            target=self._handle_successful_recognition,
-                            args=(name, emp_id),
-                            daemon=True,
-                            name="AttendanceSubmitter",
-                        ).start()
-                        # Show success message on UI
-                        self._show_status_message(f"Attendance recorded for {name.title()}!", 3, (0, 1, 0, 1)) # Green color
-                    else:
-                        # Show already done message on UI without timer
-                        self._show_status_message(f"Attendance already recorded for {name.title()}.", 3, (1, 0.5, 0, 1)) # Orange color
-                    
-                    # Draw green rectangle & label for recognized faces (even if on cooldown)
-                    cv2.rectangle(
-                        frame, (x_full, y_full), (x_full + w_full, y_full + h_full), (0, 255, 0), 2
-                    )
-                    cv2.putText(
-                        frame,
-                        f"{name.title()} ({emp_id})",
-                        (x_full, y_full - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        0.7,
-                        (0, 255, 0),
-                        2,
-                    )
-                    # Call the new function to overlay tick next to name
-                    self._overlay_tick_next_to_name(frame, x_full, y_full - 10, name.title(), emp_id, 0.7, 2)
-                else:  # Unknown face.
-                    cv2.rectangle(
-                        frame, (x_full, y_full), (x_full + w_full, y_full + h_full), (0, 0, 255), 2
-                    )
-                    cv2.putText(
-                        frame,
-                        "Unknown",
-                        (x_full, y_full - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        0.7,
-                        (0, 0, 255),
-                        2,
-                    )
+                if due_again:
+                    feed.announce(emp_id, now)
+                    threading.Thread(
+                        target=self._handle_successful_recognition,
+                        args=(name, emp_id),
+                        daemon=True,
+                        name="AttendanceSubmitter",
+                    ).start()
+                    # Show success message on UI
+                    self._show_status_message(f"Attendance recorded for {name.title()}!", 3, (0, 1, 0, 1)) # Green color
+                elif feed.announce(emp_id, now):
+                    # Show already done message on UI without timer
+                    self._show_status_message(f"Attendance already recorded for {name.title()}.", 3, (1, 0.5, 0, 1)) # Orange color
+                
+                # Draw green rectangle & label for recognized faces (even if on cooldown)
+                cv2.rectangle(
+                    frame, (x_full, y_full), (x_full + w_full, y_full + h_full), (0, 255, 0), 2
+                )
+                cv2.putText(
+                    frame,
+                    f"{name.title()} ({emp_id})",
+                    (x_full, y_full - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.7,
+                    (0, 255, 0),
+                    2,
+                )
+                # Call the new function to overlay tick next to name
+                self._overlay_tick_next_to_name(frame, x_full, y_full - 10, name.title(), emp_id, 0.7, 2)
+            else:  # Unknown face.
+                cv2.rectangle(
+                    frame, (x_full, y_full), (x_full + w_full, y_full + h_full), (0, 0, 255), 2
+                )
+                cv2.putText(
+                    frame,
+                    "Unknown",
+                    (x_full, y_full - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.7,
+                    (0, 0, 255),
+                    2,
+                )
 
-            # Place latest frame into queue (discard older).
-            if not self.frame_queue.empty():
-                try:
-                    self.frame_queue.get_nowait()
-                except queue.Empty:
-                    pass
-            self.frame_queue.put(frame)
+    def _publish_frame(self, feed: CameraFeed, frame: np.ndarray, captured_at: float) -> None:
+        """Hands *feed*'s processed *frame* to the UI thread."""
+        feed.stats.record(captured_at)
+        # Place latest frame into queue (discard older).
+        if not feed.frame_queue.empty():
+            try:
+                feed.frame_queue.get_nowait()
+            except queue.Empty:
+                pass
+        feed.frame_queue.put(frame)
+
+    def _motion_gate_open(self, feed: CameraFeed, frame: np.ndarray) -> bool:
+        """Whether *feed*'s *frame* should go through detection, per its motion gate."""
+        if feed.motion_gate is None:
+            return True
+        was_active = feed.motion_gate.active
+        if feed.motion_gate.update(frame, feed.faces_present):
+            return True
+        if was_active:
+            # Falling asleep: whoever walks up next starts from a clean slate.
+            # With detection workers the result thread is using the tracker.
+            with feed.lock:
+                feed.face_finder.reset()
+                feed.tracker.reset()
+        return False
+
+    def _detect_faces(self, scale_control: ScaleController, gray_small: np.ndarray) -> Sequence[Tuple[int, int, int, int]]:
+        """Face detection on a down-scaled grayscale frame, within *scale_control*'s face sizes."""
+        try:
+            return self.face_detector.detect(gray_small, **scale_control.size_bounds())
+        except cv2.error as e:
+            Logger(f"[ERROR] OpenCV error in {self.face_detector.name} face detection: {e}. This might indicate a corrupted model file or an issue with your OpenCV installation.")
+            # Attempt to continue, but repeated errors might require app restart or fix.
+            return [] # Treat as no faces detected if error occurs
+
+    def _recognise(self, face_rois: List[np.ndarray]) -> List[Tuple[MatchResult, str, str]]:
+        """Matches faces against this kiosk's shards; returns ``(match, name, emp_id)``.
+
+        Each face keeps its closest match over all shards, each shard being
+        read from one consistent model version. With ``fallback_to_global``
+        faces no shard recognised are retried on the global shard, which is
+        loaded on first use. A shard that is still loading matches nothing
+        rather than holding up the camera.
+        """
+        if not face_rois:
+            return []
+        queries = self.face_encoder.encode(face_rois)
+        results = [(MatchResult(-1, float("inf"), []), "unknown", "")] * len(queries)
+
+        def _match(shard: str, faces: np.ndarray) -> None:
+            holder = self.models.try_get(shard)
+            if holder is None:
+                return
+            model = holder.snapshot()
+            for i, match in zip(faces, model.matcher.match_features(queries[faces])):
+                if match.distance < results[i][0].distance:
+                    results[i] = (match, *model.identities.get(match.label))
+
+        for shard in self.kiosk.shards:
+            _match(shard, np.arange(len(queries)))
+        if self.kiosk.fallback_to_global and GLOBAL_SHARD not in self.kiosk.shards:
+            misses = [i for i, (match, _, _) in enumerate(results) if match.distance >= self.recognition_threshold]
+            if misses:
+                _match(GLOBAL_SHARD, np.array(misses))
+        return results
 
     # ------------------------------------------------------------------
     # UI texture refresh (main thread)
     # ------------------------------------------------------------------
 
     def _update_texture(self, _dt) -> None:  # noqa: D401 (Kivy signature)
-        """Updates the Kivy Image widget with the latest camera frame."""
-        if self.frame_queue.empty():
+        """Updates each camera's Image tile with its latest frame."""
+        for feed, image_widget in zip(self.feeds, self.image_widgets):
+            if feed.frame_queue.empty():
+                continue
+            frame = feed.frame_queue.get()
+            # Flip the frame vertically for Kivy texture, convert to bytes.
+            buf = cv2.flip(frame, 0).tobytes()
+            # Create a Kivy texture from the buffer.
+            img_texture = Texture.create(size=(frame.shape[1], frame.shape[0]), colorfmt="bgr")
+            img_texture.blit_buffer(buf, colorfmt="bgr", bufferfmt="ubyte")
+            image_widget.texture = img_texture
+            self.startup.mark("first frame")
+
+    # ------------------------------------------------------------------
+    # Staged start-up (warm-up thread)
+    # ------------------------------------------------------------------
+
+    def _warm_up(self) -> None:
+        """Runs in a background thread: loads what detection and recognition need.
+
+        The camera preview is already running. Detection is switched on as
+        soon as the kiosk's face detector is loaded, recognition (and the
+        registration buttons) once its shard models are loaded and the
+        backend has encoded a first face.
+        """
+        face_detector = self._select_detector()
+        if face_detector is None:
+            # Nothing can be detected, so there is no point loading the
+            # recogniser; the preview keeps running with the error shown.
+            self._set_readiness(FAILED)
             return
-        frame = self.frame_queue.get()
-        # Flip the frame vertically for Kivy texture, convert to bytes.
-        buf = cv2.flip(frame, 0).tobytes()
-        # Create a Kivy texture from the buffer.
-        img_texture = Texture.create(size=(frame.shape[1], frame.shape[0]), colorfmt="bgr")
-        img_texture.blit_buffer(buf, colorfmt="bgr", bufferfmt="ubyte")
-        self.image_widget.texture = img_texture
+        self.face_detector = face_detector
+        self._set_readiness(DETECTING)
+
+        self.tick_icon = self._load_tick_icon()
+        self.user_emails = self._load_emails()
+        try:
+            self._load_recognition()
+        except Exception as exc:  # keep previewing and detecting
+            Logger(f"[ERROR] Failed to load the recogniser: {exc}")
+            Clock.schedule_once(
+                lambda _dt: self._show_readiness("Face recogniser failed to load – please restart the app."), 0
+            )
+            return
+        if self._stop_event.is_set():
+            return
+        Clock.schedule_once(self._load_sound, 0)
+        self._set_readiness(READY)
+
+    def _load_recognition(self) -> None:
+        """Opens the sample store and loads this kiosk's shard models (warm-up thread)."""
+        # Face samples live in one packed, memory-mapped store; galleries of
+        # individual image files from older versions are moved into it once.
+        self.sample_store = SampleStore(self._known_faces_dir)
+        migrate_sample_files(self._known_faces_dir, self.sample_store, SampleLoader())
+
+        # The gallery is split into shards (site, shift, department…); this
+        # kiosk matches against the shards named in its configuration, each
+        # restored from its own model cache, or trained on its members'
+        # samples, when first used. Recently used shards stay loaded within
+        # the configured memory budget; the kiosk's own shards (and its
+        # fallback) are never evicted.
+        # An empty instance of the configured backend encodes query faces;
+        # its threshold decides what counts as recognised.
+        self.face_encoder = self._select_backend()
+        self.recognition_threshold = self.face_encoder.threshold
+        self.shard_members = ShardMembership(self._known_faces_dir)
+        pinned = self.kiosk.shards + ((GLOBAL_SHARD,) if self.kiosk.fallback_to_global else ())
+        self.models = ShardRegistry(self._open_shard, self.kiosk.memory_budget_mb << 20, pinned)
+        for shard in self.kiosk.shards:
+            if self._stop_event.is_set():
+                return
+            self.models.get(shard)
+        # The first encode pays for lazy initialisation (DNN backends in
+        # particular); do it here rather than on the first face.
+        self.face_encoder.encode([np.zeros((FACE_SIZE, FACE_SIZE), dtype=np.uint8)])
+
+    def _select_detector(self) -> Optional[FaceDetector]:
+        """Creates the kiosk's face detector, falling back to Haar; ``None`` if even that fails.
+
+        Camera and enrolment threads detect concurrently, so each gets its
+        own instance from a :class:`DetectorPool`.
+        """
+        try:
+            return DetectorPool(self.kiosk.detector, self.kiosk.detector_options)
+        except (ValueError, TypeError, OSError, cv2.error) as exc:
+            Logger(f"[ERROR] Could not create the {self.kiosk.detector} face detector ({exc}).")
+        if self.kiosk.detector != DEFAULT_DETECTOR:
+            Logger(f"[WARN] Falling back to the {DEFAULT_DETECTOR} face detector.")
+            self.kiosk = self.kiosk._replace(detector=DEFAULT_DETECTOR, detector_options=None)
+            return self._select_detector()
+        Logger("[ERROR] Please ensure 'haarcascade_frontalface_default.xml' is present and accessible, "
+               "and that opencv-python is correctly installed.")
+        return None
+
+    def _load_sound(self, _dt) -> None:  # noqa: D401 (Kivy signature)
+        """Loads the optional success sound (Kivy audio wants the UI thread)."""
+        self.sound = SoundLoader.load(AUDIO_FILE) or None
+
+    def _set_readiness(self, stage: str) -> None:
+        """Advances the start-up to *stage* and updates the readiness banner."""
+        self.startup.advance(stage)
+        Clock.schedule_once(lambda _dt: self._show_readiness(READINESS_TEXT[stage]), 0)
+
+    def _show_readiness(self, text: str) -> None:
+        """Shows *text* in the readiness banner; enables the buttons once ready (UI thread)."""
+        self.readiness_label.text = text
+        ready = self.startup.reached(READY)
+        self.register_btn.disabled = not ready
+        self.update_btn.disabled = not ready
 
     # ------------------------------------------------------------------
     # Training / retraining recogniser
     # ------------------------------------------------------------------
 
-    def _train_recognizer(self):  # noqa: D401 (private helper)
-        """Trains the LBPH face recognizer on known faces."""
-        images: list[np.ndarray] = []
-        labels: list[int] = []
-        label_map: Dict[int, Tuple[str, str]] = {}
-        label_id = 0
+    def _open_shard(self, shard: str, executor) -> ModelHolder:  # noqa: ANN001 (private helper)
+        """Builds the model holder of *shard* (see :class:`ShardRegistry`).
 
-        for file in sorted(os.listdir(self._known_faces_dir)):
-            if not file.lower().endswith((".jpg", ".png")):
-                continue
-            try:
-                name, emp_id, _ = file.split("_", 2)
-                name = name.lower()
-                emp_id = emp_id.upper()
-            except ValueError:
-                Logger(f"[WARN] Skipping unrecognised filename format: {file}")
-                continue
+        Readers take whole-model snapshots; updates run on the registry's
+        shared worker and are swapped in atomically.
+        """
+        return ModelHolder(*self._load_or_train_recognizer(shard), executor=executor)
 
-            img_path = self._known_faces_dir / file
-            img_gray = cv2.imread(str(img_path), cv2.IMREAD_GRAYSCALE)
-            if img_gray is None:
-                continue
+    def _select_backend(self) -> RecognizerBackend:
+        """Creates the kiosk's recognition backend, falling back to LBPH if it cannot be built."""
+        try:
+            return make_backend(self.kiosk.backend, **(self.kiosk.backend_options or {}))
+        except (ValueError, TypeError, OSError, cv2.error) as exc:
+            Logger(f"[ERROR] Could not create the {self.kiosk.backend} backend ({exc}) – using LBPH.")
+            self.kiosk = self.kiosk._replace(backend=DEFAULT_BACKEND, backend_options=None)
+            return make_backend(DEFAULT_BACKEND)
+
+    def _new_backend(self) -> RecognizerBackend:
+        return make_backend(self.kiosk.backend, **(self.kiosk.backend_options or {}))
+
+    def _model_cache(self, shard: str) -> ModelCache:
+        return ModelCache(
+            self._known_faces_dir,
+            None if shard == GLOBAL_SHARD else shard,
+            self.kiosk.backend,
+            self.kiosk.backend_options,
+        )
+
+    def _load_or_train_recognizer(self, shard: str = GLOBAL_SHARD):  # noqa: D401 (private helper)
+        """Restores the cached recogniser of *shard* and reconciles it with the sample store.
+
+        Samples of the shard's members stored since the cache was written
+        are added, retired ones (and ones of former members) dropped. Falls
+        back to a full retrain when there is no usable cache or the store
+        was recreated.
+        """
+        rows = self.sample_store.live_rows(self.shard_members.members(shard))
+        if not len(rows):
+            return self._train_recognizer([])
+
+        started = time.perf_counter()
+        model_cache = self._model_cache(shard)
+        cached = model_cache.load()
+        if cached is not None:
+            matcher, identities, generation = cached
+            if generation == self.sample_store.generation:
+                cached_count = len(matcher)
+                stale, new_rows = gallery_delta(matcher, self.sample_store, rows)
+                if len(stale):
+                    matcher = self._drop_samples(matcher, identities, stale)
+                if len(new_rows):
+                    self._load_samples(new_rows, identities, matcher)
+                matcher, retired = self._apply_sample_budget(matcher, identities)
+                changed = len(stale) + len(new_rows) + retired
+                # Fold the delta into the cache once it is a sizeable share
+                # of the model, so startup top-ups stay small.
+                if self._configure_index(matcher) or changed > MODEL_CACHE_REFRESH_RATIO * cached_count:
+                    model_cache.save(matcher, identities, self.sample_store.generation)
+                Logger(
+                    f"[INFO] Loaded cached recogniser '{shard}' ({cached_count} images, {len(new_rows)} added "
+                    f"and {len(stale) + retired} retired since) in {time.perf_counter() - started:.2f}s."
+                )
+                return matcher, identities
+            Logger("[INFO] Sample store was recreated – rebuilding recogniser.")
+        return self._rebuild_recognizer(shard)
 
-            # Resize image to 200x200 during training as well, for consistency
-            img_resized = cv2.resize(img_gray, (200, 200))
-            images.append(img_resized)
-            labels.append(label_id)
-            label_map[label_id] = (name, emp_id)
-            label_id += 1
+    def _rebuild_recognizer(self, shard: str = GLOBAL_SHARD):  # noqa: D401 (private helper)
+        """Retrains the recogniser of *shard* from scratch and refreshes its model cache.
 
-        recogniser = cv2.face.LBPHFaceRecognizer_create()
-        if images:
-            recogniser.train(images, np.array(labels))
+        Only needed when the cache is unusable; otherwise the cache is
+        reconciled with the store incrementally.
+        """
+        matcher, identities = self._train_recognizer(
+            self.sample_store.live_rows(self.shard_members.members(shard))
+        )
+        matcher, _ = self._apply_sample_budget(matcher, identities)
+        self._configure_index(matcher)
+        if len(identities):
+            self._model_cache(shard).save(matcher, identities, self.sample_store.generation)
+        return matcher, identities
+
+    def _train_recognizer(self, rows: Optional[Sequence[int]] = None):  # noqa: D401 (private helper)
+        """Builds the configured recognition backend from the stored faces."""
+        if rows is None:
+            rows = self.sample_store.live_rows()
+        identities = IdentityIndex()
+        matcher = self._new_backend()
+        loaded = self._load_samples(rows, identities, matcher)
+
+        if loaded:
             Logger(
-                f"[INFO] Trained recogniser on {len(images)} images across {len(label_map)} identities."
+                f"[INFO] Trained recogniser on {loaded} images across {len(identities)} identities."
             )
         else:
             Logger("[INFO] No images found – recogniser disabled until first registration.")
 
-        return recogniser, label_map
+        return matcher, identities
+
+    def _load_samples(self, rows: Sequence[int], identities: IdentityIndex, matcher: RecognizerBackend) -> int:  # noqa: D401
+        """Streams sample store *rows* into *matcher*, labelled by owner identity.
+
+        Encoding runs on a bounded thread pool straight from the
+        memory-mapped store; samples are consumed in row order and appended
+        in batches. New employees are added to *identities* and per-identity
+        sample counts are updated as a side effect. Returns the number of
+        samples added.
+        """
+        def _progress(done: int, total: int) -> None:
+            if total >= 100 and (done == total or done % max(1, total // 10) == 0):
+                Logger(f"[INFO] Loading gallery: {done}/{total} samples")
+
+        loader = SampleLoader(progress=_progress)
+        features: list[np.ndarray] = []
+        labels: list[int] = []
+        ids: list[int] = []
+        loaded = 0
+        for sample in loader.encode_rows(self.sample_store, rows, matcher.encode_one):
+            features.append(sample.features)
+            labels.append(identities.ensure(sample.name, sample.emp_id))
+            ids.append(sample.id)
+            identities.add_samples(sample.emp_id)
+            if len(features) >= GALLERY_LOAD_BATCH:
+                matcher.add_features(np.stack(features), labels, ids)
+                loaded += len(features)
+                features, labels, ids = [], [], []
+        if features:
+            matcher.add_features(np.stack(features), labels, ids)
+            loaded += len(features)
+
+        if len(rows):
+            timings = ", ".join(f"{stage} {secs:.2f}s" for stage, secs in loader.timings.items())
+            Logger(f"[INFO] Loaded {loaded} samples with {loader.workers} workers ({timings}).")
+        return loaded
+
+    @staticmethod
+    def _drop_samples(matcher: RecognizerBackend, identities: IdentityIndex, columns) -> RecognizerBackend:
+        """Returns *matcher* without gallery *columns*, updating sample counts."""
+        for label, count in zip(*np.unique(matcher.labels[columns], return_counts=True)):
+            identities.add_samples(identities.get(int(label))[1], -int(count))
+        return matcher.without(columns)
+
+    def _apply_sample_budget(self, matcher: RecognizerBackend, identities: IdentityIndex):
+        """Retires samples of identities over ``MAX_SAMPLES_PER_IDENTITY``.
+
+        A representative subset of each such identity is kept (see
+        :func:`select_representatives`); the rest are retired in the sample
+        store and dropped from the matcher, which is returned together with
+        the number of samples retired.
+        """
+        if not MAX_SAMPLES_PER_IDENTITY or not len(matcher):
+            return matcher, 0
+        labels = matcher.labels
+        over = np.flatnonzero(np.bincount(labels) > MAX_SAMPLES_PER_IDENTITY)
+        if not len(over):
+            return matcher, 0
+        retire: list[np.ndarray] = []
+        for label in over:
+            columns = np.flatnonzero(labels == label)
+            keep = select_representatives(matcher.features(columns), MAX_SAMPLES_PER_IDENTITY, distance=matcher.pairwise)
+            retire.append(np.delete(columns, keep))
+        columns = np.concatenate(retire)
+        ids = matcher.ids[columns]
+        self.sample_store.retire(ids[ids >= 0])
+        Logger(
+            f"[INFO] Retired {len(columns)} samples of {len(over)} identities over the "
+            f"budget of {MAX_SAMPLES_PER_IDENTITY} samples each."
+        )
+        return self._drop_samples(matcher, identities, columns), len(columns)
+
+    @staticmethod
+    def _configure_index(matcher: RecognizerBackend) -> bool:
+        """Attaches the ANN index or the matching cascade by gallery size.
+
+        Returns True if the ANN index was (re)built, i.e. the model cache is
+        worth re-saving; cascade descriptors are cheap and not cached. Both
+        work on LBP histograms, so other backends always search exhaustively.
+        """
+        if not isinstance(matcher, GalleryMatcher):
+            return False
+        if not ANN_INDEX_MIN_SAMPLES or len(matcher) < ANN_INDEX_MIN_SAMPLES:
+            matcher.index = None
+            if not CASCADE_MIN_SAMPLES or len(matcher) < CASCADE_MIN_SAMPLES:
+                matcher.cascade = None
+            elif matcher.cascade is None:
+                matcher.attach_cascade(CoarseFilter(grid=CASCADE_GRID, shortlist=CASCADE_SHORTLIST))
+            return False
+        matcher.cascade = None
+        index = matcher.index or IVFIndex()
+        index.nprobe, index.rerank = ANN_NPROBE, ANN_RERANK
+        if matcher.index is not None and len(index) == len(matcher):
+            return False
+        started = time.perf_counter()
+        matcher.attach_index(index)
+        Logger(f"[INFO] Built ANN index over {len(matcher)} samples in {time.perf_counter() - started:.2f}s.")
+        return True
+
+    def _enroll_samples(self, features: np.ndarray, ids: list[int], name: str, emp_id: str) -> Future:
+        """Queues the features of freshly captured samples for the next model version.
+
+        Every loaded shard *emp_id* belongs to is updated; shards that are not
+        loaded pick the samples up from the store when they are. They are
+        appended to a fork of the live matcher, so the cost scales with the
+        new samples rather than the gallery, then the per-identity budget is
+        applied. The on-disk caches are left as is; the next load reconciles
+        them with the store (see :meth:`_load_or_train_recognizer`).
+        """
+        def _update(snapshot):
+            identities = snapshot.identities.copy()
+            label = identities.ensure(name, emp_id)
+            identities.add_samples(emp_id, len(features))
+            matcher = snapshot.matcher.fork()
+            matcher.add_features(features, [label] * len(features), ids)
+            matcher, _ = self._apply_sample_budget(matcher, identities)
+            self._configure_index(matcher)
+            return matcher, identities
+
+        return gather([
+            holder.submit(_update, f"Enrolment of {len(features)} samples for {emp_id} ({shard})")
+            for shard, holder in self.models.loaded()
+            if self.shard_members.contains(shard, emp_id)
+        ])
 
     # ------------------------------------------------------------------
     # Registration / update photo flows
@@ -545,11 +1229,7 @@ class FaceApp(App):
                 Logger("[WARN] Employee ID cannot be empty for update.")
                 return
             email = self.user_emails.get(emp_id)
-            name_existing: Optional[str] = None
-            for _lbl, (nm, eid) in self.label_map.items():
-                if eid == emp_id:
-                    name_existing = nm
-                    break
+            name_existing = self.sample_store.name_for(emp_id)
 
             popup.dismiss()
             if email:
@@ -661,24 +1341,32 @@ class FaceApp(App):
         """Captures face samples for a given user.
         Incorporates image resizing, specific filename format, and delay from user's reference.
         Adds a countdown before capture and a completion message.
+        Candidates that are too small, badly exposed, blurred or near-duplicates
+        of samples already kept are rejected, with the reason shown on screen.
         """
         # Resolve name for existing employee ID if not supplied.
         if name is None:
-            for _lbl, (nm, eid) in self.label_map.items():
-                if eid == emp_id:
-                    name = nm
-                    break
+            name = self.sample_store.name_for(emp_id)
         if name is None:
             Logger("[ERROR] No existing face found for this ID – please register first.")
             Clock.schedule_once(lambda _dt: self._show_popup("Error", Label(text="No existing face found for this ID. Please register first."), size=(0.7, 0.4)))
             return
 
         count_target = sample_count if sample_count else SAMPLES_PER_USER
-        # Use self._known_faces_dir here
-        pattern = str(self._known_faces_dir / f"{name}_{emp_id}_*.jpg")
-        existing_files = glob.glob(pattern)
-        start_index = len(existing_files)
         collected = 0
+        new_faces: list[np.ndarray] = []
+        new_hists: list[np.ndarray] = []
+        new_ids: list[int] = []
+
+        # Existing samples of this person count as "already kept" for the
+        # near-duplicate check.
+        kept = self.sample_store.live_rows([emp_id])
+        gate = SampleQualityGate(
+            lbp_histograms(self.sample_store.faces()[kept]) if len(kept) else None,
+            min_face_px=CAPTURE_MIN_FACE_PX,
+            min_sharpness=CAPTURE_MIN_SHARPNESS,
+            min_novelty=CAPTURE_MIN_NOVELTY,
+        )
 
         Logger(
             f"[INFO] Starting sample capture for {emp_id} – target {count_target} faces (updating={updating})."
@@ -690,22 +1378,25 @@ class FaceApp(App):
             time.sleep(1) # Wait for 1 second for each countdown number
         self._show_status_message("Capturing now!", 1, (0, 1, 0, 1)) # Green for "Capturing now!"
         time.sleep(0.5) # Small pause before starting actual capture
+        deadline = time.monotonic() + CAPTURE_TIMEOUT
 
         # Loop to capture the target number of samples
         while collected < count_target and not self._stop_event.is_set():
+            if time.monotonic() > deadline:
+                Logger(f"[WARN] Capture for {emp_id} timed out with {collected}/{count_target} usable samples.")
+                break
             # Get the latest frame from the queue without blocking the camera thread
             # This helps in reducing perceived lag as the UI always gets the freshest frame
             frame = None
-            while not self.frame_queue.empty():
-                frame = self.frame_queue.get_nowait()
+            while not self.feeds[0].frame_queue.empty():
+                frame = self.feeds[0].frame_queue.get_nowait()
             
             if frame is None:
                 time.sleep(0.01) # Small sleep if no frame available, to prevent busy-waiting
                 continue
 
             gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            # Use scaleFactor=1.3 as per user's reference for face detection during capture
-            faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
+            faces = self.face_detector.detect(gray)
             
             # Iterate through all detected faces in the current frame to find one to capture
             # This loop will now continue until `count_target` images are collected
@@ -714,11 +1405,16 @@ class FaceApp(App):
                 x, y, w, h = faces[0] 
                 face_img = gray[y : y + h, x : x + w]
                 # Resize face image to 200x200 as per user's reference
-                face_img_resized = cv2.resize(face_img, (200, 200))
-                # Use current logic for filename to ensure unique names and proper continuation for updates
-                filename = f"{name}_{emp_id}_{start_index + collected:03d}.jpg"
-                # Use self._known_faces_dir here
-                cv2.imwrite(str(self._known_faces_dir / filename), face_img_resized) # Save resized image
+                face_img_resized = cv2.resize(face_img, (FACE_SIZE, FACE_SIZE))
+                report = gate.check(face_img_resized, min(w, h))
+                if not report.accepted:
+                    self._show_status_message(report.reason, 0.5, (1, 0.5, 0, 1)) # Orange for rejected photo
+                    time.sleep(0.1)
+                    continue
+                # Append to the packed store; it continues the employee's sample numbering
+                new_ids.extend(self.sample_store.append([face_img_resized], name, emp_id).tolist())
+                new_faces.append(face_img_resized)
+                new_hists.append(report.histogram)
                 collected += 1
                 Logger(f"[INFO] Captured sample {collected}/{count_target} for {emp_id}")
                 
@@ -734,14 +1430,34 @@ class FaceApp(App):
                 time.sleep(0.1) # Small delay to avoid hammering the loop if no face is present
 
 
-        Logger("[INFO] Capture complete – retraining recogniser…")
-        self.recognizer, self.label_map = self._train_recognizer()
-        Logger("[INFO] Update finished.")
-        # Show "Registration completed" or "Face updated" message based on 'updating' flag
-        if updating:
-            Clock.schedule_once(lambda _dt: self._show_status_message("Face updated!", 3, (0, 1, 0, 1)), 0)
+        self.capture_stats.merge(gate.stats)
+        Logger(f"[INFO] Capture quality for {emp_id}: {gate.stats.as_dict()}")
+        if not new_hists:
+            self._show_status_message("No usable photos captured – please try again.", 3, (1, 0, 0, 1))
+            return
+
+        Logger("[INFO] Capture complete – adding new samples to recogniser…")
+        # People registered at this kiosk join its home shard.
+        if not updating and self.kiosk.home_shard:
+            self.shard_members.add(self.kiosk.home_shard, emp_id)
+        # The gate's LBP histograms double as LBPH features.
+        if isinstance(self.face_encoder, GalleryMatcher):
+            features = np.stack(new_hists)
         else:
-            Clock.schedule_once(lambda _dt: self._show_status_message("Registration completed!", 3, (0, 1, 0, 1)), 0)
+            features = self.face_encoder.encode(new_faces)
+        enrolled = self._enroll_samples(features, new_ids, name, emp_id)
+
+        def _on_enrolled(future: Future) -> None:
+            if future.cancelled() or future.exception() is not None:
+                return
+            Logger("[INFO] Update finished.")
+            # Show "Registration completed" or "Face updated" message based on 'updating' flag
+            if updating:
+                Clock.schedule_once(lambda _dt: self._show_status_message("Face updated!", 3, (0, 1, 0, 1)), 0)
+            else:
+                Clock.schedule_once(lambda _dt: self._show_status_message("Registration completed!", 3, (0, 1, 0, 1)), 0)
+
+        enrolled.add_done_callback(_on_enrolled)
 
 
     # ------------------------------------------------------------------
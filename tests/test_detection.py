@@ -0,0 +1,98 @@
+import numpy as np
+
+from faceapp.detection import DETECT, ROI, TRACK, DetectThenTrack, full_frame_boxes
+
+FRAME = (120, 160)
+FACE = (60, 40, 30, 30)
+
+
+class FakeDetector:
+    """Finds FACE in the full frame, or in a region scanned around it."""
+
+    def __init__(self):
+        self.present = True
+        self.calls = []
+
+    def __call__(self, gray):
+        self.calls.append(gray.shape)
+        if not self.present:
+            return []
+        if gray.shape == FRAME:
+            return [FACE]
+        return [(15, 15, 30, 30)]  # FACE within its padded region
+
+
+def _frame():
+    rng = np.random.default_rng(0)
+    return (rng.random(FRAME) * 255).astype(np.uint8)
+
+
+def _run(finder, gray, frames):
+    modes, intervals = [], []
+    for _ in range(frames):
+        boxes = finder.process(gray)
+        modes.append(finder.mode)
+        intervals.append(finder.interval)
+    return modes, intervals, boxes
+
+
+def test_max_interval_one_detects_every_frame():
+    finder = DetectThenTrack(FakeDetector(), interval=5, max_interval=1, full_scan_every=2)
+
+    modes, _, boxes = _run(finder, _frame(), 5)
+
+    assert modes == [DETECT, ROI, DETECT, ROI, DETECT]
+    assert boxes == [FACE]
+
+
+def test_steady_scene_stretches_the_interval_and_rescans_the_full_frame():
+    finder = DetectThenTrack(FakeDetector(), interval=3, max_interval=5, full_scan_every=3)
+
+    modes, intervals, boxes = _run(finder, _frame(), 13)
+
+    assert modes == [
+        DETECT, TRACK, TRACK,
+        ROI, TRACK, TRACK, TRACK,
+        ROI, TRACK, TRACK, TRACK, TRACK,
+        DETECT,
+    ]
+    assert intervals == [3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 5, 5]
+    assert boxes == [FACE]
+
+
+def test_face_leaving_halves_the_interval():
+    detector = FakeDetector()
+    finder = DetectThenTrack(detector, interval=4, max_interval=8, full_scan_every=4)
+    gray = _frame()
+    _run(finder, gray, 4)  # detect, 3 x track
+    assert finder.interval == 4
+
+    detector.present = False
+    boxes = finder.process(gray)
+
+    assert finder.mode == ROI and boxes == []
+    assert finder.interval == 2
+    # Nothing left to scan around: the next detection covers the frame.
+    modes, _, _ = _run(finder, gray, 2)
+    assert modes == [TRACK, DETECT]
+
+
+def test_reset_detects_the_next_frame_afresh():
+    detector = FakeDetector()
+    finder = DetectThenTrack(detector, interval=5, max_interval=5)
+    gray = _frame()
+    _run(finder, gray, 3)
+
+    finder.reset()
+    finder.process(gray)
+
+    assert finder.mode == DETECT
+    assert detector.calls[-1] == FRAME
+
+
+def test_full_frame_boxes_stay_inside_the_frame():
+    boxes = [(10, 10, 20, 20), (-4, -2, 10, 10), (75, 55, 10, 10), (-10, 5, 8, 8)]
+
+    mapped = full_frame_boxes(boxes, 0.5, FRAME)
+
+    assert mapped == [(20, 20, 40, 40), (0, 0, 12, 16), (150, 110, 10, 10)]
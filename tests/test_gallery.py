@@ -0,0 +1,24 @@
+import numpy as np
+
+from faceapp.gallery import select_representatives
+
+
+def test_select_representatives_with_duplicate_samples_keeps_budget():
+    rng = np.random.default_rng(0)
+    distinct = rng.random((3, 16), dtype=np.float32)
+    # Ten copies of three samples: once they are picked every distance is 0.
+    hists = np.repeat(distinct, 10, axis=0)
+
+    picked = select_representatives(hists, budget=5)
+
+    assert len(picked) == 5
+    assert len(np.unique(picked)) == 5
+    assert {tuple(hists[i]) for i in picked} == {tuple(row) for row in distinct}
+
+
+def test_select_representatives_all_identical_samples():
+    hists = np.ones((8, 16), dtype=np.float32)
+
+    picked = select_representatives(hists, budget=4)
+
+    assert len(np.unique(picked)) == 4
@@ -0,0 +1,42 @@
+import numpy as np
+
+from faceapp.ann import IVFIndex
+from faceapp.cascade import CoarseFilter
+from faceapp.recognition import HISTOGRAM_SIZE, GalleryMatcher
+
+
+def _gallery(n=200):
+    rng = np.random.default_rng(1)
+    hists = rng.random((n, HISTOGRAM_SIZE), dtype=np.float32)
+    labels = np.arange(n) // 4
+    matcher = GalleryMatcher()
+    matcher.add_histograms(hists, labels)
+    return matcher, hists, labels
+
+
+def test_without_compacts_the_index_instead_of_dropping_it():
+    matcher, hists, labels = _gallery()
+    matcher.attach_index(IVFIndex(nprobe=1000, rerank=1000))
+    drop = np.arange(0, len(hists), 3)
+    keep = np.setdiff1d(np.arange(len(hists)), drop)
+
+    compacted = matcher.without(drop)
+
+    assert compacted.index is not None and compacted.index is not matcher.index
+    assert len(compacted.index) == len(compacted) == len(keep)
+    assert len(matcher.index) == len(hists)  # the published version is untouched
+    assert np.allclose(compacted.index.project(compacted.bins), compacted.index._proj[: len(keep)], atol=1e-4)
+    exact = GalleryMatcher()
+    exact.add_histograms(hists[keep], labels[keep])
+    queries = hists[keep[:20]]
+    assert [r.label for r in compacted.match_histograms(queries)] == [r.label for r in exact.match_histograms(queries)]
+
+
+def test_without_compacts_the_cascade():
+    matcher, hists, _ = _gallery()
+    matcher.attach_cascade(CoarseFilter())
+
+    compacted = matcher.without(np.arange(0, len(hists), 3))
+
+    assert len(compacted.cascade) == len(compacted)
+    assert np.allclose(compacted.cascade._bins[:, : len(compacted)], compacted.cascade.describe(compacted.bins))
@@ -0,0 +1,69 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from faceapp.shards import ShardRegistry
+
+MB = 1 << 20
+
+
+def _holder(size):
+    model = SimpleNamespace(matcher=SimpleNamespace(memory_bytes=lambda: size))
+    return SimpleNamespace(snapshot=lambda: model)
+
+
+def test_try_get_does_not_wait_for_the_load():
+    release = threading.Event()
+
+    def open_shard(shard, _executor):
+        release.wait(5)
+        return _holder(MB)
+
+    registry = ShardRegistry(open_shard, 10 * MB)
+    try:
+        assert registry.try_get("a") is None
+        assert registry.try_get("a") is None  # one load, not one per call
+        release.set()
+        holder = registry.get("a")
+        assert registry.try_get("a") is holder
+        assert registry.loads == 1
+    finally:
+        registry.shutdown(wait=True)
+
+
+def test_pinned_shards_are_never_evicted():
+    registry = ShardRegistry(lambda shard, _executor: _holder(4 * MB), 10 * MB, pinned=("a", "b"))
+    try:
+        for shard in ("a", "b", "c", "d", "a"):
+            registry.get(shard)
+        loaded = [shard for shard, _ in registry.loaded()]
+        assert "a" in loaded and "b" in loaded
+        assert "c" not in loaded
+    finally:
+        registry.shutdown(wait=True)
+
+
+def test_failed_load_is_not_retried_until_the_backoff_expires():
+    attempts = []
+
+    def open_shard(shard, _executor):
+        attempts.append(shard)
+        raise OSError("corrupt cache")
+
+    registry = ShardRegistry(open_shard, 10 * MB, retry_s=60.0)
+    try:
+        with pytest.raises(OSError):
+            registry.get("a")
+        for _ in range(5):
+            assert registry.try_get("a") is None
+        with pytest.raises(OSError):
+            registry.get("a")
+        assert attempts == ["a"]
+
+        registry.retry_s = 0.0
+        with pytest.raises(OSError):
+            registry.get("a")
+        assert attempts == ["a", "a"]
+    finally:
+        registry.shutdown(wait=True)
@@ -0,0 +1,59 @@
+import numpy as np
+
+from faceapp.common import FACE_SIZE
+from faceapp.store import FACE_BYTES, RECORD_DTYPE, SampleStore
+
+
+def _faces(n, value=0):
+    return [np.full((FACE_SIZE, FACE_SIZE), value + i, dtype=np.uint8) for i in range(n)]
+
+
+def test_torn_append_is_truncated_on_reopen(tmp_path):
+    store = SampleStore(tmp_path)
+    store.append(_faces(3), "ann", "E1")
+    faces_file, index_file = store._faces_file, store._index_file
+    # A crash mid-append: pixels of two more faces written, half an index record.
+    with faces_file.open("ab") as f:
+        f.write(b"\x07" * (2 * FACE_BYTES))
+    with index_file.open("ab") as f:
+        f.write(b"\x01" * (RECORD_DTYPE.itemsize // 2))
+
+    reopened = SampleStore(tmp_path)
+
+    assert len(reopened) == 3
+    assert faces_file.stat().st_size == 3 * FACE_BYTES
+    assert index_file.stat().st_size == 3 * RECORD_DTYPE.itemsize
+    assert [int(face[0, 0]) for face in reopened.faces()] == [0, 1, 2]
+    ids = reopened.append(_faces(1, value=9), "ann", "E1")
+    assert ids.tolist() == [3]
+    assert reopened.sample(3).sample == 3
+
+
+def test_records_for_unknown_identities_are_dropped(tmp_path):
+    store = SampleStore(tmp_path)
+    store.append(_faces(2), "ann", "E1")
+    # Rows appended by a process that crashed before store.json listed the person.
+    records = np.zeros(1, dtype=RECORD_DTYPE)
+    records["identity"] = 5
+    with store._faces_file.open("ab") as f:
+        f.write(b"\x00" * FACE_BYTES)
+    with store._index_file.open("ab") as f:
+        f.write(records.tobytes())
+
+    assert len(SampleStore(tmp_path)) == 2
+
+
+def test_interrupted_compaction_leaves_the_committed_file_set(tmp_path):
+    store = SampleStore(tmp_path)
+    store.append(_faces(4), "ann", "E1")
+    store.retire([1])
+    # A compaction that wrote its new file set but crashed before switching to it.
+    stray = [tmp_path / ".sample_store" / name for name in ("faces-deadbeef.u8", "index-deadbeef.bin")]
+    for path in stray:
+        path.write_bytes(b"partial")
+
+    reopened = SampleStore(tmp_path)
+
+    assert len(reopened) == 3
+    assert [reopened.sample(row).sample for row in reopened.live_rows()] == [0, 2, 3]
+    assert not any(path.exists() for path in stray)
@@ -0,0 +1,92 @@
+import time
+
+import numpy as np
+import pytest
+
+from faceapp.workers import DetectionPool
+
+SHAPE = (48, 64, 3)  # BGR, as the cameras deliver
+
+
+def _frame(value: int) -> np.ndarray:
+    return np.full(SHAPE, value, dtype=np.uint8)
+
+
+def _collect(pool, count, timeout=20.0):
+    results = []
+    deadline = time.monotonic() + timeout
+    while len(results) < count and time.monotonic() < deadline:
+        result = pool.next_result()
+        if result is not None:
+            results.append(result)
+    return results
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(**kwargs):
+        pool = DetectionPool(frame_bytes=int(np.prod(SHAPE)), **kwargs)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def test_results_come_out_in_submission_order(make_pool):
+    pool = make_pool(workers=2, slots=8)
+    for i in range(6):
+        if i % 3 == 2:
+            pool.pass_through(_frame(i), captured_at=float(i), source=i % 2)
+        else:
+            assert pool.submit(_frame(i), 1.0, {}, captured_at=float(i), source=i % 2)
+
+    results = _collect(pool, 6)
+
+    assert [r.captured_at for r in results] == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+    assert [r.source for r in results] == [0, 1, 0, 1, 0, 1]
+    assert [int(r.frame[0, 0, 0]) for r in results] == [0, 1, 2, 3, 4, 5]
+    assert [r.boxes is None for r in results] == [False, False, True, False, False, True]
+    assert pool.stats.passed_through == 2
+    assert pool.stats.frames == 6
+
+
+def test_frames_are_dropped_while_the_ring_is_full(make_pool):
+    pool = make_pool(workers=1, slots=1)
+
+    assert pool.submit(_frame(1), 1.0, {})
+    assert not pool.submit(_frame(2), 1.0, {})
+    assert pool.stats.dropped == 1
+
+    assert len(_collect(pool, 1)) == 1
+    assert pool.submit(_frame(3), 1.0, {})  # the slot is free again
+
+
+def test_a_stalled_result_is_skipped_and_discarded_when_it_turns_up(make_pool):
+    pool = make_pool(workers=1, slots=2, stall_s=0.2)
+    assert pool.submit(_frame(0), 1.0, {})  # sequence 0: the "stalled" one
+    pool._next = 1  # pretend sequence 0 was given up on before its result came
+    pool.pass_through(_frame(1), captured_at=1.0)
+
+    results = _collect(pool, 1)
+    deadline = time.monotonic() + 20.0
+    while pool._free.qsize() < pool.ring.slots and time.monotonic() < deadline:
+        assert pool.next_result() is None  # the late result is taken in, not handed out
+
+    assert [r.captured_at for r in results] == [1.0]
+    assert not pool._ready
+    assert pool._free.qsize() == pool.ring.slots
+
+
+def test_a_missing_result_is_given_up_on_after_stall_s(make_pool):
+    pool = make_pool(workers=1, slots=2, stall_s=0.2)
+    pool._seq = iter(range(1, 100))  # sequence 0 is never submitted
+    pool.pass_through(_frame(1), captured_at=1.0)
+
+    results = _collect(pool, 1, timeout=5.0)
+
+    assert [r.captured_at for r in results] == [1.0]
+    assert pool.stats.lost == 1
@@ -0,0 +1,173 @@
+"""Compares recogniser backends on an enrolled gallery.
+
+Run from the app directory (not shipped in the APK)::
+
+    python -m tools.benchmark_backends path/to/known_faces --backends lbph,eigen,fisher,dnn \
+        --option dnn.model=models/face_recognition_sface_2021dec.onnx
+
+Every ``--probe-every``-th live sample of each person with at least two
+samples is held out as a probe and the rest are enrolled, so every probe's
+identity is known to the gallery. Per backend it reports training time,
+per-face encode and match latency, rank-1/rank-3 accuracy, gallery memory,
+and - from each probe's distance to its own identity (genuine) and to the
+closest other one (impostor) - the true/false accept rates at the
+backend's threshold plus the equal-error-rate threshold to calibrate it with.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from faceapp.backends import BACKENDS, make_backend
+from faceapp.common import Logger
+from faceapp.store import SampleStore
+
+
+def split_rows(store: SampleStore, probe_every: int):
+    """Returns ``(gallery_rows, gallery_labels, probe_rows, probe_labels)``."""
+    records = store.records()
+    rows = store.live_rows()
+    identities = records["identity"][rows]
+    gallery, gallery_labels, probes, probe_labels = [], [], [], []
+    for identity in np.unique(identities):
+        own = rows[identities == identity]
+        if len(own) < 2:
+            gallery.extend(own)
+            gallery_labels.extend([identity] * len(own))
+            continue
+        held_out = np.zeros(len(own), dtype=bool)
+        held_out[probe_every - 1 :: probe_every] = True
+        held_out[-1] |= not held_out.any()
+        gallery.extend(own[~held_out])
+        gallery_labels.extend([identity] * int((~held_out).sum()))
+        probes.extend(own[held_out])
+        probe_labels.extend([identity] * int(held_out.sum()))
+    return (np.array(gallery), np.array(gallery_labels), np.array(probes), np.array(probe_labels))
+
+
+def equal_error_threshold(genuine: np.ndarray, impostor: np.ndarray) -> float:
+    """Distance threshold at which false accepts and false rejects are closest."""
+    candidates = np.unique(np.concatenate([genuine, impostor]))
+    if not len(candidates):
+        return float("nan")
+    far = np.searchsorted(np.sort(impostor), candidates, side="left") / max(len(impostor), 1)
+    frr = 1.0 - np.searchsorted(np.sort(genuine), candidates, side="left") / max(len(genuine), 1)
+    return float(candidates[np.argmin(np.abs(far - frr))])
+
+
+def benchmark(name: str, options: Dict[str, Any], store: SampleStore, split) -> Dict[str, Any]:
+    """Trains backend *name* on the gallery part of *split* and scores the probes."""
+    gallery_rows, gallery_labels, probe_rows, probe_labels = split
+    faces = store.faces()
+    gallery_faces = [np.array(faces[row]) for row in gallery_rows]
+    probe_faces = [np.array(faces[row]) for row in probe_rows]
+
+    backend = make_backend(name, **options)
+    started = time.perf_counter()
+    backend.train(gallery_faces, gallery_labels)
+    train_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    queries = backend.encode(probe_faces)
+    encode_s = time.perf_counter() - started
+    started = time.perf_counter()
+    matches = backend.match_features(queries, top_k=len(np.unique(gallery_labels)))
+    match_s = time.perf_counter() - started
+
+    genuine: List[float] = []
+    impostor: List[float] = []
+    rank1 = rank3 = 0
+    for truth, match in zip(probe_labels, matches):
+        ranked = [label for label, _ in match.candidates]
+        rank1 += int(ranked[:1] == [truth])
+        rank3 += int(truth in ranked[:3])
+        distances = dict(match.candidates)
+        genuine.append(distances.get(int(truth), float("inf")))
+        impostor.append(min((d for label, d in match.candidates if label != truth), default=float("inf")))
+    genuine_a, impostor_a = np.array(genuine), np.array(impostor)
+    n = max(len(probe_labels), 1)
+    return {
+        "backend": name,
+        "gallery": len(gallery_rows),
+        "probes": len(probe_rows),
+        "train_s": round(train_s, 3),
+        "encode_ms": round(1000.0 * encode_s / n, 3),
+        "match_ms": round(1000.0 * match_s / n, 3),
+        "rank1": round(rank1 / n, 4),
+        "rank3": round(rank3 / n, 4),
+        "memory_mb": round(backend.memory_bytes() / 2**20, 2),
+        "threshold": backend.threshold,
+        "tar": round(float(np.mean(genuine_a < backend.threshold)), 4),
+        "far": round(float(np.mean(impostor_a < backend.threshold)), 4),
+        "eer_threshold": round(equal_error_threshold(genuine_a, impostor_a), 4),
+    }
+
+
+def parse_options(pairs: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    """Turns ``backend.key=value`` pairs into per-backend option dicts (values parsed as JSON)."""
+    options: Dict[str, Dict[str, Any]] = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        backend, _, option = key.partition(".")
+        if not option:
+            raise SystemExit(f"--option expects backend.key=value, got {pair!r}")
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            parsed = value
+        options.setdefault(backend, {})[option] = parsed
+    return options
+
+
+def print_table(results: Sequence[Dict[str, Any]]) -> None:
+    """Prints result dicts (all with the same keys) as aligned columns."""
+    if not results:
+        return
+    columns = list(results[0])
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare recogniser backends on an enrolled gallery.")
+    parser.add_argument("gallery_dir", help="known_faces directory that holds .sample_store/")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="comma-separated backend names")
+    parser.add_argument("--probe-every", type=int, default=5, help="hold out every n-th sample per person")
+    parser.add_argument("--option", action="append", default=[], metavar="BACKEND.KEY=VALUE",
+                        help="backend constructor option, e.g. eigen.size=64 or dnn.model=path.onnx")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    store = SampleStore(args.gallery_dir)
+    split = split_rows(store, max(2, args.probe_every))
+    if not len(split[2]):
+        Logger("[ERROR] Need at least one person with two or more samples.")
+        return 1
+    options = parse_options(args.option)
+
+    results = []
+    for name in filter(None, (n.strip() for n in args.backends.split(","))):
+        try:
+            result = benchmark(name, options.get(name, {}), store, split)
+        except (ValueError, OSError) as exc:
+            Logger(f"[WARN] Skipping {name}: {exc}")
+            continue
+        results.append(result)
+        Logger(f"[INFO] {json.dumps(result)}")
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
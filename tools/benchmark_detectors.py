@@ -0,0 +1,153 @@
+"""Compares face detector backends on an annotated clip.
+
+Run from the app directory (not shipped in the APK)::
+
+    python -m tools.benchmark_detectors clip.mp4 clip.json --detectors haar,lbp,yunet \
+        --scales 1.0,0.5,0.35 --option yunet.score_threshold=0.8
+
+The annotations file maps frame indices to the faces in that frame, as
+full-resolution ``[x, y, w, h]`` boxes: ``{"0": [[412, 160, 96, 96]], "5": []}``.
+Every frame is timed; only annotated ones are scored. Per backend and
+detection scale (the app's frame reduce factor) it reports the detection
+time per frame, the recall and false positives per frame at an IoU of
+``--min-iou``, and the CPU load - process CPU time over wall time, so
+backends that use several cores show more than 100%.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from faceapp.common import Logger
+from faceapp.detectors import DETECTORS, make_detector
+from faceapp.tracking import Box, box_iou
+from tools.benchmark_backends import parse_options, print_table
+
+
+def read_clip(path: str, max_frames: int) -> List[np.ndarray]:
+    """Decodes up to *max_frames* BGR frames of the clip at *path*."""
+    capture = cv2.VideoCapture(path)
+    frames: List[np.ndarray] = []
+    try:
+        while len(frames) < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames.append(frame)
+    finally:
+        capture.release()
+    return frames
+
+
+def read_annotations(path: str) -> Dict[int, List[Box]]:
+    """Reads ``{frame index: [[x, y, w, h], ...]}``."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {int(index): [tuple(int(v) for v in box) for box in boxes] for index, boxes in data.items()}
+
+
+def score(found: Sequence[Box], truth: Sequence[Box], min_iou: float) -> Tuple[int, int]:
+    """Returns ``(true positives, false positives)``; each true face matches at most one box."""
+    if not len(found) or not len(truth):
+        return 0, len(found)
+    iou = box_iou(found, truth)
+    hits = 0
+    used_f, used_t = set(), set()
+    for flat in np.argsort(-iou, axis=None, kind="stable"):
+        f, t = np.unravel_index(flat, iou.shape)
+        if iou[f, t] < min_iou:
+            break
+        if f not in used_f and t not in used_t:
+            used_f.add(f)
+            used_t.add(t)
+            hits += 1
+    return hits, len(found) - hits
+
+
+def benchmark(name: str, options: Dict[str, Any], frames: Sequence[np.ndarray],
+              annotations: Dict[int, List[Box]], scale: float, min_iou: float) -> Dict[str, Any]:
+    """Runs detector *name* over *frames* shrunk by *scale* and scores the annotated ones."""
+    detector = make_detector(name, **options)
+    h, w = frames[0].shape[:2]
+    size = (max(1, int(w * scale)), max(1, int(h * scale)))
+    grays = [cv2.cvtColor(cv2.resize(frame, size), cv2.COLOR_BGR2GRAY) for frame in frames]
+    detector.detect(grays[0])  # first-call set-up is not what we are measuring
+
+    found: List[List[Box]] = []
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for gray in grays:
+        found.append(detector.detect(gray))
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+
+    faces = hits = false_positives = 0
+    for index, truth in annotations.items():
+        if index >= len(found):
+            continue
+        boxes = [tuple(int(round(v / scale)) for v in box) for box in found[index]]
+        tp, fp = score(boxes, truth, min_iou)
+        faces += len(truth)
+        hits += tp
+        false_positives += fp
+    scored = sum(1 for index in annotations if index < len(found))
+    return {
+        "detector": name,
+        "scale": scale,
+        "resolution": f"{size[0]}x{size[1]}",
+        "frames": len(grays),
+        "ms_per_frame": round(1000.0 * wall / len(grays), 3),
+        "cpu_percent": round(100.0 * cpu / wall, 1) if wall else 0.0,
+        "faces": faces,
+        "recall": round(hits / faces, 4) if faces else float("nan"),
+        "fp_per_frame": round(false_positives / scored, 3) if scored else float("nan"),
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare face detector backends on an annotated clip.")
+    parser.add_argument("clip", help="video file readable by OpenCV")
+    parser.add_argument("annotations", help='JSON {"frame index": [[x, y, w, h], ...]} at full resolution')
+    parser.add_argument("--detectors", default=",".join(DETECTORS), help="comma-separated detector names")
+    parser.add_argument("--scales", default="1.0,0.5,0.35", help="comma-separated frame reduce factors")
+    parser.add_argument("--min-iou", type=float, default=0.5, help="IoU for a detection to count as a hit")
+    parser.add_argument("--max-frames", type=int, default=300, help="frames of the clip to use")
+    parser.add_argument("--option", action="append", default=[], metavar="DETECTOR.KEY=VALUE",
+                        help="detector constructor option, e.g. haar.min_neighbors=3 or yunet.model=path.onnx")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    frames = read_clip(args.clip, args.max_frames)
+    if not frames:
+        Logger(f"[ERROR] Could not read any frames from {args.clip}.")
+        return 1
+    annotations = read_annotations(args.annotations)
+    options = parse_options(args.option)
+    scales = [float(s) for s in args.scales.split(",") if s.strip()]
+
+    results = []
+    for name in filter(None, (n.strip() for n in args.detectors.split(","))):
+        for scale in scales:
+            try:
+                result = benchmark(name, options.get(name, {}), frames, annotations, scale, args.min_iou)
+            except (ValueError, OSError, cv2.error) as exc:
+                Logger(f"[WARN] Skipping {name}: {exc}")
+                break
+            results.append(result)
+            Logger(f"[INFO] {json.dumps(result)}")
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,191 @@
+"""Runs recognition-style and enrolment-style face detection concurrently.
+
+Run from the app directory (not shipped in the APK)::
+
+    python -m tools.stress_detection clip.mp4 --camera-threads 2 --enrol-threads 1 \
+        --modes pooled,locked --rounds 3
+
+Camera threads detect in the clip's frames shrunk by ``--scale``, as the
+camera loop does; enrolment threads detect in the full-resolution frames,
+as the registration capture does. Each round every thread goes through
+the whole clip. The threads get their detectors in one of these ways:
+
+``pooled``
+    a :class:`~faceapp.detectors.DetectorPool`, one instance per thread
+    (what the app does);
+``locked``
+    one shared instance behind a lock - correct, but detection runs one
+    thread at a time;
+``shared``
+    one shared instance without a lock, as the app used to. Cascade
+    classifiers are not thread-safe, so expect mismatches or a crash.
+
+Every detection is checked against a single-threaded reference run. Per
+mode it reports the detections per second over all threads, the mean and
+95th-percentile time per detection, and how many detections differed
+from the reference.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+from faceapp.common import Logger
+from faceapp.detectors import DEFAULT_DETECTOR, DETECTORS, DetectorPool, FaceDetector, make_detector
+from faceapp.tracking import Box
+from tools.benchmark_backends import parse_options, print_table
+from tools.benchmark_detectors import read_clip
+
+MODES = ("pooled", "locked", "shared")
+
+
+class LockedDetector:
+    """One detector that only one thread at a time may use."""
+
+    def __init__(self, detector: FaceDetector):
+        self.name = detector.name
+        self._detector = detector
+        self._lock = threading.Lock()
+
+    def detect(self, gray: np.ndarray, min_size=None, max_size=None) -> List[Box]:
+        with self._lock:
+            return self._detector.detect(gray, min_size, max_size)
+
+
+def make_mode_detector(mode: str, name: str, options: Dict[str, Any]) -> FaceDetector:
+    """The detector the threads of *mode* share."""
+    if mode == "pooled":
+        return DetectorPool(name, options)
+    if mode == "locked":
+        return LockedDetector(make_detector(name, **options))
+    if mode == "shared":
+        return make_detector(name, **options)
+    raise ValueError(f"unknown mode {mode!r} (expected one of {list(MODES)})")
+
+
+def run_threads(detector: FaceDetector, jobs: Sequence[Callable[[FaceDetector], Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Runs every job in its own thread, all released at once; returns their results.
+
+    The first exception a job raised is re-raised here.
+    """
+    start = threading.Barrier(len(jobs))
+    results: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+    errors: List[BaseException] = []
+
+    def work(i: int) -> None:
+        start.wait()
+        try:
+            results[i] = jobs[i](detector)
+        except Exception as exc:  # reported by the caller
+            errors.append(exc)
+
+    threads = [threading.Thread(target=work, args=(i,), name=f"Stress-{i}") for i in range(len(jobs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def detect_all(images: Sequence[np.ndarray], reference: Sequence[List[Box]], rounds: int):
+    """A job that detects in every image *rounds* times and counts deviations from *reference*."""
+
+    def job(detector: FaceDetector) -> Dict[str, Any]:
+        times: List[float] = []
+        mismatches = 0
+        for _ in range(rounds):
+            for image, expected in zip(images, reference):
+                started = time.perf_counter()
+                boxes = detector.detect(image)
+                times.append(time.perf_counter() - started)
+                mismatches += sorted(boxes) != expected
+        return {"times": times, "mismatches": mismatches}
+
+    return job
+
+
+def stress(mode: str, name: str, options: Dict[str, Any], small: Sequence[np.ndarray],
+           full: Sequence[np.ndarray], camera_threads: int, enrol_threads: int, rounds: int) -> Dict[str, Any]:
+    """Runs the concurrent load through *mode*'s detector and scores it."""
+    reference = make_detector(name, **options)
+    small_ref = [sorted(reference.detect(image)) for image in small]
+    full_ref = [sorted(reference.detect(image)) for image in full]
+
+    detector = make_mode_detector(mode, name, options)
+    jobs = [detect_all(small, small_ref, rounds)] * camera_threads
+    jobs += [detect_all(full, full_ref, rounds)] * enrol_threads
+    wall = time.perf_counter()
+    results = run_threads(detector, jobs)
+    wall = time.perf_counter() - wall
+
+    times = np.concatenate([result["times"] for result in results])
+    return {
+        "mode": mode,
+        "detector": name,
+        "threads": len(jobs),
+        "detections": len(times),
+        "detections_per_s": round(len(times) / wall, 1),
+        "ms_per_detection": round(1000.0 * float(times.mean()), 3),
+        "p95_ms": round(1000.0 * float(np.percentile(times, 95)), 3),
+        "mismatches": sum(result["mismatches"] for result in results),
+        "instances": detector.instances if isinstance(detector, DetectorPool) else 1,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Stress concurrent face detection from several threads.")
+    parser.add_argument("clip", help="video file readable by OpenCV, ideally with faces in it")
+    parser.add_argument("--detector", default=DEFAULT_DETECTOR, choices=sorted(DETECTORS))
+    parser.add_argument("--modes", default="pooled,locked", help=f"comma-separated, of {','.join(MODES)}")
+    parser.add_argument("--camera-threads", type=int, default=2, help="threads detecting in shrunk frames")
+    parser.add_argument("--enrol-threads", type=int, default=1, help="threads detecting in full frames")
+    parser.add_argument("--scale", type=float, default=0.5, help="frame reduce factor of the camera threads")
+    parser.add_argument("--rounds", type=int, default=3, help="passes over the clip per thread")
+    parser.add_argument("--max-frames", type=int, default=60, help="frames of the clip to use")
+    parser.add_argument("--option", action="append", default=[], metavar="DETECTOR.KEY=VALUE",
+                        help="detector constructor option, e.g. haar.min_neighbors=3")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    frames = read_clip(args.clip, args.max_frames)
+    if not frames:
+        Logger(f"[ERROR] Could not read any frames from {args.clip}.")
+        return 1
+    if args.camera_threads + args.enrol_threads < 1:
+        Logger("[ERROR] Nothing to run: need at least one camera or enrolment thread.")
+        return 1
+    options = parse_options(args.option).get(args.detector, {})
+    full = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+    h, w = full[0].shape
+    size = (max(1, int(w * args.scale)), max(1, int(h * args.scale)))
+    small = [cv2.resize(gray, size) for gray in full]
+
+    results = []
+    for mode in filter(None, (m.strip() for m in args.modes.split(","))):
+        try:
+            result = stress(mode, args.detector, options, small, full,
+                            args.camera_threads, args.enrol_threads, args.rounds)
+        except (ValueError, OSError, cv2.error) as exc:
+            Logger(f"[WARN] Skipping {mode}: {exc}")
+            continue
+        results.append(result)
+        Logger(f"[INFO] {json.dumps(result)}")
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())